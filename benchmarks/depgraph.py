@@ -0,0 +1,87 @@
+"""
+Time evaluating the rtconfig and ReaperTheme files of a synthetic theme after one
+constant changes, with and without the dependency graph of the previous build. Run
+with:
+
+    python -m benchmarks.depgraph [--preset medium] [--changes 1 10]
+"""
+
+import argparse
+import contextlib
+import io
+import re
+import tempfile
+import time
+from pathlib import Path
+
+from reaper_theme_builder.lib.project import Project
+
+from .synthetic import PRESETS, generate_theme
+
+
+def evaluate(project: Project):
+    """Evaluate the rtconfig and ReaperTheme files, returns the time and the output"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        project.evaluator
+        text = "".join(project.rtconfig())
+        rpt = project.rptheme()
+        seconds = time.perf_counter() - start
+    if project.cache_dir is not None:
+        project.evaluator.save_cache()
+    return seconds, text, rpt.serialize()
+
+
+def change_constants(path: Path, count: int, seed: int):
+    """Change the first `count` colour constants"""
+    n = 0
+
+    def replace(match: re.Match):
+        nonlocal n
+        n += 1
+        if n > count:
+            return match.group(0)
+        return f"rgb({seed}, {n % 256}, 0)"
+
+    path.write_text(re.sub(r"rgb\([^)]*\)", replace, path.read_text()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--preset", choices=list(PRESETS), default="medium")
+    parser.add_argument("--changes", type=int, nargs="+", default=[1, 10])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        theme, constants = generate_theme(root, PRESETS[args.preset])
+        cache_dir = Path(root) / "cache"
+
+        def project(cached: bool):
+            return Project(
+                Path(theme),
+                constants_path=Path(constants),
+                cache_dir=cache_dir if cached else None,
+            )
+
+        # the first build records the graph, and compiles the expressions
+        evaluate(project(True))
+
+        print(f"{args.preset} theme:")
+        print(f"  {'changed constants':<20} {'full':>10} {'graph':>10}")
+        for i, count in enumerate(args.changes):
+            change_constants(Path(constants), count, i + 1)
+            graph = project(True)
+            graph_seconds, graph_text, graph_rpt = evaluate(graph)
+            full_seconds, full_text, full_rpt = evaluate(project(False))
+            assert (graph_text, graph_rpt) == (full_text, full_rpt)
+
+            invalidated = graph.evaluator.invalidated
+            print(
+                f"  {count:<20} {full_seconds:9.3f}s {graph_seconds:9.3f}s"
+                f"  {full_seconds / graph_seconds:5.1f}x"
+                f"  ({invalidated} expressions evaluated again)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Compare evaluating a large rtconfig with SimpleEval against the compiled expression
+cache, and against evaluating the expressions in a process pool. Run with:
+
+    python -m benchmarks.evaluator [--expressions 50000] [--jobs 2 4]
+"""
+
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from simpleeval import SimpleEval
+
+from reaper_theme_builder.lib.val.constants import ConstantsConfig
+from reaper_theme_builder.lib.val.evaluator import Evaluator
+from reaper_theme_builder.lib.val.formatter import split_double
+
+CONSTANTS = """\
+[colors]
+bg = rgb(30, 30, 30)
+fg = rev(0xEEEEEE)
+accent = c("colors.bg") + 0x101010
+"""
+
+TEMPLATES = [
+    '{{{{c("colors.bg")}}}}',
+    '{{{{c("colors.accent")}}}}',
+    "{{{{rgb({r}, {g}, {b})}}}}",
+    '{{{{blend("add", {frac})}}}}',
+    "{{{{{a} * 2 + {b}}}}}",
+    '{{{{set("tcp.x{a}", "{a} {b}", "+ 1 {r}", inherit=True)}}}}',
+]
+
+
+def generate_rtconfig(count: int, seed=0):
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(count):
+        template = rnd.choice(TEMPLATES)
+        expr = template.format(
+            r=rnd.randrange(8),
+            g=rnd.randrange(8),
+            b=rnd.randrange(8),
+            a=rnd.randrange(50),
+            frac=rnd.choice([0.25, 0.5, 0.75]),
+        )
+        lines.append(f"set value{i} {expr}")
+    return "\n".join(lines)
+
+
+def timed(label: str, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"  {label:<28} {time.perf_counter() - start:8.3f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--expressions", type=int, default=50_000)
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        nargs="*",
+        default=[2, 4],
+        help="numbers of processes to evaluate in parallel with",
+    )
+    args = parser.parse_args()
+
+    text = generate_rtconfig(args.expressions)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        constants_path = tmp / "constants.ini"
+        constants_path.write_text(CONSTANTS)
+        constants = ConstantsConfig(str(constants_path))
+
+        print(f"Evaluating {args.expressions} expressions:")
+
+        # the previous implementation, calling SimpleEval for every expression
+        baseline = Evaluator(constants)
+        simple_eval = SimpleEval(
+            functions=baseline._functions(), names=baseline._names()
+        )
+
+        def simple_eval_path():
+            result = []
+            for prefix, raw in split_double(text):
+                result.append(prefix)
+                if raw is not None:
+                    result.append(str(simple_eval.eval(raw)))
+            return "".join(result)
+
+        expected = timed("SimpleEval", simple_eval_path)
+
+        cache_dir = tmp / "cache"
+        cold = Evaluator(constants, cache_dir=cache_dir)
+        result = timed("compiled (cold cache)", lambda: cold.parse_double(text))
+        assert result == expected
+        cold.save_cache()
+
+        warm = Evaluator(constants, cache_dir=cache_dir)
+        result = timed("compiled (disk cache)", lambda: warm.parse_double(text))
+        assert result == expected
+
+        result = timed("compiled (in memory)", lambda: warm.parse_double(text))
+        assert result == expected
+        for name, (hits, misses) in warm.memo.stats().items():
+            print(f"    memoized {name}(): {hits} hits, {misses} misses")
+
+        # each worker process starts with an empty memory cache
+        for jobs in args.jobs:
+            parallel = Evaluator(constants, cache_dir=cache_dir)
+            result = timed(
+                f"parallel (jobs={jobs})",
+                lambda: parallel.parse_double(text, jobs=jobs),
+            )
+            assert result == expected
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Tokenize adversarial templates, like unterminated '{{' and stray braces, and compare
+the linear tokenizer against the previous regex based splitters. Run with:
+
+    python -m benchmarks.formatter [--lines 20000] [--legacy-lines 2000]
+
+The previous stream splitter scanned its whole buffer again for every chunk after an
+unterminated '{{', so it is only run on the first --legacy-lines lines.
+"""
+
+import argparse
+import re
+import time
+from string import Formatter
+from typing import Iterable
+
+from reaper_theme_builder.lib.val.formatter import (
+    split_double,
+    split_double_stream,
+    split_single,
+)
+
+LEGACY_REGEX = re.compile(r"{{((?:[^{}]|{[^{}]|}[^{}])+)}}", flags=re.DOTALL)
+
+
+def legacy_split_double(text: str):
+    last_match_end = 0
+    for match in LEGACY_REGEX.finditer(text):
+        yield text[last_match_end : match.start()], match.group(1)
+        last_match_end = match.end()
+
+    yield text[last_match_end:], None
+
+
+def legacy_split_double_stream(chunks: Iterable[str]):
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        if "}" in chunk:
+            last_match_end = 0
+            for match in LEGACY_REGEX.finditer(buffer):
+                yield buffer[last_match_end : match.start()], match.group(1)
+                last_match_end = match.end()
+            buffer = buffer[last_match_end:]
+
+        start = buffer.find("{{")
+        if start == -1:
+            start = len(buffer) - 1 if buffer.endswith("{") else len(buffer)
+
+        if start > 0:
+            yield buffer[:start], None
+            buffer = buffer[start:]
+
+    yield buffer, None
+
+
+def double_cases(lines: int):
+    """rtconfig lines with double braces, mostly adversarial"""
+    return {
+        "valid expressions": ['set x {{c("a.b") + 1}} ; comment\n'] * lines,
+        "unterminated '{{' at the top": ["{{ unterminated\n"] + ["set x } y\n"] * lines,
+        "unterminated '{{' on every line": ["set x {{ a } b\n"] * lines,
+        "stray single braces": ["{a} }b{ {c}\n"] * lines,
+        "long runs of braces": ["{{{{{{{{ }}}}}}}}\n"] * lines,
+    }
+
+
+def single_cases(count: int):
+    """ReaperTheme values with single braces"""
+    return {
+        "expressions": "{rgb(1, 2, 3)} text " * count,
+        "escaped braces": "{{a}}" * count,
+        "nested format spec": "{a:{b}{c}}" * count,
+    }
+
+
+def _merge(segments):
+    """Merge literal text yielded separately by the stream splitters"""
+    merged = []
+    literal = ""
+    for prefix, raw in segments:
+        literal += prefix
+        if raw is not None:
+            merged.append((literal, raw))
+            literal = ""
+    merged.append((literal, None))
+    return merged
+
+
+def timed(label: str, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"  {label:<40} {time.perf_counter() - start:8.3f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=20_000)
+    parser.add_argument("--legacy-lines", type=int, default=2_000)
+    args = parser.parse_args()
+
+    print(f"Double braces ({args.lines} lines):")
+    for name, lines in double_cases(args.lines).items():
+        print(f" {name}")
+        text = "".join(lines)
+        result = timed("tokenizer", lambda: list(split_double(text)))
+        expected = timed("legacy regex", lambda: list(legacy_split_double(text)))
+        assert result == expected
+
+        streamed = timed("tokenizer (stream)", lambda: list(split_double_stream(lines)))
+        assert _merge(streamed) == result
+
+        head = lines[: args.legacy_lines]
+        timed(
+            f"legacy stream (first {len(head)} lines)",
+            lambda: list(legacy_split_double_stream(head)),
+        )
+
+    fmt = Formatter()
+    print(f"Single braces ({args.lines} values):")
+    for name, text in single_cases(args.lines).items():
+        print(f" {name}")
+        result = timed("tokenizer", lambda: list(split_single(text)))
+        expected = timed(
+            "string.Formatter", lambda: [(p, k) for p, k, _, _ in fmt.parse(text)]
+        )
+        assert result == expected
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Measure how long the command line modules take to import, and check that slow
+modules aren't imported before they are needed. Run with:
+
+    python -m benchmarks.imports [--budget-ms 60] [--runs 5]
+
+Each module is imported in a fresh interpreter with `-X importtime`, the time is the
+best of several runs. Exits with status 1 if any module is over the budget, or imports
+one of the modules that should only be loaded by the commands that use them.
+"""
+
+import argparse
+import subprocess
+import sys
+
+# the modules run for each command before any work is done
+MODULES = [
+    "reaper_theme_builder",
+    "reaper_theme_builder.check",
+    "reaper_theme_builder.lib.check",
+]
+
+# modules that are slow to import, and only needed by some commands
+SLOW = ["asyncio", "ctypes", "multiprocessing", "numpy", "PIL", "zipfile"]
+
+
+def measure(module: str):
+    """Import a module in a new interpreter, returns the time and imported modules"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    total = 0
+    imported = set()
+    for line in result.stderr.splitlines():
+        # lines look like "import time: <self us> | <cumulative us> | <module>"
+        if not line.startswith("import time:"):
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            # the header line
+            continue
+        total += int(self_us)
+        imported.add(name.strip())
+
+    return total / 1000, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--budget-ms", type=float, default=60)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    for module in MODULES:
+        times = []
+        imported = set()
+        for _ in range(args.runs):
+            ms, imported = measure(module)
+            times.append(ms)
+
+        best = min(times)
+        slow = sorted(
+            name
+            for name in imported
+            if any(name == s or name.startswith(f"{s}.") for s in SLOW)
+        )
+        status = "ok"
+        if best > args.budget_ms:
+            status = f"over budget of {args.budget_ms:.0f}ms"
+            failed = True
+        if len(slow) > 0:
+            status = f"imports {', '.join(slow)}"
+            failed = True
+        print(f"{module:<36} {best:>7.1f}ms  {status}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
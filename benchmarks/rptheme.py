@@ -0,0 +1,131 @@
+"""
+Merge, process and serialize large ReaperTheme files, and compare the ReaperTheme
+store against the previous ConfigParser based path. Run with:
+
+    python -m benchmarks.rptheme [--keys 5000] [--files 3] [--expressions 0.1]
+
+Most values in a real ReaperTheme are plain numbers, --expressions sets the fraction
+of values that contain an expression.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from configparser import ConfigParser
+from io import StringIO
+from typing import Callable
+
+from reaper_theme_builder.lib import rptheme
+from reaper_theme_builder.lib.val.constants import ConstantsConfig
+from reaper_theme_builder.lib.val.evaluator import Evaluator
+
+from .synthetic import COLOR_EXPRESSIONS, PRESETS, _expression, generate_constants
+
+
+def legacy_from_paths(paths: list[str]):
+    config = ConfigParser()
+    for p in paths:
+        config.read(p)
+    return config
+
+
+def legacy_process(config: ConfigParser, parse: Callable[[str], str]):
+    cache: dict[str, str] = {}
+    for section in config:
+        for key in config[section]:
+            raw = config[section][key]
+            if raw not in cache:
+                cache[raw] = parse(raw)
+            config[section][key] = cache[raw]
+
+
+def legacy_serialize(config: ConfigParser):
+    with StringIO() as f:
+        config.write(f, space_around_delimiters=False)
+        return f.getvalue()
+
+
+def generate_files(root, keys: int, files: int, expressions: float):
+    """
+    Create ReaperTheme files, each later file overrides a part of the keys of the
+    first one. Returns the paths.
+    """
+    rnd = random.Random(0)
+    size = PRESETS["small"]
+    paths = []
+    for n in range(files):
+        path = os.path.join(root, f"part{n}.ReaperTheme")
+        count = keys if n == 0 else keys // 10
+        with open(path, "w", encoding="utf8") as f:
+            f.write("[color theme]\n")
+            for i in rnd.sample(range(keys), count) if n > 0 else range(keys):
+                if rnd.random() < expressions:
+                    value = f"{{{_expression(rnd, size, COLOR_EXPRESSIONS)}}}"
+                else:
+                    value = str(rnd.randrange(0x1000000))
+                f.write(f"Col_Key_{i}={value}\n")
+            f.write("[REAPER]\nui_img=Default\n")
+        paths.append(path)
+    return paths
+
+
+def best(func, runs=5):
+    """The best time of several runs, and the last result"""
+    times = []
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=5000)
+    parser.add_argument("--files", type=int, default=3)
+    parser.add_argument("--expressions", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        paths = generate_files(root, args.keys, args.files, args.expressions)
+        constants = os.path.join(root, "constants.ini")
+        generate_constants(constants, PRESETS["small"])
+        evaluator = Evaluator(ConstantsConfig(constants))
+
+        old_rpt = legacy_from_paths(paths)
+        new_rpt = rptheme.from_paths(paths)
+
+        legacy = {
+            "merge": lambda: legacy_from_paths(paths),
+            "merge + process": lambda: legacy_process(
+                legacy_from_paths(paths), evaluator.parse_single
+            ),
+            "serialize": lambda: legacy_serialize(old_rpt),
+        }
+        current = {
+            "merge": lambda: rptheme.from_paths(paths),
+            "merge + process": lambda: rptheme.process(
+                rptheme.from_paths(paths), evaluator.parse_single
+            ),
+            "serialize": new_rpt.serialize,
+        }
+
+        print(f"{args.files} files, {args.keys} keys:")
+        print(f"  {'stage':<20} {'ConfigParser':>12} {'ReaperTheme':>12}")
+        for stage in legacy:
+            old, _ = best(legacy[stage])
+            new, _ = best(current[stage])
+            print(f"  {stage:<20} {old:11.4f}s {new:11.4f}s  {old / new:5.1f}x")
+
+        # both paths give the same values, apart from the case of keys
+        legacy_process(old_rpt, evaluator.parse_single)
+        rptheme.process(new_rpt, evaluator.parse_single)
+        expected = legacy_serialize(old_rpt)
+        assert new_rpt.serialize().replace("Col_Key", "col_key") == expected
+
+
+if __name__ == "__main__":
+    main()
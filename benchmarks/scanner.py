@@ -0,0 +1,128 @@
+"""
+Scan a large synthetic theme folder and compare the flat index scanner against the
+previous recursive scanner. Run with:
+
+    python -m benchmarks.scanner [--datadirs 50] [--files 700]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from reaper_theme_builder.lib.scanner import DirInfo, is_rptheme, is_rtconfig
+
+
+class LegacyDirInfo:
+    """The previous scanner: one recursive scan per folder, O(n^2) queues"""
+
+    def __init__(self, path) -> None:
+        self._path = os.path.abspath(path)
+        self._files: list[str] = []
+        self._datafiles: list[str] = []
+        self._subdirs: list[LegacyDirInfo] = []
+
+    @classmethod
+    def scan(cls, path):
+        info = cls(path)
+        dirpaths = []
+        for entry in os.scandir(path):
+            if entry.is_dir():
+                dirpaths.append(entry.path)
+            elif is_rtconfig(entry.path) or is_rptheme(entry.path):
+                info._datafiles.append(entry.name)
+            elif entry.name.lower().endswith(".png"):
+                info._files.append(entry.name)
+        info._files.sort()
+        info._datafiles.sort()
+        for path in dirpaths:
+            info._subdirs.append(cls.scan(path))
+        return info
+
+    def datadirs(self):
+        datadirs = []
+        to_check = [self]
+        while len(to_check) > 0:
+            info = to_check.pop(0)
+            to_check.extend(info._subdirs)
+            if len(info._datafiles) > 0:
+                datadirs.append(info)
+        return datadirs
+
+    def partial_filemap(self):
+        files = [os.path.join(self._path, f) for f in self._files]
+        checkdirs = [d for d in self._subdirs if len(d._datafiles) == 0]
+        while len(checkdirs) > 0:
+            subdir = checkdirs.pop(0)
+            files.extend([os.path.join(subdir._path, f) for f in subdir._files])
+            checkdirs.extend([d for d in subdir._subdirs if len(d._datafiles) == 0])
+        return [(f, os.path.relpath(f, self._path)) for f in files]
+
+    def filemap(self):
+        return [x for info in self.datadirs() for x in info.partial_filemap()]
+
+
+def generate_tree(root, datadirs: int, files: int):
+    """Create datadirs with a rtconfig and PNGs at 100%, 150% and 200%"""
+    count = 0
+    for i in range(datadirs):
+        datadir = os.path.join(root, f"part{i:03}")
+        with open(os.path.join(datadir + "_rtconfig.txt"), "w") as f:
+            pass
+        for scale in ("", "150", "200"):
+            folder = os.path.join(datadir, scale)
+            os.makedirs(folder, exist_ok=True)
+            for j in range(files // 3):
+                open(os.path.join(folder, f"image_{j:04}.png"), "wb").close()
+                count += 1
+        open(os.path.join(datadir, "rtconfig.txt"), "w").close()
+        count += 1
+
+    # backdate the folders, so they aren't considered too new to trust by snapshots
+    an_hour_ago = time.time() - 3600
+    for dirpath, _, _ in os.walk(root):
+        os.utime(dirpath, (an_hour_ago, an_hour_ago))
+
+    return count
+
+
+def timed(label: str, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"  {label:<36} {time.perf_counter() - start:8.3f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--datadirs", type=int, default=50)
+    parser.add_argument("--files", type=int, default=2100, help="files per datadir")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as cache_dir:
+        count = generate_tree(root, args.datadirs, args.files)
+        print(f"Scanning {count} files in {args.datadirs} datadirs:")
+
+        legacy = timed("legacy scan + filemap", lambda: LegacyDirInfo.scan(root).filemap())
+        expected = sorted(legacy)
+
+        for jobs in (None, 8):
+            label = f"index scan + filemap (jobs={jobs})"
+            result = timed(label, lambda: DirInfo.scan(root, jobs=jobs).filemap())
+            assert sorted(result) == expected
+
+        info = DirInfo.scan(root)
+        timed("index filemap only", info.filemap)
+        timed("index rtconfig_paths only", info.rtconfig_paths)
+
+        snapshot = os.path.join(cache_dir, "snapshot.bin")
+        timed("save snapshot", lambda: info.save_snapshot(snapshot))
+        result = timed(
+            "index scan from snapshot", lambda: DirInfo.scan(root, snapshot=snapshot)
+        )
+        assert result.reused == len(result._listings)
+        assert sorted(result.filemap()) == expected
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+Time each stage of a build on a synthetic theme, and compare the results against a
+stored baseline. Run with:
+
+    python -m benchmarks.suite --preset small --compare benchmarks/baselines/small.json
+    python -m benchmarks.suite --preset small --save benchmarks/baselines/small.json
+
+Timings are the best of several runs. Peak memory is measured in a separate run with
+tracemalloc, as tracing slows everything down. Baselines also store the time taken by
+a fixed calibration workload, so timings from a faster or slower machine are scaled
+before they are compared.
+
+Exits with status 1 if any stage is slower (or uses more memory) than the baseline
+by more than the threshold. Very fast stages are too noisy to compare, so slowdowns
+of less than --min-seconds are ignored, and so is memory growth of less than
+--min-bytes, which is mostly the allocator and the threads of the stage.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+from reaper_theme_builder.lib import rptheme, rtconfig
+from reaper_theme_builder.lib.project import Project
+from reaper_theme_builder.lib.scanner import DirInfo
+from reaper_theme_builder.lib.theme import Resource, create_theme
+from reaper_theme_builder.lib.val.constants import ConstantsConfig
+from reaper_theme_builder.lib.val.evaluator import Evaluator
+from reaper_theme_builder.lib.val.formatter import split_double
+
+from .synthetic import PRESETS, ThemeSize, generate_theme
+
+BASELINE_VERSION = 1
+
+
+def calibrate():
+    """Time a fixed pure Python workload, used to compare machines"""
+    start = time.perf_counter()
+    total = 0
+    for i in range(2_000_000):
+        total += i % 7
+    text = ",".join(str(i) for i in range(200_000))
+    text.split(",")
+    return time.perf_counter() - start
+
+
+class Stages:
+    """The stages of a build, each stage may use the results of the previous ones"""
+
+    def __init__(self, root: Path, theme: str, constants: str) -> None:
+        self.root = root
+        self.theme = theme
+        self.constants = constants
+
+    def scan(self):
+        self.dirinfo = DirInfo.scan(self.theme)
+
+    def filemap(self):
+        self.files = self.dirinfo.filemap()
+
+    def read_rtconfig(self):
+        self.text = rtconfig.from_paths(self.dirinfo.rtconfig_paths())
+
+    def split_double(self):
+        for _ in split_double(self.text):
+            pass
+
+    def constants_table(self):
+        self.evaluator = Evaluator(ConstantsConfig(self.constants))
+
+    def parse_double_cold(self):
+        # a new evaluator, so every expression is compiled again
+        evaluator = Evaluator(ConstantsConfig(self.constants))
+        evaluator.parse_double(self.text)
+
+    def parse_double_warm(self):
+        self.evaluator.parse_double(self.text)
+
+    def rptheme(self):
+        rpt = rptheme.from_paths(self.dirinfo.rptheme_paths())
+        rptheme.process(rpt, self.evaluator.parse_single)
+        self.rpt = rpt
+
+    def create_theme(self):
+        create_theme(
+            self.root / "stage.ReaperThemeZip",
+            rtconfig=self.text,
+            rptheme=self.rpt,
+            resources=[Resource(Path(src), Path(dst)) for src, dst in self.files],
+        )
+
+    def full_build(self):
+        project = Project(Path(self.theme), constants_path=Path(self.constants))
+        with contextlib.redirect_stdout(io.StringIO()):
+            project.build(self.root / "full.ReaperThemeZip")
+
+    def all(self) -> list[tuple[str, Callable[[], None]]]:
+        return [
+            ("scan", self.scan),
+            ("filemap", self.filemap),
+            ("read_rtconfig", self.read_rtconfig),
+            ("split_double", self.split_double),
+            ("constants_table", self.constants_table),
+            ("parse_double_cold", self.parse_double_cold),
+            ("parse_double_warm", self.parse_double_warm),
+            ("rptheme", self.rptheme),
+            ("create_theme", self.create_theme),
+            ("full_build", self.full_build),
+        ]
+
+
+def run(size: ThemeSize, repeat: int, seed: int):
+    """Run every stage, returns a map from stage names to seconds and peak bytes"""
+    results: dict[str, dict[str, float]] = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        theme, constants = generate_theme(tmp, size, seed)
+        stages = Stages(Path(tmp), theme, constants)
+
+        for name, stage in stages.all():
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                stage()
+                times.append(time.perf_counter() - start)
+
+            tracemalloc.start()
+            stage()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results[name] = {"seconds": min(times), "peak_bytes": peak}
+            print(f"  {name:<20} {min(times):8.3f}s {peak / 1024 / 1024:9.1f} MB")
+
+    return results
+
+
+def compare(
+    results: dict,
+    calibration: float,
+    baseline: dict,
+    threshold: float,
+    min_seconds: float,
+    min_bytes: int,
+):
+    """Print a comparison against a baseline, returns the names of regressed stages"""
+    scale = calibration / baseline["calibration"]
+    print(f"Comparing against baseline (machine speed ratio: {scale:.2f})")
+
+    regressed = []
+    for name, result in results.items():
+        old = baseline["stages"].get(name)
+        if old is None:
+            print(f"  {name:<20} (not in baseline)")
+            continue
+
+        expected = old["seconds"] * scale
+        time_ratio = result["seconds"] / expected
+        memory_ratio = result["peak_bytes"] / max(old["peak_bytes"], 1)
+
+        slower = time_ratio > 1 + threshold
+        if result["seconds"] - expected < min_seconds:
+            slower = False
+        larger = memory_ratio > 1 + threshold
+        if result["peak_bytes"] - old["peak_bytes"] < min_bytes:
+            larger = False
+        failed = slower or larger
+        if failed:
+            regressed.append(name)
+
+        status = "REGRESSED" if failed else "ok"
+        ratios = f"time {time_ratio:6.2f}x  memory {memory_ratio:6.2f}x"
+        print(f"  {name:<20} {ratios}  {status}")
+
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="medium")
+    parser.add_argument("--dirs", type=int, help="number of datadirs")
+    parser.add_argument("--pngs", type=int, help="number of PNGs per folder")
+    parser.add_argument("--lines", type=int, help="number of rtconfig lines per dir")
+    parser.add_argument("--density", type=float, help="fraction of lines with {{ }}")
+    parser.add_argument("--constants", type=int, help="number of constants")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", type=Path, help="baseline to compare against")
+    parser.add_argument("--save", type=Path, help="save the results as a baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="allowed slowdown before a stage is a regression, default 0.25 (25%%)",
+    )
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=0.02,
+        help="ignore slowdowns smaller than this, default 0.02",
+    )
+    parser.add_argument(
+        "--min-bytes",
+        type=int,
+        default=512 * 1024,
+        help="ignore peak memory growth smaller than this, default 524288 (512 KiB)",
+    )
+    args = parser.parse_args()
+
+    size = PRESETS[args.preset]
+    overrides = {
+        k: getattr(args, k)
+        for k in ("dirs", "pngs", "lines", "density", "constants")
+        if getattr(args, k) is not None
+    }
+    size = size._replace(**overrides)
+
+    calibration = calibrate()
+    print(f"Benchmarking {args.preset} theme: {size}")
+    results = run(size, args.repeat, args.seed)
+
+    if args.save is not None:
+        data = {
+            "version": BASELINE_VERSION,
+            "preset": args.preset,
+            "size": size._asdict(),
+            "python": platform.python_version(),
+            "calibration": calibration,
+            "stages": results,
+        }
+        with open(args.save, "w", encoding="utf8") as f:
+            json.dump(data, f, indent=2)
+            f.write("\n")
+        print(f"Saved baseline to {args.save}")
+
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf8") as f:
+            baseline = json.load(f)
+
+        if baseline.get("version") != BASELINE_VERSION:
+            raise ValueError(f"Unsupported baseline version: {baseline.get('version')}")
+        if baseline["size"] != size._asdict():
+            raise ValueError(
+                "The baseline was recorded with a different theme size, use the same"
+                " preset and overrides"
+            )
+
+        regressed = compare(
+            results,
+            calibration,
+            baseline,
+            args.threshold,
+            args.min_seconds,
+            args.min_bytes,
+        )
+        if len(regressed) > 0:
+            print(f"Regressed stages: {', '.join(regressed)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
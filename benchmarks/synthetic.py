@@ -0,0 +1,158 @@
+"""
+Generate synthetic themes for benchmarking. Every theme generated with the same
+parameters and seed is identical.
+"""
+
+import os
+import random
+import struct
+import zlib
+from typing import NamedTuple
+
+
+class ThemeSize(NamedTuple):
+    # number of datadirs, each with its own rtconfig and 150/200 folders
+    dirs: int
+    # number of PNGs in each folder
+    pngs: int
+    # number of rtconfig lines in each datadir
+    lines: int
+    # fraction of rtconfig lines containing an expression
+    density: float
+    # number of constants
+    constants: int
+    # number of ReaperTheme colour values
+    colors: int
+
+
+PRESETS = {
+    "small": ThemeSize(
+        dirs=4, pngs=50, lines=2_000, density=0.3, constants=50, colors=200
+    ),
+    "medium": ThemeSize(
+        dirs=20, pngs=200, lines=10_000, density=0.3, constants=500, colors=800
+    ),
+    "large": ThemeSize(
+        dirs=50, pngs=700, lines=40_000, density=0.5, constants=2_000, colors=1_500
+    ),
+}
+
+# expressions used in rtconfig files
+EXPRESSIONS = [
+    'c("{const}")',
+    "rgb({r}, {g}, {b})",
+    'blend("add", {frac})',
+    "{a} * 2 + {b}",
+    '{a} + c("{const}")',
+    'set("tcp.x{a}", "{a} {b}", "+ 1 {r}", inherit=True)',
+]
+
+# expressions used in ReaperTheme files
+COLOR_EXPRESSIONS = [
+    'c("{const}")',
+    "rgb({r}, {g}, {b})",
+    'blend("add", {frac})',
+]
+
+
+def png(width: int, height: int, rnd: random.Random):
+    """A noisy RGBA PNG, which compresses about as well as real theme images"""
+    rows = []
+    for _ in range(height):
+        row = bytes(rnd.randrange(4) * 60 for _ in range(width * 4))
+        rows.append(b"\x00" + row)
+
+    def chunk(kind: bytes, data: bytes):
+        crc = zlib.crc32(kind + data)
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(b"".join(rows)))
+        + chunk(b"IEND", b"")
+    )
+
+
+def _constant_name(i: int):
+    return f"section{i % 10}.const{i}"
+
+
+def _expression(rnd: random.Random, size: ThemeSize, templates=EXPRESSIONS):
+    template = rnd.choice(templates)
+    return template.format(
+        const=_constant_name(rnd.randrange(size.constants)),
+        r=rnd.randrange(256),
+        g=rnd.randrange(256),
+        b=rnd.randrange(256),
+        a=rnd.randrange(100),
+        frac=rnd.choice([0.25, 0.5, 0.75]),
+    )
+
+
+def generate_constants(path, size: ThemeSize, seed=0):
+    rnd = random.Random(seed)
+    sections: dict[str, list[str]] = {}
+    for i in range(size.constants):
+        section, name = _constant_name(i).split(".")
+        if i > 0 and rnd.random() < 0.3:
+            # refer to an earlier constant
+            value = f'c("{_constant_name(rnd.randrange(i))}") + {rnd.randrange(10)}'
+        else:
+            r, g, b = rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)
+            value = f"rgb({r}, {g}, {b})"
+        sections.setdefault(section, []).append(f"{name} = {value}")
+
+    with open(path, "w", encoding="utf8") as f:
+        for section, lines in sections.items():
+            f.write(f"[{section}]\n")
+            f.write("\n".join(lines))
+            f.write("\n\n")
+
+
+def generate_rtconfig(size: ThemeSize, rnd: random.Random):
+    lines = []
+    for i in range(size.lines):
+        if rnd.random() < size.density:
+            lines.append(f"set value{i} {{{{{_expression(rnd, size)}}}}} ; comment")
+        elif i % 10 == 0:
+            lines.append(f"; section {i}")
+        else:
+            lines.append(f"set value{i} {rnd.randrange(1000)} {rnd.randrange(1000)}")
+    return "\n".join(lines) + "\n"
+
+
+def generate_theme(root, size: ThemeSize, seed=0):
+    """
+    Create a theme folder and a constants file in `root`, returns the paths to the
+    theme folder and the constants file.
+    """
+    rnd = random.Random(seed)
+    theme = os.path.join(root, "theme")
+    constants = os.path.join(root, "constants.ini")
+    generate_constants(constants, size, seed)
+
+    # a few distinct images are enough, the contents don't matter for timing
+    images = [png(16 + i, 16, rnd) for i in range(8)]
+
+    for d in range(size.dirs):
+        datadir = theme if d == 0 else os.path.join(theme, f"part{d:03}")
+        for folder in ("", "150", "200"):
+            path = os.path.join(datadir, folder)
+            os.makedirs(path, exist_ok=True)
+            for i in range(size.pngs):
+                name = f"part{d:03}_image{i:04}.png"
+                with open(os.path.join(path, name), "wb") as f:
+                    f.write(images[i % len(images)])
+
+        with open(os.path.join(datadir, "rtconfig.txt"), "w", encoding="utf8") as f:
+            f.write(generate_rtconfig(size, rnd))
+
+    with open(os.path.join(theme, "Default.ReaperTheme"), "w", encoding="utf8") as f:
+        f.write("[color theme]\n")
+        for i in range(size.colors):
+            f.write(f"col_{i}={{{_expression(rnd, size, COLOR_EXPRESSIONS)}}}\n")
+        f.write("[REAPER]\nui_img=Default\n")
+
+    return theme, constants
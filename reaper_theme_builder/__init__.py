@@ -1,17 +1,26 @@
 import argparse
+import contextlib
 import os
+import sys
 from pathlib import Path
 
-from .lib import rptheme, rtconfig
-from .lib.scanner import DirInfo
-from .lib.theme import Resource, create_theme
-from .lib.utils import get_config_section_and_key
-from .lib.val.constants import ConstantsConfig
-from .lib.val.evaluator import Evaluator
-
-parser = argparse.ArgumentParser()
+parser = argparse.ArgumentParser(
+    epilog="other commands: 'rtb matrix THEMES.toml' builds many variants at once,"
+    " 'rtb serve' runs a build server that keeps themes in memory between builds,"
+    " 'rtb check INPUT' reports errors in a theme without building it,"
+    " 'rtb import THEMES... -o OUTPUT' imports existing themes into source folders,"
+    " 'rtb cache --max-age DAYS' removes cached resources that are no longer used",
+)
 parser.add_argument("input", type=Path)
-parser.add_argument("output", type=Path)
+parser.add_argument(
+    "output",
+    help="path to the .ReaperThemeZip file to create, or '-' to write it to stdout",
+    type=Path,
+)
+parser.add_argument(
+    "--name",
+    help="theme name to use when writing to stdout, defaults to the name of the input folder",
+)
 parser.add_argument(
     "-c",
     "--config",
@@ -31,7 +40,7 @@ parser.add_argument(
 parser.add_argument(
     "-m",
     "--minify",
-    help="strip comments and whitespace from the output rtconfig file",
+    help="strip comments and whitespace from the output rtconfig file, and optimize its WALTER code (the whole processed rtconfig is held in memory to optimize it, instead of being streamed into the archive)",
     action="store_true",
 )
 parser.add_argument(
@@ -40,12 +49,92 @@ parser.add_argument(
     help='path to an ini file defining constants, use constants with the syntax: c("section.name_of_your_constant")',
     type=Path,
 )
+parser.add_argument(
+    "--functions",
+    metavar="PATH",
+    help="path to a Python file of extra functions for expressions, registered with register_func, only imported when one of them is used",
+    default=[],
+    action="append",
+    type=Path,
+)
+parser.add_argument(
+    "--palette",
+    help="path to a palette spec, to recolour the ReaperTheme colours (requires NumPy)",
+    type=Path,
+)
+parser.add_argument(
+    "--transforms",
+    help="path to a transform spec, to generate scaled, tinted or re-encoded images (requires Pillow)",
+    type=Path,
+)
+parser.add_argument(
+    "--optimize-png",
+    help="losslessly shrink PNG resources by dropping metadata and compressing them again, results are cached",
+    action="store_true",
+)
 parser.add_argument(
     "-all",
     "--all-resources",
     help="add all files found in the source folder to the theme, instead of only adding .png files",
     action="store_true",
 )
+parser.add_argument(
+    "--reproducible",
+    help="write the same bytes for the same inputs (fixed timestamps and permissions, sorted entries) with a digest of the inputs in the Zip comment, and skip the build if the existing output has the same digest",
+    action="store_true",
+)
+parser.add_argument(
+    "-i",
+    "--incremental",
+    help="reuse unchanged resources from the existing output file, a build manifest is stored alongside the output Zip file",
+    action="store_true",
+)
+parser.add_argument(
+    "--compress",
+    metavar="ext=method",
+    help="compression method for resources with the given extension, one of 'store', 'deflate', 'deflate:LEVEL', 'best' or 'best:LEVEL' ('best' keeps whichever of store/deflate is smaller), use '*' as the extension to set the default",
+    default=[],
+    action="append",
+)
+parser.add_argument(
+    "-j",
+    "--jobs",
+    help="number of threads to use when scanning folders and compressing resources",
+    type=int,
+)
+parser.add_argument(
+    "--eval-jobs",
+    metavar="N",
+    help="number of processes to evaluate rtconfig expressions in, only worth it for very large themes (default: 1)",
+    type=int,
+)
+parser.add_argument(
+    "--cache-dir",
+    help="folder to store caches between runs in, defaults to the user's cache folder",
+    type=Path,
+)
+parser.add_argument(
+    "--no-cache",
+    help="don't read or write caches between runs",
+    action="store_true",
+)
+parser.add_argument(
+    "--timings",
+    help="print the time taken by each stage of the build, and the slowest expressions",
+    action="store_true",
+)
+parser.add_argument(
+    "--profile-json",
+    metavar="PATH",
+    help="write the time taken by each stage and expression to a JSON file",
+    type=Path,
+)
+parser.add_argument(
+    "-w",
+    "--watch",
+    help="keep running and rebuild the theme whenever the source folder changes",
+    action="store_true",
+)
 parser.add_argument(
     "-v",
     "--verbose",
@@ -68,76 +157,178 @@ def parse_extra_reapertheme_configs(args: list[list[str]]):
     return result
 
 
+def _run_command(argv: list[str]):
+    """Run a subcommand like 'rtb matrix ...', returns False if there is none"""
+    if len(argv) == 0:
+        return False
+
+    if argv[0] == "matrix":
+        from . import matrix
+
+        matrix.main(argv[1:])
+        return True
+
+    if argv[0] == "serve":
+        from . import serve
+
+        serve.main(argv[1:])
+        return True
+
+    if argv[0] == "check":
+        from . import check
+
+        check.main(argv[1:])
+        return True
+
+    if argv[0] == "import":
+        from . import importer
+
+        importer.main(argv[1:])
+        return True
+
+    if argv[0] == "cache":
+        from . import cache
+
+        cache.main(argv[1:])
+        return True
+
+    return False
+
+
 def main():
-    args = parser.parse_args()
+    if _run_command(sys.argv[1:]):
+        return
 
-    def log(*x):
-        if not args.verbose:
-            return
+    args = parser.parse_args()
 
-        print(*x)
+    # the build modules are only imported after the arguments are parsed, so '--help'
+    # and invalid arguments return straight away
+    from .lib.cache import default_cache_dir
+    from .lib.compress import CompressionPolicy
+    from .lib.manifest import BuildManifest
+    from .lib.project import Project
+    from .lib.timings import Timings
 
-    # convert to absolute path to ensure we can get the directory name
-    input_dir: Path = args.input.absolute().resolve()
     output_file: Path = args.output
+    to_stdout = str(output_file) == "-"
+    stdout = sys.stdout.buffer
 
     # validation
-    if output_file.suffix.lower() != ".reaperthemezip":
+    if to_stdout:
+        for flag, name in (
+            (args.watch, "--watch"),
+            (args.incremental, "--incremental"),
+            (args.debug, "--debug"),
+        ):
+            if flag:
+                raise ValueError(f"{name} can't be used when writing to stdout")
+    elif output_file.suffix.lower() != ".reaperthemezip":
         raise ValueError("Output extension must be .ReaperThemeZip")
 
-    print(f"Scanning folder: {input_dir}")
-
-    # scan and build list of files
-    dirinfo = DirInfo.scan(input_dir, png_only=not args.all_resources)
-
-    # construct initial config and stuff
-    print(f"Adding {len(dirinfo.filemap())} resources...")
-    res: list[Resource] = []
-    for src, dst in dirinfo.filemap():
-        res.append(Resource(Path(src), Path(dst)))
-        log(f"  [{dst}]: {src}")
-
-    print(f"Merging {len(dirinfo.rtconfig_paths())} *.rtconfig files...")
-    for path in dirinfo.rtconfig_paths():
-        log(f"  {path}")
-    rtc = rtconfig.from_paths(dirinfo.rtconfig_paths(), minify=args.minify)
-
-    print(f"Merging {len(dirinfo.rptheme_paths())} *.ReaperTheme files...")
-    for path in dirinfo.rptheme_paths():
-        log(f"  {path}")
-    rpt = rptheme.from_paths(dirinfo.rptheme_paths())
-
-    # assign extra configs from the command line
-    for fullname, value in args.config:
-        section, key = get_config_section_and_key(rpt, fullname)
-        rpt[section][key] = value
-
-    # post-process
-    print("Post processing rtconfig and ReaperTheme...")
-    constants = ConstantsConfig(args.constants_path)
-    log(f"  Loaded {len(constants)} constants")
-    evaluator = Evaluator(constants=constants)
-    # proces rtconfig
-    rtc = evaluator.parse_double(rtc)
-    # process ReaperTheme
-    for section in rpt:
-        for key in rpt[section]:
-            rpt[section][key] = evaluator.parse_single(rpt[section][key])
-
-    print(f"Writing ZIP file to {args.output}")
-
-    create_theme(output_file, rtconfig=rtc, rptheme=rpt, resources=res)
-
-    if args.debug:
-        rtc_path = output_file.with_suffix(".rtconfig.txt")
-        print(f"  [rtconfig] {rtc_path}")
-        with open(rtc_path, "w", encoding="utf8") as f:
-            f.write(rtc)
-
-        rpt_path = output_file.with_suffix(".ReaperTheme")
-        print(f"  [ReaperTheme] {rpt_path}")
-        # serialise the rptheme ConfigParser into string
-        with open(rpt_path, "w", encoding="utf8") as f:
-            rpt.write(f, space_around_delimiters=False)
-
-    print("Success!")
+    project = Project(
+        args.input,
+        png_only=not args.all_resources,
+        minify=args.minify,
+        constants_path=args.constants_path,
+        function_paths=args.functions,
+        palette_path=args.palette,
+        transforms_path=args.transforms,
+        optimize_png=args.optimize_png,
+        configs=args.config,
+        policy=CompressionPolicy.parse(args.compress),
+        jobs=args.jobs,
+        eval_jobs=args.eval_jobs,
+        cache_dir=None if args.no_cache else (args.cache_dir or default_cache_dir()),
+        reproducible=args.reproducible,
+        warm=args.watch,
+        verbose=args.verbose,
+    )
+
+    manifest_path = output_file.with_suffix(".manifest.json")
+    if args.incremental:
+        project.manifest = BuildManifest.load(manifest_path)
+    elif args.watch:
+        # rebuilds will reuse resources from the previous build in memory
+        project.manifest = BuildManifest()
+
+    def build():
+        if args.timings or args.profile_json is not None:
+            project.timings = Timings()
+
+        if to_stdout:
+            report = project.build(stdout, name=args.name)
+        else:
+            report = project.build(output_file, debug=args.debug)
+        if report is None:
+            # the output was built from the same inputs, and was left as it is
+            return
+
+        if args.incremental:
+            print(f"  Reused {report.reused} unchanged resources")
+            project.manifest.save(manifest_path)
+
+        if project.timings is not None:
+            if args.timings:
+                print(project.timings.format())
+            if args.profile_json is not None:
+                project.timings.save(args.profile_json)
+
+        print("Success!")
+
+    if to_stdout:
+        # the archive is written to stdout, so print everything else to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            build()
+        stdout.flush()
+        return
+
+    build()
+
+    if not args.watch:
+        return
+
+    # files written by the build itself must not trigger another build
+    outputs = {
+        os.path.abspath(p)
+        for p in (
+            output_file,
+            output_file.with_name(f"{output_file.name}.tmp"),
+            manifest_path,
+            args.profile_json,
+            output_file.with_suffix(".rtconfig.txt"),
+            output_file.with_suffix(".ReaperTheme"),
+        )
+        if p is not None
+    }
+
+    extra_files = [
+        p
+        for p in (args.constants_path, *args.functions, args.palette, args.transforms)
+        if p is not None
+    ]
+    from .lib.watch import create_watcher
+
+    watcher = create_watcher(project.input_dir, extra_files)
+    print("Watching for changes, press Ctrl+C to stop...")
+
+    try:
+        while True:
+            changed = watcher.wait() - outputs
+            if not project.update(changed):
+                continue
+
+            print()
+            for path in sorted(changed):
+                project.log(f"Changed: {path}")
+
+            try:
+                build()
+            except Exception:
+                import traceback
+
+                # keep watching, the error may be fixed in the next save
+                traceback.print_exc()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
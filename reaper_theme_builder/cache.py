@@ -0,0 +1,55 @@
+import argparse
+import sys
+from pathlib import Path
+
+parser = argparse.ArgumentParser(
+    prog="rtb cache",
+    description="Show the size of the caches of generated resources, and remove files"
+    " that are no longer used",
+)
+parser.add_argument(
+    "--cache-dir",
+    help="the cache folder, defaults to the user's cache folder",
+    type=Path,
+)
+parser.add_argument(
+    "--max-age",
+    metavar="DAYS",
+    help="remove generated resources that weren't used for this many days",
+    type=float,
+)
+parser.add_argument(
+    "--max-size",
+    metavar="MB",
+    help="remove the least recently used resources until each cache holds at most"
+    " this many megabytes",
+    type=float,
+)
+parser.add_argument(
+    "--clear",
+    help="remove every generated resource",
+    action="store_true",
+)
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+
+    from .lib.cache import RESOURCE_CACHES, default_cache_dir, prune
+
+    cache_dir = args.cache_dir or default_cache_dir()
+    max_age = None if args.max_age is None else args.max_age * 24 * 60 * 60
+    max_bytes = None if args.max_size is None else int(args.max_size * 1024 * 1024)
+    if args.clear:
+        max_bytes = 0
+
+    for name in RESOURCE_CACHES:
+        stats = prune(cache_dir / name, max_age=max_age, max_bytes=max_bytes)
+        folder = cache_dir / name
+        line = f"{folder}: {stats.files} files, {stats.bytes / 1024 / 1024:.1f} MB"
+        if max_age is not None or max_bytes is not None:
+            line += (
+                f", removed {stats.removed_files} files"
+                f" ({stats.removed_bytes / 1024 / 1024:.1f} MB)"
+            )
+        print(line, file=sys.stderr)
@@ -0,0 +1,63 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+parser = argparse.ArgumentParser(
+    prog="rtb check",
+    description="Evaluate every expression of a theme and report all errors, without"
+    " building it",
+)
+parser.add_argument("input", help="the theme source folder", type=Path)
+parser.add_argument(
+    "-p",
+    "--constants-path",
+    help="path to an ini file defining constants",
+    type=Path,
+)
+parser.add_argument(
+    "--functions",
+    metavar="PATH",
+    help="path to a Python file of extra functions for expressions",
+    default=[],
+    action="append",
+    type=Path,
+)
+parser.add_argument(
+    "--cache-dir",
+    help="folder to store caches between runs in, defaults to the user's cache folder",
+    type=Path,
+)
+parser.add_argument(
+    "--no-cache",
+    help="don't read or write caches between runs",
+    action="store_true",
+)
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+
+    from .lib.cache import default_cache_dir
+    from .lib.check import check_theme
+
+    start = time.perf_counter()
+    result = check_theme(
+        args.input,
+        constants_path=args.constants_path,
+        function_paths=args.functions,
+        cache_dir=None if args.no_cache else (args.cache_dir or default_cache_dir()),
+    )
+    ms = (time.perf_counter() - start) * 1000
+
+    for problem in result.problems:
+        print(problem.format())
+
+    print(
+        f"Checked {result.files} files ({result.unchanged} unchanged,"
+        f" {result.expressions} expressions evaluated) in {ms:.0f}ms,"
+        f" found {len(result.problems)} problems",
+        file=sys.stderr,
+    )
+    if len(result.problems) > 0:
+        sys.exit(1)
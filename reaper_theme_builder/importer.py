@@ -0,0 +1,116 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
+parser = argparse.ArgumentParser(
+    prog="rtb import",
+    description="Import existing .ReaperThemeZip and .ReaperTheme files into theme"
+    " source folders, decoding their colours into expressions",
+)
+parser.add_argument(
+    "inputs",
+    help="theme files to import, folders are searched for theme files recursively",
+    nargs="+",
+    type=Path,
+)
+parser.add_argument(
+    "-o",
+    "--output",
+    help="folder to create a source folder in for each theme",
+    required=True,
+    type=Path,
+)
+parser.add_argument(
+    "--constants",
+    help="move values used by several keys into a constants.ini file for each theme",
+    action="store_true",
+)
+parser.add_argument(
+    "--min-repeats",
+    help="number of keys a value must be used by to become a constant (default: 3)",
+    default=3,
+    type=int,
+)
+parser.add_argument(
+    "-j",
+    "--jobs",
+    help="number of processes to import themes with, defaults to the number of CPUs",
+    type=int,
+)
+
+
+def _import(path: Path, output: Path, min_repeats: int | None):
+    """Import a theme, returns the report or an error message"""
+    import zipfile
+
+    from .lib.decompile import import_theme
+
+    try:
+        return import_theme(path, output, min_repeats=min_repeats)
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+
+    from .lib.decompile import find_duplicates, find_themes
+
+    themes = find_themes(args.inputs)
+    if len(themes) == 0:
+        print("No themes found", file=sys.stderr)
+        sys.exit(1)
+
+    # themes with the same name would be imported into the same folder, so none of
+    # them are imported
+    duplicates = find_duplicates(themes)
+    for paths in duplicates.values():
+        print(
+            f"{', '.join(map(str, paths))}: these themes have the same name, import"
+            " them into different output folders",
+            file=sys.stderr,
+        )
+    total = len(themes)
+    themes = [p for p in themes if p.stem.lower() not in duplicates]
+
+    min_repeats = args.min_repeats if args.constants else None
+    jobs = min(args.jobs or os.cpu_count() or 1, max(len(themes), 1))
+    if jobs > 1:
+        # multiprocessing is slow to import, so only import it when it is used
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(jobs) as executor:
+            results = list(
+                executor.map(
+                    _import,
+                    themes,
+                    [args.output] * len(themes),
+                    [min_repeats] * len(themes),
+                )
+            )
+    else:
+        results = [_import(path, args.output, min_repeats) for path in themes]
+
+    failed = total - len(themes)
+    for path, result in zip(themes, results):
+        if isinstance(result, str):
+            failed += 1
+            print(f"{path}: {result}", file=sys.stderr)
+            continue
+
+        constants = ""
+        if result.constants_path is not None:
+            constants = f", {result.constants} constants"
+        print(
+            f"{path} -> {result.theme_dir}: {result.colors} colours, {result.blends}"
+            f" blends{constants}, {result.resources} resources"
+        )
+        if not result.png_only:
+            print("  has resources that aren't PNG, build it with '-all' to keep them")
+        for name in result.skipped:
+            print(f"  skipped {name}, it isn't in the theme folder")
+
+    print(f"Imported {total - failed} of {total} themes", file=sys.stderr)
+    if failed > 0:
+        sys.exit(1)
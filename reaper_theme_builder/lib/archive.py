@@ -0,0 +1,180 @@
+# This module reads and writes ZIP entries in their compressed form, so that entries
+# can be copied between archives without being decompressed and recompressed.
+
+import os
+import struct
+import zipfile
+import zlib
+from typing import BinaryIO, NamedTuple
+
+# the timestamp and permissions of every entry in a reproducible archive, this is the
+# earliest time a ZIP file can store
+REPRODUCIBLE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+REPRODUCIBLE_ATTR = 0o644 << 16
+
+# reproducible archives store a digest of their inputs in the archive comment
+DIGEST_PREFIX = b"rtb-digest:"
+
+# compression methods that entries are written with, and that `decompress` can read
+SUPPORTED_METHODS = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+
+
+class CompressedEntry(NamedTuple):
+    # compression method, e.g. zipfile.ZIP_DEFLATED
+    compress_type: int
+    # CRC-32 of the uncompressed data
+    CRC: int
+    # size of the uncompressed data
+    file_size: int
+    # timestamp to store in the archive
+    date_time: tuple[int, int, int, int, int, int]
+    # file permissions and attributes
+    external_attr: int
+    # the compressed data
+    data: bytes
+
+
+def read_entry(fp: BinaryIO, info: zipfile.ZipInfo):
+    """Read the raw compressed data of an entry from an opened ZIP file"""
+    fp.seek(info.header_offset)
+    header = fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader:
+        raise zipfile.BadZipFile(f"Truncated file header: {info.filename}")
+
+    header = struct.unpack(zipfile.structFileHeader, header)
+    if header[0] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad magic number for file header: {info.filename}")
+
+    # skip the filename and extra field, the central directory has the same info
+    fp.seek(header[10] + header[11], 1)
+
+    data = fp.read(info.compress_size)
+    if len(data) != info.compress_size:
+        raise zipfile.BadZipFile(f"Truncated file data: {info.filename}")
+
+    return CompressedEntry(
+        info.compress_type,
+        info.CRC,
+        info.file_size,
+        info.date_time,
+        info.external_attr,
+        data,
+    )
+
+
+def read_entries(path):
+    """Read all entries of a ZIP file in their compressed form, mapped by name"""
+    entries: dict[str, CompressedEntry] = {}
+    with open(path, "rb") as fp, zipfile.ZipFile(fp) as z:
+        for info in z.infolist():
+            entries[info.filename] = read_entry(fp, info)
+    return entries
+
+
+# the private attributes of ZipFile that write_entry relies on
+_ZIPFILE_INTERNALS = (
+    "_lock",
+    "_seekable",
+    "_writecheck",
+    "_didModify",
+    "fp",
+    "start_dir",
+    "filelist",
+    "NameToInfo",
+)
+
+
+def _can_write_raw(z: zipfile.ZipFile):
+    """Whether raw entries can be appended to a ZipFile, see write_entry"""
+    return hasattr(zipfile.ZipInfo, "FileHeader") and all(
+        hasattr(z, name) for name in _ZIPFILE_INTERNALS
+    )
+
+
+def decompress(entry: CompressedEntry):
+    """The uncompressed data of an entry, raises BadZipFile if it can't be read"""
+    if entry.compress_type == zipfile.ZIP_STORED:
+        return entry.data
+    if entry.compress_type == zipfile.ZIP_DEFLATED:
+        try:
+            return zlib.decompress(entry.data, -15)
+        except zlib.error as e:
+            raise zipfile.BadZipFile(f"Invalid compressed data: {e}")
+    raise zipfile.BadZipFile(f"Unsupported compression method: {entry.compress_type}")
+
+
+def write_entry(
+    z: zipfile.ZipFile,
+    arcname: str,
+    entry: CompressedEntry,
+    *,
+    create_system: int | None = None,
+):
+    """
+    Append an already-compressed entry to a ZIP file that is open for writing. The
+    system the entry was made on defaults to the current one.
+
+    `ZipFile` has no public API for this, so this mirrors what `ZipFile.mkdir` does
+    internally for entries that have no data stream. If a version of Python doesn't
+    have the same internals, the entry is decompressed and written with `writestr`
+    instead, which compresses it again.
+    """
+    zinfo = zipfile.ZipInfo(arcname, entry.date_time)
+    if create_system is not None:
+        zinfo.create_system = create_system
+    zinfo.compress_type = entry.compress_type
+    zinfo.external_attr = entry.external_attr
+
+    if not _can_write_raw(z):
+        z.writestr(zinfo, decompress(entry))
+        return
+
+    zinfo.CRC = entry.CRC
+    zinfo.file_size = entry.file_size
+    zinfo.compress_size = len(entry.data)
+
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or (
+        zinfo.compress_size > zipfile.ZIP64_LIMIT
+    )
+
+    with z._lock:
+        if z._seekable:
+            z.fp.seek(z.start_dir)
+        zinfo.header_offset = z.fp.tell()
+
+        z._writecheck(zinfo)
+        z._didModify = True
+
+        z.filelist.append(zinfo)
+        z.NameToInfo[zinfo.filename] = zinfo
+        z.fp.write(zinfo.FileHeader(zip64))
+        z.fp.write(entry.data)
+        z.start_dir = z.fp.tell()
+
+
+def read_digest(path):
+    """
+    The input digest stored in the comment of a reproducible archive, or None if the
+    file doesn't exist or has no digest. Only the end of the file is read.
+    """
+    # the comment is at the very end, after the end of central directory record
+    length = zipfile.sizeEndCentDir + len(DIGEST_PREFIX) + 32
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < length:
+                return None
+            f.seek(-length, os.SEEK_END)
+            tail = f.read()
+    except OSError:
+        return None
+
+    record = struct.unpack(zipfile.structEndArchive, tail[: zipfile.sizeEndCentDir])
+    comment = tail[zipfile.sizeEndCentDir :]
+    if (
+        record[0] != zipfile.stringEndArchive
+        or record[zipfile._ECD_COMMENT_SIZE] != len(comment)
+        or not comment.startswith(DIGEST_PREFIX)
+    ):
+        return None
+    return comment[len(DIGEST_PREFIX) :].decode("ascii", "replace")
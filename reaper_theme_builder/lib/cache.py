@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+# folders in the cache folder that hold generated resources, these grow with every
+# new or changed resource, so unused files are removed with `rtb cache`
+TRANSFORM_CACHE = "resources"
+PNG_CACHE = "png"
+RESOURCE_CACHES = (TRANSFORM_CACHE, PNG_CACHE)
+
+# cached files are marked as used at most this often, by updating their mtime
+USED_RESOLUTION = 24 * 60 * 60
+
+
+def default_cache_dir():
+    """
+    The folder used to store caches between runs, this can be overridden with the
+    RTB_CACHE_DIR environment variable.
+    """
+    if "RTB_CACHE_DIR" in os.environ:
+        return Path(os.environ["RTB_CACHE_DIR"])
+
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", Path.home() / "AppData" / "Local")
+    elif sys.platform == "darwin":
+        base = Path.home() / "Library" / "Caches"
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+
+    return Path(base) / "reaper-theme-builder"
+
+
+def is_cached(path):
+    """
+    Whether a cached file exists. Files that exist are marked as used, so `prune`
+    keeps them.
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return False
+
+    if time.time() - mtime > USED_RESOLUTION:
+        try:
+            os.utime(path)
+        except OSError:
+            # a read-only cache is still used as it is
+            pass
+    return True
+
+
+class PruneStats(NamedTuple):
+    files: int
+    bytes: int
+    removed_files: int
+    removed_bytes: int
+
+
+def prune(folder, *, max_age: float | None = None, max_bytes: int | None = None):
+    """
+    Remove files from a cache folder that weren't used for `max_age` seconds, then the
+    least recently used files until the folder holds at most `max_bytes`. Returns the
+    sizes before pruning, and what was removed.
+    """
+    files: list[tuple[float, int, str]] = []
+    try:
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.is_file():
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        return PruneStats(0, 0, 0, 0)
+
+    total = sum(size for _, size, _ in files)
+    remaining = total
+    removed = 0
+
+    # the least recently used files first
+    files.sort()
+    now = time.time()
+    for mtime, size, path in files:
+        expired = max_age is not None and now - mtime > max_age
+        too_big = max_bytes is not None and remaining > max_bytes
+        if not expired and not too_big:
+            break
+
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        remaining -= size
+        removed += 1
+
+    return PruneStats(len(files), total, removed, total - remaining)
@@ -0,0 +1,243 @@
+# This module checks a theme for errors without building it, for `rtb check`. Every
+# expression in the rtconfig and ReaperTheme files is evaluated, and every error is
+# reported with the file, line and column it was found at. Nothing is compressed or
+# written, other than the caches that make the next check faster.
+
+import bisect
+import marshal
+import os
+from pathlib import Path
+from typing import NamedTuple
+
+from .rptheme import ReaperTheme, ReaperThemeSyntaxError
+from .scanner import DirInfo, snapshot_path
+from .utils import tmp_suffix
+from .val.constants import ConstantsConfig
+from .val.evaluator import Evaluator
+from .val.formatter import TemplateSyntaxError, split_double, split_single
+
+# bump this when the results of a check change, to invalidate existing caches
+RESULTS_VERSION = 2
+
+
+class Problem(NamedTuple):
+    path: str
+    # the line and column, starting from 1
+    line: int
+    column: int
+    message: str
+
+    def format(self):
+        return f"{self.path}:{self.line}:{self.column}: {self.message}"
+
+
+class _Lines:
+    """Finds the line and column of positions in a text"""
+
+    def __init__(self, text: str) -> None:
+        self._text = text
+        self._starts: list[int] | None = None
+
+    def position(self, pos: int):
+        if self._starts is None:
+            # only needed once there is a problem, most files don't have any
+            self._starts = [0]
+            start = self._text.find("\n")
+            while start != -1:
+                self._starts.append(start + 1)
+                start = self._text.find("\n", start + 1)
+
+        line = bisect.bisect_right(self._starts, pos)
+        return line, pos - self._starts[line - 1] + 1
+
+
+class Checker:
+    """Checks rtconfig and ReaperTheme files, each distinct expression is evaluated once"""
+
+    def __init__(self, evaluator: Evaluator) -> None:
+        self._evaluator = evaluator
+
+        # map from expressions to the error they raise, or None
+        self._errors: dict[str, str | None] = {}
+
+        # number of expressions found
+        self.expressions = 0
+
+    def _error(self, raw: str):
+        self.expressions += 1
+        if raw in self._errors:
+            return self._errors[raw]
+
+        try:
+            self._evaluator.val(raw)
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if raw.strip() not in error:
+                error += f" in {raw.strip()!r}"
+
+        self._errors[raw] = error
+        return error
+
+    def rtconfig(self, path: str):
+        """Check the double brace expressions in a rtconfig file"""
+        with open(path, "r", encoding="utf8") as f:
+            text = f.read()
+
+        lines = _Lines(text)
+        errors: list[TemplateSyntaxError] = []
+        problems = []
+
+        pos = 0
+        for literal, raw in split_double(text, errors=errors):
+            pos += len(literal)
+            if raw is None:
+                continue
+
+            error = self._error(raw)
+            if error is not None:
+                problems.append(Problem(path, *lines.position(pos), error))
+            pos += len(raw) + 4
+
+        for e in errors:
+            problems.append(Problem(path, e.line, e.column, e.message))
+
+        return sorted(problems)
+
+    def rptheme(self, path: str):
+        """
+        Check a ReaperTheme file is read by the build without errors, and check the
+        single brace expressions in its values
+        """
+        # read the same way as the build, see `ReaperTheme.read`
+        with open(path, "r", encoding="utf-8-sig") as f:
+            text = f.read()
+
+        problems = []
+        try:
+            ReaperTheme().read_string(text, path)
+        except ReaperThemeSyntaxError as e:
+            problems.append(Problem(path, e.line, 1, e.message))
+
+        for number, line in enumerate(text.splitlines(), 1):
+            stripped = line.lstrip()
+            if stripped == "" or stripped[0] in "#;[":
+                continue
+            if "{" not in line and "}" not in line:
+                continue
+
+            key, sep, value = line.partition("=")
+            if sep == "":
+                continue
+
+            # the column of the first character of the value
+            start = len(key) + 2 + len(value) - len(value.lstrip())
+            value = value.strip()
+
+            try:
+                fields = [raw for _, raw in split_single(value) if raw is not None]
+            except TemplateSyntaxError as e:
+                problems.append(Problem(path, number, start + e.column - 1, e.message))
+                continue
+
+            cursor = 0
+            for raw in fields:
+                found = value.find("{" + raw, cursor)
+                if found != -1:
+                    cursor = found + 1
+
+                error = self._error(raw)
+                if error is not None:
+                    column = start + max(found, 0)
+                    problems.append(Problem(path, number, column, error))
+
+        return sorted(problems)
+
+
+def _load_results(path: Path):
+    """
+    Load the results of the previous check, a map from file paths to their size,
+    modification time and problems
+    """
+    try:
+        with open(path, "rb") as f:
+            data = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return {}
+
+    if not isinstance(data, dict) or data.get("version") != RESULTS_VERSION:
+        return {}
+    return data["files"]
+
+
+def _save_results(path: Path, files: dict):
+    os.makedirs(path.parent, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{tmp_suffix()}")
+    with open(tmp_path, "wb") as f:
+        marshal.dump({"version": RESULTS_VERSION, "files": files}, f)
+    os.replace(tmp_path, path)
+
+
+class CheckResult(NamedTuple):
+    problems: list[Problem]
+    # number of files checked, and how many of them were unchanged since the last check
+    files: int
+    unchanged: int
+    # number of expressions evaluated
+    expressions: int
+
+
+def check_theme(
+    input_dir: Path,
+    *,
+    constants_path: Path | None = None,
+    function_paths: list[Path] | None = None,
+    cache_dir: Path | None = None,
+):
+    """
+    Check every rtconfig and ReaperTheme file in a theme source folder. If a cache
+    folder is given, files that haven't changed since the last check with the same
+    constants aren't checked again.
+    """
+    input_dir = Path(input_dir).absolute().resolve()
+    snapshot = None if cache_dir is None else snapshot_path(cache_dir, input_dir)
+
+    dirinfo = DirInfo.scan(input_dir, snapshot=snapshot)
+    evaluator = Evaluator(
+        ConstantsConfig(constants_path),
+        cache_dir=cache_dir,
+        function_paths=function_paths,
+    )
+    checker = Checker(evaluator)
+
+    results_path = None
+    previous = {}
+    if cache_dir is not None:
+        results_path = Path(cache_dir) / f"check-{evaluator.key()}.bin"
+        previous = _load_results(results_path)
+
+    files = [(p, checker.rtconfig) for p in dirinfo.rtconfig_paths()]
+    files += [(p, checker.rptheme) for p in dirinfo.rptheme_paths()]
+
+    results = {}
+    problems = []
+    unchanged = 0
+    for path, check in files:
+        stat = os.stat(path)
+        entry = previous.get(path)
+        if entry is not None and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+            found = [Problem(*p) for p in entry[2]]
+            unchanged += 1
+        else:
+            found = check(path)
+
+        problems.extend(found)
+        results[path] = (stat.st_size, stat.st_mtime_ns, [tuple(p) for p in found])
+
+    evaluator.save_cache()
+    if results_path is not None and results != previous:
+        _save_results(results_path, results)
+    if snapshot is not None:
+        dirinfo.save_snapshot(snapshot)
+
+    return CheckResult(problems, len(files), unchanged, checker.expressions)
@@ -0,0 +1,205 @@
+# This module compresses resources before they are written to a theme archive.
+# Resources are compressed in a thread pool (zlib releases the GIL while compressing),
+# then written to the archive in their original order.
+
+import os
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from .archive import CompressedEntry
+
+STORE = "store"
+DEFLATE = "deflate"
+# try both storing and deflating, and keep the smaller result
+BEST = "best"
+
+
+class CompressionMethod(NamedTuple):
+    kind: str
+    # zlib compression level, -1 uses zlib's default
+    level: int = -1
+
+    @classmethod
+    def parse(cls, text: str):
+        """Parse a method like 'store', 'deflate' or 'deflate:9'"""
+        kind, _, level = text.strip().lower().partition(":")
+        if kind not in (STORE, DEFLATE, BEST):
+            raise ValueError(f"Unknown compression method: {text!r}")
+
+        if len(level) == 0:
+            return cls(kind)
+
+        if kind == STORE:
+            raise ValueError(f"Compression level is not supported for 'store': {text!r}")
+
+        try:
+            level = int(level)
+        except ValueError:
+            raise ValueError(f"Invalid compression level: {text!r}")
+        if not 0 <= level <= 9:
+            raise ValueError(f"Compression level must be between 0 and 9: {text!r}")
+
+        return cls(kind, level)
+
+    def __str__(self) -> str:
+        if self.kind == STORE or self.level == -1:
+            return self.kind
+        return f"{self.kind}:{self.level}"
+
+
+class CompressionPolicy:
+    """Decides which compression method to use for each resource, by file extension"""
+
+    def __init__(
+        self,
+        default: CompressionMethod | None = None,
+        extensions: dict[str, CompressionMethod] | None = None,
+    ) -> None:
+        self.default = CompressionMethod(DEFLATE) if default is None else default
+        # map from lowercase extensions (without the period) to methods
+        self.extensions = {} if extensions is None else extensions
+
+    @classmethod
+    def parse(cls, specs: list[str]):
+        """
+        Parse a list of rules like 'png=store' or 'txt=deflate:9'. Use '*' as the
+        extension to change the default method.
+        """
+        policy = cls()
+        for spec in specs:
+            if "=" not in spec:
+                raise ValueError(f"Compression rule must be like 'png=store': {spec!r}")
+
+            ext, method = spec.split("=", 1)
+            ext = ext.strip().lower().lstrip(".")
+            method = CompressionMethod.parse(method)
+
+            if ext == "*":
+                policy.default = method
+            else:
+                policy.extensions[ext] = method
+
+        return policy
+
+    def method(self, path) -> CompressionMethod:
+        ext = os.path.splitext(path)[1].lower().lstrip(".")
+        return self.extensions.get(ext, self.default)
+
+    def __str__(self) -> str:
+        rules = [f"*={self.default}"]
+        rules.extend(f"{ext}={m}" for ext, m in sorted(self.extensions.items()))
+        return " ".join(rules)
+
+
+def _deflate(data: bytes, level: int):
+    # ZIP files store raw deflate streams without the zlib header
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress(data: bytes, method: CompressionMethod) -> tuple[int, bytes]:
+    """Compress data using the given method, returns the ZIP compression type and data"""
+    if method.kind == STORE:
+        return zipfile.ZIP_STORED, data
+
+    deflated = _deflate(data, method.level)
+    if method.kind == BEST and len(deflated) >= len(data):
+        return zipfile.ZIP_STORED, data
+
+    return zipfile.ZIP_DEFLATED, deflated
+
+
+class _ReportRow(NamedTuple):
+    method: str
+    files: int
+    bytes_in: int
+    bytes_out: int
+    seconds: float
+
+
+class CompressionReport:
+    """Statistics on how much each file extension was compressed, and how long it took"""
+
+    def __init__(self) -> None:
+        self.rows: dict[str, _ReportRow] = {}
+
+        # number of resources copied from a previous build without compressing
+        self.reused = 0
+
+        # the entries of the written archive
+        self.entries: list[zipfile.ZipInfo] = []
+
+    def add(
+        self,
+        path,
+        method: CompressionMethod,
+        bytes_in: int,
+        bytes_out: int,
+        seconds: float,
+    ):
+        ext = os.path.splitext(path)[1].lower() or "(none)"
+        row = self.rows.get(ext, _ReportRow(str(method), 0, 0, 0, 0.0))
+        self.rows[ext] = _ReportRow(
+            row.method,
+            row.files + 1,
+            row.bytes_in + bytes_in,
+            row.bytes_out + bytes_out,
+            row.seconds + seconds,
+        )
+
+    def format(self):
+        lines = [
+            f"  {'ext':<8} {'method':<10} {'files':>6} {'in':>12} {'out':>12} {'saved':>7} {'time':>8}"
+        ]
+        for ext, row in sorted(self.rows.items()):
+            saved = 1 - row.bytes_out / row.bytes_in if row.bytes_in else 0
+            lines.append(
+                f"  {ext:<8} {row.method:<10} {row.files:>6} {row.bytes_in:>12} {row.bytes_out:>12} {saved:>7.1%} {row.seconds:>7.2f}s"
+            )
+        return "\n".join(lines)
+
+
+def compress_file(src, method: CompressionMethod):
+    """Read and compress a file, returns the entry and the time spent compressing"""
+    # use the same timestamp and permissions as ZipFile.write()
+    zinfo = zipfile.ZipInfo.from_file(src)
+    with open(src, "rb") as f:
+        data = f.read()
+
+    start = time.perf_counter()
+    compress_type, compressed = compress(data, method)
+    crc = zlib.crc32(data)
+    seconds = time.perf_counter() - start
+
+    entry = CompressedEntry(
+        compress_type, crc, len(data), zinfo.date_time, zinfo.external_attr, compressed
+    )
+    return entry, seconds
+
+
+def compress_files(
+    paths: list,
+    policy: CompressionPolicy,
+    *,
+    jobs: int | None = None,
+    report: CompressionReport | None = None,
+):
+    """
+    Compress files in a thread pool, yields the compressed entries in the same order
+    as the given paths.
+    """
+    if len(paths) == 0:
+        return
+
+    def task(path):
+        return compress_file(path, policy.method(path))
+
+    with ThreadPoolExecutor(jobs) as executor:
+        for path, (entry, seconds) in zip(paths, executor.map(task, paths)):
+            if report is not None:
+                method = policy.method(path)
+                report.add(path, method, entry.file_size, len(entry.data), seconds)
+            yield entry
@@ -0,0 +1,383 @@
+# This module imports existing themes into source folders, for `rtb import`.
+#
+# A .ReaperThemeZip holds a `NAME.ReaperTheme` file and a folder of resources with a
+# `rtconfig.txt`. Entries are streamed out of the archive straight into a source
+# folder, which builds the same theme again:
+#
+#     OUT/NAME/theme/NAME.ReaperTheme
+#     OUT/NAME/theme/rtconfig.txt
+#     OUT/NAME/theme/...resources
+#     OUT/NAME/constants.ini (with --constants)
+#
+# Values in the colour section are decoded into `rgb(...)` and `blend(...)`
+# expressions. Each distinct value is only decoded once, and values used by at least
+# `min_repeats` keys can be moved into a constants file, referred to with `c(...)`.
+# Braces in the text are escaped so they aren't read as expressions. Every imported
+# theme is evaluated again and compared with the original, so an import never changes
+# the theme.
+
+import os
+import shutil
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import NamedTuple
+
+from . import rptheme
+from .palette import (
+    BLEND_MODE_NAMES,
+    COLOR_SECTION,
+    DEFAULT_BLEND_KEYS,
+    is_blend,
+    matches_any,
+)
+from .rptheme import ReaperTheme
+from .rtconfig import from_path as read_rtconfig
+from .scanner import is_rtconfig
+from .utils import tmp_suffix
+from .val.constants import ConstantsConfig
+from .val.evaluator import Evaluator
+from .val.formatter import split_double
+from .val.funcs import blend, rgb
+
+# reads as '{{' in a processed rtconfig, an expression can't contain two braces in a row
+_ESCAPED_OPENING = '{{"{" * 2}}'
+
+
+class ThemeImportError(ValueError):
+    """A theme that can't be imported"""
+
+
+class ImportReport(NamedTuple):
+    name: str
+    # the source folder, and the constants file if one was written
+    theme_dir: Path
+    constants_path: Path | None
+    resources: int
+    # whether every resource is a PNG, otherwise the theme must be built with '-all'
+    png_only: bool
+    colors: int
+    blends: int
+    constants: int
+    # archive entries that aren't part of the theme, and were skipped
+    skipped: list[str]
+
+
+def decode(value: int, key: str):
+    """
+    Decode a colour section value into an expression, returns None if the value isn't
+    a colour or blend, or its expression wouldn't give the same value
+    """
+    if matches_any(key, DEFAULT_BLEND_KEYS) or is_blend(value):
+        if not is_blend(value):
+            return None
+        mode = BLEND_MODE_NAMES[value & 0xFF]
+        frac = ((value >> 8) & 0b111111111) / 256
+        expression = f'blend("{mode}", {frac!r})'
+        return expression if blend(mode, frac) == value else None
+
+    if not 0 <= value <= 0xFFFFFF:
+        return None
+    r, g, b = value & 0xFF, (value >> 8) & 0xFF, (value >> 16) & 0xFF
+    return f"rgb({r}, {g}, {b})" if rgb(r, g, b) == value else None
+
+
+def _escape_single(text: str):
+    """Escape braces in a ReaperTheme value, so it is kept as it is"""
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def _escape_double(text: str):
+    """Escape every '{{' that would start an expression in a rtconfig"""
+    parts = []
+    for literal, raw in split_double(text):
+        parts.append(literal)
+        if raw is not None:
+            parts.append(f"{_ESCAPED_OPENING}{raw}}}}}")
+    return "".join(parts)
+
+
+def _constant_name(key: str, used: set[str]):
+    name = key.lower()
+    if name.startswith("col_"):
+        name = name[len("col_") :]
+    name = "".join(c if c.isalnum() else "_" for c in name) or "value"
+
+    unique = name
+    n = 2
+    while unique in used:
+        unique = f"{name}_{n}"
+        n += 1
+    used.add(unique)
+    return unique
+
+
+class _Decompiled(NamedTuple):
+    rptheme: ReaperTheme
+    constants: dict[str, dict[str, str]]
+    colors: int
+    blends: int
+
+
+def decompile_rptheme(original: ReaperTheme, *, min_repeats: int | None = None):
+    """
+    Decode the colour values of a ReaperTheme into expressions. If `min_repeats` is
+    given, expressions used by at least that many keys are moved into constants.
+    Returns the source ReaperTheme, and the constants by section.
+    """
+    # decode each distinct value once, in a batch
+    decoded: dict[tuple[int, bool], str | None] = {}
+    # map from keys to their decoded expressions
+    expressions: dict[tuple[str, str], str] = {}
+    if original.has_section(COLOR_SECTION):
+        for key, text in original[COLOR_SECTION].items():
+            try:
+                value = int(text)
+            except ValueError:
+                continue
+
+            blend_key = matches_any(key, DEFAULT_BLEND_KEYS)
+            if (value, blend_key) not in decoded:
+                decoded[(value, blend_key)] = decode(value, key)
+            expression = decoded[(value, blend_key)]
+            if expression is not None:
+                expressions[(COLOR_SECTION, key)] = expression
+
+    # expressions used often enough become constants, named after the first key
+    references: dict[str, str] = {}
+    constants: dict[str, dict[str, str]] = {}
+    if min_repeats is not None:
+        counts: dict[str, int] = {}
+        for expression in expressions.values():
+            counts[expression] = counts.get(expression, 0) + 1
+
+        used: set[str] = set()
+        for (_, key), expression in expressions.items():
+            if counts[expression] < min_repeats or expression in references:
+                continue
+
+            section = "blends" if expression.startswith("blend(") else "colors"
+            name = _constant_name(key, used)
+            constants.setdefault(section, {})[name] = expression
+            references[expression] = f'c("{section}.{name}")'
+
+    rpt = ReaperTheme()
+    colors = blends = 0
+    for section_name in original:
+        section = rpt.add_section(section_name)
+        for key, text in original[section_name].items():
+            expression = expressions.get((section_name, key))
+            if expression is None:
+                section[key] = _escape_single(text)
+                continue
+
+            if expression.startswith("blend("):
+                blends += 1
+            else:
+                colors += 1
+            section[key] = f"{{{references.get(expression, expression)}}}"
+
+    return _Decompiled(rpt, constants, colors, blends)
+
+
+def _write_constants(path: Path, constants: dict[str, dict[str, str]]):
+    parts = []
+    for section, values in constants.items():
+        parts.append(f"[{section}]\n")
+        for name, expression in values.items():
+            parts.append(f"{name} = {expression}\n")
+        parts.append("\n")
+    with open(path, "w", encoding="utf8") as f:
+        f.write("".join(parts))
+
+
+def _verify(
+    original: ReaperTheme,
+    rtconfig: str | None,
+    theme_dir: Path,
+    constants_path: Path | None,
+):
+    """Evaluate an imported theme, and check that it gives the original theme back"""
+    evaluator = Evaluator(ConstantsConfig(constants_path))
+
+    rpt = rptheme.from_paths(
+        [str(p) for p in theme_dir.iterdir() if p.suffix.lower() == ".reapertheme"]
+    )
+    rptheme.process(rpt, evaluator.parse_single)
+    if rpt.serialize() != original.serialize():
+        raise ThemeImportError(
+            "The imported ReaperTheme doesn't evaluate to the original"
+        )
+
+    if rtconfig is not None:
+        # rtconfig files are read with universal newlines when they are built
+        expected = rtconfig.replace("\r\n", "\n").replace("\r", "\n")
+        text = read_rtconfig(str(theme_dir / "rtconfig.txt"))
+        if evaluator.parse_double(text) != expected:
+            raise ThemeImportError(
+                "The imported rtconfig doesn't evaluate to the original"
+            )
+
+
+def _safe_path(root: Path, name: str):
+    """The path of an archive entry in the output folder, refusing paths outside it"""
+    parts = PurePosixPath(name).parts
+    if len(parts) == 0 or name.startswith("/") or ".." in parts or ":" in parts[0]:
+        raise ThemeImportError(f"Unsafe path in archive: {name!r}")
+    return root.joinpath(*parts)
+
+
+def _theme_folder(z: zipfile.ZipFile, rpt: ReaperTheme | None):
+    """Find the folder holding the resources of a theme archive"""
+    folders = sorted({n.split("/", 1)[0] for n in z.namelist() if "/" in n})
+    if len(folders) == 1:
+        return folders[0]
+
+    ui_img = None
+    if rpt is not None and "REAPER" in rpt and "ui_img" in rpt["REAPER"]:
+        ui_img = rpt["REAPER"]["ui_img"]
+    if ui_img in folders:
+        return ui_img
+    if len(folders) == 0:
+        return None
+    raise ThemeImportError(
+        f"Can't tell which folder holds the theme, found: {', '.join(folders)}"
+    )
+
+
+def import_theme(path: Path, output_dir: Path, *, min_repeats: int | None = None):
+    """
+    Import a .ReaperThemeZip or .ReaperTheme file into a source folder in
+    `output_dir`. If `min_repeats` is given, repeated values are moved into a
+    constants file next to the source folder.
+    """
+    path = Path(path)
+    root = Path(output_dir) / path.stem
+    if root.exists():
+        raise ThemeImportError(f"The output folder already exists: {root}")
+
+    # import into a temporary folder next to the output, which is only moved into
+    # place once the import is verified, so a failed import leaves nothing behind
+    tmp_root = root.with_name(f".{root.name}.{tmp_suffix()}.tmp")
+    try:
+        report = _import(path, tmp_root, min_repeats)
+        os.replace(tmp_root, root)
+    finally:
+        if tmp_root.exists():
+            shutil.rmtree(tmp_root)
+
+    constants_path = None
+    if report.constants_path is not None:
+        constants_path = root / report.constants_path.name
+    return report._replace(theme_dir=root / "theme", constants_path=constants_path)
+
+
+def _import(path: Path, root: Path, min_repeats: int | None):
+    """Import a theme into the source folder `root`, see import_theme"""
+    name = path.stem
+    theme_dir = root / "theme"
+
+    original = ReaperTheme()
+    rtconfig = None
+    resources = 0
+    png_only = True
+    skipped: list[str] = []
+
+    if path.suffix.lower() == ".reapertheme":
+        original.read(str(path))
+        theme_dir.mkdir(parents=True)
+    else:
+        with zipfile.ZipFile(path) as z:
+            rpt_names = [
+                n
+                for n in z.namelist()
+                if "/" not in n and n.lower().endswith(".reapertheme")
+            ]
+            if len(rpt_names) > 1:
+                raise ThemeImportError(
+                    f"More than one ReaperTheme: {', '.join(rpt_names)}"
+                )
+            if len(rpt_names) == 1:
+                # utf-8-sig, as files saved by some editors start with a byte order mark
+                text = z.read(rpt_names[0]).decode("utf-8-sig")
+                original.read_string(text, f"{path}/{rpt_names[0]}")
+
+            folder = _theme_folder(z, original)
+            theme_dir.mkdir(parents=True)
+
+            for info in z.infolist():
+                if info.is_dir() or info.filename in rpt_names:
+                    continue
+                if folder is None or not info.filename.startswith(f"{folder}/"):
+                    skipped.append(info.filename)
+                    continue
+
+                local = info.filename[len(folder) + 1 :]
+                if local.lower() == "rtconfig.txt":
+                    rtconfig = z.read(info).decode("utf8")
+                    with open(
+                        theme_dir / "rtconfig.txt", "w", encoding="utf8", newline=""
+                    ) as f:
+                        f.write(_escape_double(rtconfig))
+                    continue
+                if is_rtconfig(local):
+                    # the builder would place the files next to it at the root
+                    raise ThemeImportError(f"Nested rtconfig: {info.filename}")
+
+                dst = _safe_path(theme_dir, local)
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                # stream the entry out of the archive, without holding it in memory
+                with z.open(info) as src, open(dst, "wb") as f:
+                    shutil.copyfileobj(src, f)
+                resources += 1
+                png_only = png_only and local.lower().endswith(".png")
+
+    decompiled = decompile_rptheme(original, min_repeats=min_repeats)
+    with open(theme_dir / f"{name}.ReaperTheme", "w", encoding="utf8") as f:
+        decompiled.rptheme.write(f)
+
+    constants_path = None
+    if min_repeats is not None:
+        constants_path = root / "constants.ini"
+        _write_constants(constants_path, decompiled.constants)
+
+    _verify(original, rtconfig, theme_dir, constants_path)
+
+    return ImportReport(
+        name,
+        theme_dir,
+        constants_path,
+        resources,
+        png_only,
+        decompiled.colors,
+        decompiled.blends,
+        sum(len(values) for values in decompiled.constants.values()),
+        skipped,
+    )
+
+
+def find_duplicates(themes: list[Path]):
+    """
+    Themes that would be imported into the same source folder, like Foo.ReaperTheme
+    and Foo.ReaperThemeZip, mapped by the name of the folder
+    """
+    names: dict[str, list[Path]] = {}
+    for path in themes:
+        # the output folder may be on a case-insensitive filesystem
+        names.setdefault(path.stem.lower(), []).append(path)
+    return {name: paths for name, paths in names.items() if len(paths) > 1}
+
+
+def find_themes(paths: list[Path]):
+    """Expand folders into the theme files inside them, recursively"""
+    themes: list[Path] = []
+    for path in paths:
+        if not Path(path).is_dir():
+            themes.append(Path(path))
+            continue
+
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith((".reaperthemezip", ".reapertheme")):
+                    themes.append(Path(dirpath) / filename)
+    return themes
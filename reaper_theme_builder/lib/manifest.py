@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+from typing import NamedTuple
+
+from .archive import CompressedEntry
+
+
+def file_digest(path) -> str:
+    """Hash the contents of a file"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 16):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ManifestEntry(NamedTuple):
+    # the local path of the resource
+    src: str
+    # file size in bytes
+    size: int
+    # modification time in nanoseconds
+    mtime_ns: int
+    # hash of the file contents
+    digest: str
+    # CRC-32 of the file contents, as stored in the archive, or None if the resource
+    # isn't written yet
+    crc: int | None
+
+
+class BuildManifest:
+    """
+    A record of the resources written to a theme archive in the previous build.
+
+    This is used to determine which resources are unchanged since the last build, so
+    their compressed data can be copied from the previous archive as-is. The CRC and
+    size of each resource are kept too, so entries of an archive that was overwritten
+    since then aren't copied, see `matches`.
+    """
+
+    VERSION = 3
+
+    def __init__(
+        self, theme: str | None = None, policy: str | None = None, entries=None
+    ) -> None:
+        # the theme name the archive was built with
+        self.theme = theme
+
+        # the compression policy the archive was built with
+        self.policy = policy
+
+        # map from archive paths (relative to the theme folder) to entries
+        self.entries: dict[str, ManifestEntry] = {} if entries is None else entries
+
+    @classmethod
+    def load(cls, path):
+        """Load a manifest, returns an empty manifest if it doesn't exist or is invalid"""
+        try:
+            with open(path, "r", encoding="utf8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cls()
+
+        if not isinstance(data, dict) or data.get("version") != cls.VERSION:
+            return cls()
+
+        entries = {
+            dst: ManifestEntry(*entry) for dst, entry in data["entries"].items()
+        }
+        return cls(data["theme"], data["policy"], entries)
+
+    def save(self, path):
+        data = {
+            "version": self.VERSION,
+            "theme": self.theme,
+            "policy": self.policy,
+            "entries": {dst: list(entry) for dst, entry in self.entries.items()},
+        }
+        with open(path, "w", encoding="utf8") as f:
+            json.dump(data, f, indent=1)
+
+    def check(self, dst: str, src) -> tuple[ManifestEntry, bool]:
+        """
+        Compare a resource with the entry recorded in the last build. Returns the new
+        entry for the resource, and whether the file is unchanged.
+
+        The size and modification time are checked first, the file is only hashed if
+        they are different.
+        """
+        src = str(src)
+        stat = os.stat(src)
+        old = self.entries.get(dst)
+
+        digest = None
+        if old is not None and old.src == src and old.size == stat.st_size:
+            if old.mtime_ns == stat.st_mtime_ns:
+                return old, True
+
+            digest = file_digest(src)
+            if digest == old.digest:
+                return old._replace(mtime_ns=stat.st_mtime_ns), True
+
+        if digest is None:
+            digest = file_digest(src)
+        return ManifestEntry(src, stat.st_size, stat.st_mtime_ns, digest, None), False
+
+    @staticmethod
+    def matches(entry: ManifestEntry, compressed: CompressedEntry):
+        """Whether an entry of the previous archive is the resource in the manifest"""
+        return entry.crc == compressed.CRC and entry.size == compressed.file_size
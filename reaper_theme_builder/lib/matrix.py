@@ -0,0 +1,306 @@
+# This module builds many variants of a theme in one go. Variants are described in a
+# TOML file like this, where paths are relative to the TOML file:
+#
+#     # defaults for every variant
+#     input = "theme"
+#     constants = "constants.ini"
+#     functions = ["functions.py"]
+#     compress = ["png=store"]
+#
+#     [[variant]]
+#     output = "out/Dark.ReaperThemeZip"
+#     constants = "dark.ini"
+#
+#     [[variant]]
+#     output = "out/Light.ReaperThemeZip"
+#     constants = "light.ini"
+#     palette = "light-palette.ini"
+#     config = { "REAPER.ui_img" = "Light" }
+#
+# Each source folder is scanned and its rtconfig and ReaperTheme files are merged only
+# once. Every resource is compressed once and shared between variants. The variants
+# are evaluated in a process pool, then all archives are written in parallel. With a
+# cache folder, each variant only evaluates the expressions that depend on constants
+# that changed since it was last built.
+
+import copy
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+from . import rptheme, rtconfig, walter
+from .archive import CompressedEntry
+from .compress import CompressionPolicy, CompressionReport, compress_files
+from .rptheme import ReaperTheme
+from .scanner import DirInfo
+from .theme import Resource, create_theme
+from .val.constants import ConstantsConfig
+from .val.depgraph import DependencyGraph, graph_path
+from .val.evaluator import Evaluator
+
+try:
+    import tomllib
+except ImportError:
+    # python 3.10
+    tomllib = None
+
+# options that can be given for every variant, or as defaults at the top of the file
+_VARIANT_OPTIONS = {
+    "output",
+    "input",
+    "constants",
+    "config",
+    "minify",
+    "all_resources",
+    "palette",
+    "functions",
+}
+
+
+class Variant(NamedTuple):
+    output: Path
+    input_dir: Path
+    constants_path: Path | None
+    # overrides like ['REAPER.ui_img', 'x'], the same as -c
+    configs: list[list[str]]
+    minify: bool
+    png_only: bool
+    palette_path: Path | None
+    # Python files of extra functions for expressions, the same as --functions
+    function_paths: list[Path]
+
+
+class Matrix(NamedTuple):
+    variants: list[Variant]
+    policy: CompressionPolicy
+
+
+def _load_toml(path):
+    if tomllib is not None:
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+
+    try:
+        import tomli
+    except ImportError:
+        raise ImportError("tomli is required on Python 3.10: pip install tomli")
+
+    with open(path, "rb") as f:
+        return tomli.load(f)
+
+
+def load_matrix(path, function_paths: list[Path] | None = None) -> Matrix:
+    """
+    Load a build matrix from a TOML file. `function_paths` are added to the function
+    modules of every variant.
+    """
+    path = Path(path).absolute()
+    data = _load_toml(path)
+    root = path.parent
+
+    def resolve(value):
+        return None if value is None else (root / value).resolve()
+
+    defaults = {k: v for k, v in data.items() if k in _VARIANT_OPTIONS}
+    unknown = set(data) - _VARIANT_OPTIONS - {"compress", "variant"}
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown options in matrix: {', '.join(sorted(unknown))}")
+
+    variants = []
+    for i, options in enumerate(data.get("variant", [])):
+        unknown = set(options) - _VARIANT_OPTIONS
+        if len(unknown) > 0:
+            raise ValueError(
+                f"Unknown options in variant {i + 1}: {', '.join(sorted(unknown))}"
+            )
+
+        options = {**defaults, **options}
+        for required in ("output", "input"):
+            if required not in options:
+                raise ValueError(f"Variant {i + 1} has no {required!r}")
+
+        output = resolve(options["output"])
+        assert output is not None
+        if output.suffix.lower() != ".reaperthemezip":
+            raise ValueError(f"Output extension must be .ReaperThemeZip: {output}")
+
+        configs = [[k, str(v)] for k, v in options.get("config", {}).items()]
+
+        functions = options.get("functions", [])
+        if isinstance(functions, str):
+            functions = [functions]
+        if not isinstance(functions, list) or not all(
+            isinstance(x, str) for x in functions
+        ):
+            raise ValueError(f"'functions' of variant {i + 1} must be a list of paths")
+        functions = [resolve(x) for x in functions]
+        if function_paths is not None:
+            functions += [Path(x).absolute() for x in function_paths]
+        variants.append(
+            Variant(
+                output,
+                resolve(options["input"]),
+                resolve(options.get("constants")),
+                configs,
+                bool(options.get("minify", False)),
+                not options.get("all_resources", False),
+                resolve(options.get("palette")),
+                functions,
+            )
+        )
+
+    outputs = [v.output for v in variants]
+    if len(set(outputs)) != len(outputs):
+        raise ValueError("Variants must be written to different outputs")
+
+    policy = CompressionPolicy.parse(data.get("compress", []))
+    return Matrix(variants, policy)
+
+
+class _Job(NamedTuple):
+    """Everything a worker process needs to evaluate a variant"""
+
+    input_dir: Path
+    # paths and raw text of the rtconfig files, empty files are skipped
+    rtconfig: list[tuple[str, str]]
+    # merged ReaperTheme files
+    rptheme: ReaperTheme
+    minify: bool
+    constants_path: Path | None
+    configs: list[list[str]]
+    palette_path: Path | None
+    function_paths: list[Path]
+    cache_dir: Path | None
+
+
+def _evaluate(job: _Job):
+    """Evaluate a variant's rtconfig and ReaperTheme, runs in a worker process"""
+    graph = None
+    if job.cache_dir is not None:
+        graph = DependencyGraph.load(
+            graph_path(
+                job.cache_dir, job.input_dir, job.constants_path, minify=job.minify
+            )
+        )
+    evaluator = Evaluator(
+        constants=ConstantsConfig(job.constants_path),
+        cache_dir=job.cache_dir,
+        function_paths=job.function_paths,
+        graph=graph,
+    )
+
+    text = "\n".join(
+        evaluator.parse_file(path, t) for path, t in job.rtconfig if len(t) != 0
+    )
+    if job.minify:
+        text, _ = walter.optimize(text)
+
+    rpt = job.rptheme
+    rptheme.process(rpt, evaluator.parse_single, overrides=job.configs)
+    if job.palette_path is not None:
+        from .palette import Palette
+
+        Palette.from_path(job.palette_path, evaluator.val).apply(rpt)
+
+    evaluator.save_cache()
+    return text, rpt
+
+
+def build_matrix(
+    matrix: Matrix,
+    *,
+    jobs: int | None = None,
+    cache_dir: Path | None = None,
+    verbose=False,
+):
+    """Build every variant in a matrix, returns the compression report"""
+
+    def log(*x):
+        if verbose:
+            print(*x)
+
+    # scan each source folder once, variants that include other resources reuse
+    # the same listings
+    scans: dict[tuple[Path, bool], DirInfo] = {}
+    for v in matrix.variants:
+        key = (v.input_dir, v.png_only)
+        if key in scans:
+            continue
+
+        other = scans.get((v.input_dir, not v.png_only))
+        if other is None:
+            print(f"Scanning folder: {v.input_dir}")
+            scans[key] = DirInfo.scan(v.input_dir, png_only=v.png_only, jobs=jobs)
+        else:
+            scans[key] = DirInfo(v.input_dir, v.png_only, other._listings)
+
+    # merge the rtconfig and ReaperTheme files of each source folder once
+    rtconfigs: dict[tuple[Path, bool], list[tuple[str, str]]] = {}
+    rpthemes: dict[Path, ReaperTheme] = {}
+    for v in matrix.variants:
+        dirinfo = scans[(v.input_dir, v.png_only)]
+        if (v.input_dir, v.minify) not in rtconfigs:
+            rtconfigs[(v.input_dir, v.minify)] = [
+                (p, rtconfig.from_path(p, minify=v.minify))
+                for p in dirinfo.rtconfig_paths()
+            ]
+        if v.input_dir not in rpthemes:
+            rpthemes[v.input_dir] = rptheme.from_paths(dirinfo.rptheme_paths())
+
+    # compress every resource once, for all variants
+    resources: dict[tuple[Path, bool], list[Resource]] = {
+        key: [Resource(Path(src), Path(dst)) for src, dst in dirinfo.filemap()]
+        for key, dirinfo in scans.items()
+    }
+    paths = list(dict.fromkeys(str(r.src) for res in resources.values() for r in res))
+    print(f"Compressing {len(paths)} resources...")
+    report = CompressionReport()
+    compressed: dict[str, CompressedEntry] = dict(
+        zip(paths, compress_files(paths, matrix.policy, jobs=jobs, report=report))
+    )
+    log(report.format())
+
+    # evaluate the variants in parallel
+    print(f"Evaluating {len(matrix.variants)} variants...")
+    start = time.perf_counter()
+    job_list = [
+        _Job(
+            v.input_dir,
+            rtconfigs[(v.input_dir, v.minify)],
+            copy.deepcopy(rpthemes[v.input_dir]),
+            v.minify,
+            v.constants_path,
+            v.configs,
+            v.palette_path,
+            v.function_paths,
+            cache_dir,
+        )
+        for v in matrix.variants
+    ]
+    if jobs == 1 or len(job_list) == 1:
+        results = [_evaluate(job) for job in job_list]
+    else:
+        with ProcessPoolExecutor(jobs) as executor:
+            results = list(executor.map(_evaluate, job_list))
+    log(f"  Evaluated in {time.perf_counter() - start:.2f}s")
+
+    def write(args):
+        variant, (text, rpt) = args
+        variant.output.parent.mkdir(parents=True, exist_ok=True)
+        create_theme(
+            variant.output,
+            rtconfig=text,
+            rptheme=rpt,
+            resources=resources[(variant.input_dir, variant.png_only)],
+            policy=matrix.policy,
+            compressed=compressed,
+        )
+        return variant.output
+
+    # write the archives in parallel, all resources are already compressed
+    with ThreadPoolExecutor(jobs) as executor:
+        for output in executor.map(write, zip(matrix.variants, results)):
+            print(f"  [written] {output}")
+
+    return report
@@ -0,0 +1,309 @@
+# This module recolours a ReaperTheme in bulk. All colour values are decoded into a
+# NumPy array and transformed together, then encoded again with the same functions
+# used in expressions (`rgb()` and `blend()`).
+#
+# A palette spec is an ini file like this, every option is optional:
+#
+#     [transform]
+#     ; degrees added to the hue of every colour
+#     hue = 180
+#     ; multipliers for the saturation and lightness
+#     saturation = 0.8
+#     lightness = 1.1
+#     ; gamma applied to the lightness, < 1 brightens dark colours
+#     curve = 0.9
+#     ; scale colours away from (> 1) or towards (< 1) middle grey
+#     contrast = 1.2
+#     ; flip the lightness of every colour, to turn a dark theme into a light one
+#     invert = true
+#     ; multiplier for the fraction of blend values
+#     opacity = 1.0
+#
+#     [palette]
+#     ; snap every colour to the nearest of these colours
+#     bg = rgb(30, 30, 30)
+#     fg = rev(0xEEEEEE)
+#
+#     [keys]
+#     ; sections containing colours
+#     sections = color theme
+#     ; keys that are always treated as colours, blends or skipped (glob patterns),
+#     ; by default keys ending with 'dm' are blends
+#     colors = col_*
+#     blends = *dm
+#     skip = col_main_bg2
+
+import fnmatch
+from configparser import ConfigParser
+from typing import Any, Callable
+
+from .rptheme import ReaperTheme
+from .val.funcs import BLEND_MODES, blend, rgb
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COLOR = "color"
+BLEND = "blend"
+
+# the section REAPER stores theme colours in
+COLOR_SECTION = "color theme"
+
+# blend values have this bit set, see `blend()`
+BLEND_FLAG = 0b100000000000000000
+
+# REAPER's draw mode keys, like 'col_gridlines2dm', always hold blend values
+DEFAULT_BLEND_KEYS = ["*dm"]
+
+# map from blend mode values to their names, like 'add'
+BLEND_MODE_NAMES = {v: k for k, v in BLEND_MODES.items()}
+
+
+def is_blend(value: int):
+    """Whether a value could have been encoded by `blend()`"""
+    if not BLEND_FLAG <= value < BLEND_FLAG << 1:
+        return False
+
+    frac = (value >> 8) & 0b111111111
+    return value & 0xFF in BLEND_MODE_NAMES and frac <= 256
+
+
+def _split_patterns(text: str):
+    return [p.strip() for p in text.replace("\n", ",").split(",") if p.strip()]
+
+
+def matches_any(key: str, patterns: list[str]):
+    """Whether a key matches any of the patterns, like '*dm'"""
+    return any(fnmatch.fnmatchcase(key, p) for p in patterns)
+
+
+def _rgb_to_hls(rgb):
+    """Vectorised version of `colorsys.rgb_to_hls`, for an array of shape (n, 3)"""
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    maxc = rgb.max(axis=1)
+    minc = rgb.min(axis=1)
+    sumc = maxc + minc
+    rangec = maxc - minc
+    l = sumc / 2
+
+    # avoid dividing by zero for greys, their hue and saturation are 0
+    grey = rangec == 0
+    safe_range = np.where(grey, 1, rangec)
+
+    s = np.where(l <= 0.5, rangec / np.where(grey, 1, sumc), 0)
+    s = np.where(l > 0.5, rangec / np.where(grey, 1, 2 - sumc), s)
+
+    rc = (maxc - r) / safe_range
+    gc = (maxc - g) / safe_range
+    bc = (maxc - b) / safe_range
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2 + rc - bc, 4 + gc - rc))
+    h = (h / 6) % 1
+
+    h = np.where(grey, 0, h)
+    s = np.where(grey, 0, s)
+    return h, l, s
+
+
+def _hue_to_channel(m1, m2, hue):
+    hue = hue % 1
+    return np.select(
+        [hue < 1 / 6, hue < 0.5, hue < 2 / 3],
+        [m1 + (m2 - m1) * hue * 6, m2, m1 + (m2 - m1) * (2 / 3 - hue) * 6],
+        m1,
+    )
+
+
+def _hls_to_rgb(h, l, s):
+    """Vectorised version of `colorsys.hls_to_rgb`, returns an array of shape (n, 3)"""
+    m2 = np.where(l <= 0.5, l * (1 + s), l + s - l * s)
+    m1 = 2 * l - m2
+    rgb = np.stack(
+        [
+            _hue_to_channel(m1, m2, h + 1 / 3),
+            _hue_to_channel(m1, m2, h),
+            _hue_to_channel(m1, m2, h - 1 / 3),
+        ],
+        axis=1,
+    )
+    grey = (s == 0)[:, None]
+    return np.where(grey, l[:, None], rgb)
+
+
+class Palette:
+    """A set of colour transforms applied to every colour in a ReaperTheme"""
+
+    def __init__(
+        self,
+        *,
+        hue=0.0,
+        saturation=1.0,
+        lightness=1.0,
+        curve=1.0,
+        contrast=1.0,
+        invert=False,
+        opacity=1.0,
+        colors: list[int] | None = None,
+        sections: list[str] | None = None,
+        color_keys: list[str] | None = None,
+        blend_keys: list[str] | None = None,
+        skip_keys: list[str] | None = None,
+    ) -> None:
+        if np is None:
+            raise ImportError(
+                "NumPy is required for palettes:"
+                " pip install 'reaper-theme-builder[palette]'"
+            )
+
+        self.hue = hue
+        self.saturation = saturation
+        self.lightness = lightness
+        self.curve = curve
+        self.contrast = contrast
+        self.invert = invert
+        self.opacity = opacity
+
+        # colours to snap to, encoded like `rgb()`
+        self.colors = [] if colors is None else colors
+
+        self.sections = [COLOR_SECTION] if sections is None else sections
+        self.color_keys = [] if color_keys is None else color_keys
+        self.blend_keys = DEFAULT_BLEND_KEYS if blend_keys is None else blend_keys
+        self.skip_keys = [] if skip_keys is None else skip_keys
+
+    @classmethod
+    def from_path(cls, path, val: Callable[[str], Any]):
+        """
+        Load a palette spec. Colours in the [palette] section are evaluated with `val`,
+        so they can be written like any other value.
+        """
+        config = ConfigParser()
+        with open(path, "r", encoding="utf8") as f:
+            config.read_file(f)
+
+        kwargs = {}
+        if config.has_section("transform"):
+            section = config["transform"]
+            for name in ("hue", "saturation", "lightness", "curve", "contrast"):
+                if name in section:
+                    kwargs[name] = section.getfloat(name)
+            if "opacity" in section:
+                kwargs["opacity"] = section.getfloat("opacity")
+            if "invert" in section:
+                kwargs["invert"] = section.getboolean("invert")
+
+        if config.has_section("palette"):
+            kwargs["colors"] = [int(val(v)) for v in config["palette"].values()]
+
+        if config.has_section("keys"):
+            section = config["keys"]
+            for option, name in (
+                ("sections", "sections"),
+                ("colors", "color_keys"),
+                ("blends", "blend_keys"),
+                ("skip", "skip_keys"),
+            ):
+                if option in section:
+                    kwargs[name] = _split_patterns(section[option])
+
+        return cls(**kwargs)
+
+    def classify(self, key: str, value: int):
+        """Returns COLOR or BLEND if the value should be transformed, otherwise None"""
+        if matches_any(key, self.skip_keys):
+            return None
+
+        # negative values mean 'no colour' or 'use the default'
+        if value < 0:
+            return None
+
+        if matches_any(key, self.blend_keys):
+            return BLEND if is_blend(value) else None
+        if matches_any(key, self.color_keys):
+            return COLOR if value <= 0xFFFFFF else None
+
+        # otherwise guess from the value. a few very dark colours look like blend
+        # values, these can be listed in `colors` to treat them as colours
+        if is_blend(value):
+            return BLEND
+        return COLOR if value <= 0xFFFFFF else None
+
+    def transform(self, colors):
+        """Transform an array of RGB colours with shape (n, 3) and values from 0 to 1"""
+        h, l, s = _rgb_to_hls(colors)
+
+        if self.invert:
+            l = 1 - l
+        h = (h + self.hue / 360) % 1
+        s = np.clip(s * self.saturation, 0, 1)
+        l = np.clip(l * self.lightness, 0, 1) ** self.curve
+
+        colors = _hls_to_rgb(h, l, s)
+        colors = np.clip((colors - 0.5) * self.contrast + 0.5, 0, 1)
+
+        if len(self.colors) > 0:
+            colors = self._snap(colors)
+
+        return colors
+
+    def _snap(self, colors):
+        palette = np.array(
+            [[c & 0xFF, (c >> 8) & 0xFF, (c >> 16) & 0xFF] for c in self.colors],
+            dtype=np.float64,
+        )
+        palette /= 255
+
+        # squared distance from every colour to every palette colour
+        distance = ((colors[:, None, :] - palette[None, :, :]) ** 2).sum(axis=2)
+        return palette[distance.argmin(axis=1)]
+
+    def apply(self, rpt: ReaperTheme):
+        """Recolour the theme in place, returns the number of values changed"""
+        color_refs: list[tuple[str, str]] = []
+        color_values: list[int] = []
+        blend_refs: list[tuple[str, str, int]] = []
+
+        for section in self.sections:
+            if not rpt.has_section(section):
+                continue
+
+            for key, text in rpt[section].items():
+                try:
+                    value = int(text)
+                except ValueError:
+                    continue
+
+                kind = self.classify(key, value)
+                if kind == COLOR:
+                    color_refs.append((section, key))
+                    color_values.append(value)
+                elif kind == BLEND:
+                    blend_refs.append((section, key, value))
+
+        changed = 0
+
+        if len(color_values) > 0:
+            values = np.array(color_values, dtype=np.int64)
+            colors = np.stack(
+                [values & 0xFF, (values >> 8) & 0xFF, (values >> 16) & 0xFF], axis=1
+            )
+            colors = self.transform(colors / 255)
+            channels = np.rint(colors * 255).astype(np.int64)
+            encoded = rgb(channels[:, 0], channels[:, 1], channels[:, 2])
+
+            for (section, key), old, new in zip(color_refs, color_values, encoded):
+                if old != new:
+                    rpt[section][key] = str(int(new))
+                    changed += 1
+
+        # blends are rare, so they are encoded one at a time
+        for section, key, value in blend_refs:
+            mode = BLEND_MODE_NAMES[value & 0xFF]
+            frac = ((value >> 8) & 0b111111111) / 256
+            new = blend(mode, min(max(frac * self.opacity, 0), 1))
+            if new != value:
+                rpt[section][key] = str(new)
+                changed += 1
+
+        return changed
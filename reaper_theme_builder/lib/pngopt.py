@@ -0,0 +1,311 @@
+# This module losslessly shrinks PNG resources before they are added to a theme. PNGs
+# are already compressed, so the archive can't make them any smaller, and the size of
+# the theme is set entirely by how well the source files were saved.
+#
+# For each image:
+#
+# - chunks that don't change the decoded pixels (text, timestamps, colour profiles and
+#   other metadata) are dropped
+# - the pixel data is filtered again with each PNG filter type, and with an adaptive
+#   filter chosen per row, then compressed with different zlib strategies
+# - the smallest result is kept, or the original file if nothing is smaller
+#
+# Images are optimized in a process pool. Outputs are cached by the hash of the input
+# file, so only new or changed images are optimized again. Outputs that are no longer
+# used can be removed with `rtb cache`.
+
+import hashlib
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import NamedTuple
+
+from .cache import is_cached
+from .manifest import file_digest
+from .utils import tmp_suffix
+
+# bump this when the output of the optimizer changes, to invalidate existing caches
+PNG_OPTIMIZER_VERSION = 1
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# the chunks needed to decode the pixels, REAPER ignores colour management chunks
+_KEEP = {b"IHDR", b"PLTE", b"tRNS", b"IDAT", b"IEND"}
+
+# channels per pixel for each colour type
+_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+_STRATEGIES = (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED)
+
+
+class _Chunk(NamedTuple):
+    type: bytes
+    data: bytes
+
+
+def _read_chunks(data: bytes):
+    """Split a PNG into chunks, raises ValueError if it isn't a valid PNG"""
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG file")
+
+    chunks: list[_Chunk] = []
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length, type_ = struct.unpack(">I4s", data[pos : pos + 8])
+        if pos + 12 + length > len(data):
+            raise ValueError(f"Truncated {type_!r} chunk")
+
+        body = data[pos + 8 : pos + 8 + length]
+        (crc,) = struct.unpack(">I", data[pos + 8 + length : pos + 12 + length])
+        if zlib.crc32(type_ + body) != crc:
+            raise ValueError(f"Corrupt {type_!r} chunk")
+
+        chunks.append(_Chunk(type_, body))
+        pos += 12 + length
+        if type_ == b"IEND":
+            break
+
+    if len(chunks) == 0 or chunks[0].type != b"IHDR" or chunks[-1].type != b"IEND":
+        raise ValueError("Missing IHDR or IEND chunk")
+    if len(chunks[0].data) != 13:
+        raise ValueError("Invalid IHDR chunk")
+    return chunks
+
+
+def _write_chunks(chunks: list[_Chunk]):
+    parts = [PNG_SIGNATURE]
+    for type_, body in chunks:
+        parts.append(struct.pack(">I4s", len(body), type_))
+        parts.append(body)
+        parts.append(struct.pack(">I", zlib.crc32(type_ + body)))
+    return b"".join(parts)
+
+
+def _paeth(a: int, b: int, c: int):
+    p = a + b - c
+    pa = abs(p - a)
+    pb = abs(p - b)
+    pc = abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+def _unfilter(data: bytes, height: int, stride: int, bpp: int):
+    """Undo the filter of each row, returns the raw rows"""
+    if len(data) != height * (stride + 1):
+        raise ValueError("Unexpected size of image data")
+
+    rows: list[bytes] = []
+    prev = bytes(stride)
+    for y in range(height):
+        start = y * (stride + 1)
+        filter_type = data[start]
+        row = bytearray(data[start + 1 : start + 1 + stride])
+
+        if filter_type == 1:
+            for i in range(bpp, stride):
+                row[i] = (row[i] + row[i - bpp]) & 0xFF
+        elif filter_type == 2:
+            row = bytearray((x + u) & 0xFF for x, u in zip(row, prev))
+        elif filter_type == 3:
+            for i in range(stride):
+                left = row[i - bpp] if i >= bpp else 0
+                row[i] = (row[i] + ((left + prev[i]) >> 1)) & 0xFF
+        elif filter_type == 4:
+            for i in range(stride):
+                if i >= bpp:
+                    pred = _paeth(row[i - bpp], prev[i], prev[i - bpp])
+                else:
+                    pred = prev[i]
+                row[i] = (row[i] + pred) & 0xFF
+        elif filter_type != 0:
+            raise ValueError(f"Unknown filter type {filter_type}")
+
+        prev = bytes(row)
+        rows.append(prev)
+
+    return rows
+
+
+def _filter_row(filter_type: int, row: bytes, prev: bytes, bpp: int):
+    """Filter a row, returns the filtered bytes without the filter type"""
+    if filter_type == 0:
+        return row
+
+    left = bytes(bpp) + row[:-bpp]
+    if filter_type == 1:
+        return bytes((x - a) & 0xFF for x, a in zip(row, left))
+    if filter_type == 2:
+        return bytes((x - b) & 0xFF for x, b in zip(row, prev))
+    if filter_type == 3:
+        return bytes((x - ((a + b) >> 1)) & 0xFF for x, a, b in zip(row, left, prev))
+
+    upper_left = bytes(bpp) + prev[:-bpp]
+    return bytes(
+        (x - _paeth(a, b, c)) & 0xFF for x, a, b, c in zip(row, left, prev, upper_left)
+    )
+
+
+# bytes as the size of a signed value, summed to estimate how well a row compresses
+_COST = bytes(x if x < 128 else 256 - x for x in range(256))
+
+
+def _filter_candidates(rows: list[bytes], bpp: int):
+    """Yield the image data filtered with each filter type, and adaptively per row"""
+    if len(rows) == 0:
+        return
+
+    prev = bytes(len(rows[0]))
+    # for each filter type, the filtered rows with the filter type byte
+    filtered: list[list[bytes]] = [[] for _ in range(5)]
+    adaptive: list[bytes] = []
+    for row in rows:
+        options = [_filter_row(t, row, prev, bpp) for t in range(5)]
+        for t, option in enumerate(options):
+            filtered[t].append(bytes((t,)) + option)
+
+        # the usual heuristic: the filter with the smallest sum of signed values
+        best = min(range(5), key=lambda t: sum(options[t].translate(_COST)))
+        adaptive.append(filtered[best][-1])
+        prev = row
+
+    for t in range(5):
+        yield b"".join(filtered[t])
+    yield b"".join(adaptive)
+
+
+def _compress(data: bytes):
+    """Compress with each zlib strategy, returns the smallest result"""
+    best = None
+    for strategy in _STRATEGIES:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+        result = compressor.compress(data) + compressor.flush()
+        if best is None or len(result) < len(best):
+            best = result
+    assert best is not None
+    return best
+
+
+def optimize_png(data: bytes):
+    """
+    Losslessly shrink a PNG, returns the smallest encoding found, which is the input
+    itself if nothing smaller was found or the file can't be optimized
+    """
+    try:
+        chunks = _read_chunks(data)
+    except ValueError:
+        # not something we can decode, keep it as it is
+        return data
+
+    if any(c.type == b"acTL" for c in chunks):
+        # dropping the frames of an animated PNG would change the image
+        return data
+
+    width, height, depth, color_type, _, _, interlace = struct.unpack(
+        ">IIBBBBB", chunks[0].data
+    )
+    idat = b"".join(c.data for c in chunks if c.type == b"IDAT")
+    try:
+        raw = zlib.decompress(idat)
+    except zlib.error:
+        return data
+
+    # the already filtered data is always a candidate, only its compression changes
+    candidates = [raw]
+    if interlace == 0 and color_type in _CHANNELS:
+        channels = _CHANNELS[color_type]
+        stride = (width * channels * depth + 7) // 8
+        bpp = max(1, channels * depth // 8)
+        try:
+            rows = _unfilter(raw, height, stride, bpp)
+        except ValueError:
+            return data
+        candidates.extend(_filter_candidates(rows, bpp))
+
+    best = idat
+    for candidate in candidates:
+        compressed = _compress(candidate)
+        if len(compressed) < len(best):
+            best = compressed
+
+    kept: list[_Chunk] = []
+    for chunk in chunks:
+        if chunk.type == b"IDAT":
+            # all image data is written to a single IDAT chunk, in place of the first
+            if not any(c.type == b"IDAT" for c in kept):
+                kept.append(_Chunk(b"IDAT", best))
+        elif chunk.type in _KEEP:
+            kept.append(chunk)
+
+    result = _write_chunks(kept)
+    return result if len(result) < len(data) else data
+
+
+def run_optimize(src: str, dst: str):
+    """Optimize a PNG file and save it, runs in a worker process"""
+    with open(src, "rb") as f:
+        data = f.read()
+
+    tmp_path = f"{dst}.{tmp_suffix()}.png"
+    with open(tmp_path, "wb") as f:
+        f.write(optimize_png(data))
+    os.replace(tmp_path, dst)
+
+
+class PngStats(NamedTuple):
+    optimized: int
+    cached: int
+    bytes_in: int
+    bytes_out: int
+
+
+def optimize_pngs(
+    filemap: list[tuple[str, str]], cache_dir: Path, *, jobs: int | None = None
+):
+    """
+    Optimize the PNGs in a filemap, reusing cached outputs. Returns the filemap with
+    PNGs replaced by their optimized files, and how many were optimized.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # map from source files to optimized files
+    outputs: dict[str, str] = {}
+    # map from optimized files that don't exist yet to their source files
+    pending: dict[str, str] = {}
+
+    for src, dst in filemap:
+        if not dst.lower().endswith(".png") or src in outputs:
+            continue
+
+        key = f"{PNG_OPTIMIZER_VERSION}\0{file_digest(src)}"
+        name = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        out_path = os.path.join(cache_dir, f"{name}.png")
+        outputs[src] = out_path
+
+        if not is_cached(out_path):
+            pending[out_path] = src
+
+    if len(pending) > 0:
+        srcs = list(pending.values())
+        dsts = list(pending.keys())
+
+        if jobs == 1 or len(pending) == 1:
+            for args in zip(srcs, dsts):
+                run_optimize(*args)
+        else:
+            # multiprocessing is slow to import, so only import it when it is used
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(jobs) as executor:
+                # consume the results, to raise any errors
+                for _ in executor.map(run_optimize, srcs, dsts):
+                    pass
+
+    bytes_in = sum(os.path.getsize(src) for src in outputs)
+    bytes_out = sum(os.path.getsize(out) for out in outputs.values())
+
+    result = [(outputs.get(src, src), dst) for src, dst in filemap]
+    stats = PngStats(len(pending), len(outputs) - len(pending), bytes_in, bytes_out)
+    return result, stats
@@ -0,0 +1,591 @@
+import contextlib
+import functools
+import hashlib
+import itertools
+import os
+import sys
+import tempfile
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Iterable
+
+from . import rptheme, rtconfig, walter
+from .archive import CompressedEntry, read_digest
+from .cache import PNG_CACHE, TRANSFORM_CACHE
+from .compress import CompressionPolicy
+from .manifest import BuildManifest, file_digest
+from .pngopt import optimize_pngs
+from .scanner import DirInfo, is_rtconfig, snapshot_path
+from .theme import Resource, create_theme, write_theme
+from .timings import Timings
+from .transform import TransformSpec, apply_transforms
+from .val.constants import ConstantsConfig
+from .val.depgraph import DependencyGraph, graph_path
+from .val.evaluator import Evaluator, expressions
+from .val.formatter import Template, compile_double
+
+
+# bump this when the inputs of a build change, to invalidate existing digests
+DIGEST_VERSION = 1
+
+
+@functools.cache
+def _builder_digest():
+    """Hash the source of the builder, as a different builder may build differently"""
+    root = Path(__file__).parent.parent
+    h = hashlib.blake2b(digest_size=16)
+    for path in sorted(root.rglob("*.py")):
+        h.update(f"{path.relative_to(root).as_posix()}\0{file_digest(path)}\0".encode())
+    return h.hexdigest()
+
+
+def _tee(pieces: Iterable[str], path: Path):
+    """Write pieces of text to a file as they pass through"""
+    with open(path, "w", encoding="utf8") as f:
+        for piece in pieces:
+            f.write(piece)
+            yield piece
+
+
+class Project:
+    """
+    The state of a theme source folder between builds.
+
+    The scanned folder, the evaluated rtconfig files and the evaluator are kept in
+    memory, so after some files change only the affected parts need to be updated
+    before building again.
+    """
+
+    def __init__(
+        self,
+        input_dir: Path,
+        *,
+        png_only=True,
+        minify=False,
+        constants_path: Path | None = None,
+        function_paths: list[Path] | None = None,
+        palette_path: Path | None = None,
+        transforms_path: Path | None = None,
+        optimize_png=False,
+        configs: list[list[str]] | None = None,
+        policy: CompressionPolicy | None = None,
+        jobs: int | None = None,
+        eval_jobs: int | None = None,
+        cache_dir: Path | None = None,
+        reproducible=False,
+        warm=False,
+        verbose=False,
+    ) -> None:
+        # convert to absolute path to ensure we can get the directory name
+        self.input_dir = Path(input_dir).absolute().resolve()
+        self.png_only = png_only
+        self.minify = minify
+        self.constants_path = constants_path
+        self.function_paths = [] if function_paths is None else function_paths
+        self.palette_path = palette_path
+        self.transforms_path = transforms_path
+        self.optimize_png = optimize_png
+        self.configs = [] if configs is None else configs
+        self.policy = policy
+        self.jobs = jobs
+        # processes to evaluate rtconfig expressions in, 1 or None to evaluate them in
+        # this process
+        self.eval_jobs = eval_jobs
+        self.cache_dir = cache_dir
+        # write archives that only depend on the inputs, and skip builds whose inputs
+        # are the same as those of the existing archive
+        self.reproducible = reproducible
+        # keep processed rtconfig files in memory, to speed up the next build
+        self.warm = warm
+        self.verbose = verbose
+
+        # manifest of the last build, used to reuse compressed resources
+        self.manifest: BuildManifest | None = None
+
+        # compressed resources of the last build, when it was written to a stream
+        self._previous: dict[str, CompressedEntry] = {}
+
+        # when set, the time taken by each stage of a build is recorded
+        self.timings: Timings | None = None
+
+        self._dirinfo: DirInfo | None = None
+        self._evaluator: Evaluator | None = None
+        # values and outputs of the last build, and the constants they depend on
+        self._graph: DependencyGraph | None = None
+        self._palette = None
+        self._transforms: TransformSpec | None = None
+
+        # holds transformed and optimized resources when caching is disabled
+        self._transform_tmpdir: tempfile.TemporaryDirectory | None = None
+
+        # map from rtconfig paths to their processed contents
+        self._rtconfig_cache: dict[str, str | None] = {}
+
+        # map from rtconfig paths to their tokenized contents, which stay valid when
+        # only the constants change
+        self._rtconfig_templates: dict[str, Template] = {}
+
+        # map from raw ReaperTheme values to processed values
+        self._rptheme_cache: dict[str, str] = {}
+
+    def log(self, *x):
+        if not self.verbose:
+            return
+
+        print(*x)
+
+    @property
+    def dirinfo(self):
+        if self._dirinfo is None:
+            print(f"Scanning folder: {self.input_dir}")
+            self._dirinfo = DirInfo.scan(
+                self.input_dir,
+                png_only=self.png_only,
+                jobs=self.jobs,
+                snapshot=self.snapshot_path(),
+            )
+            self.log(f"  Reused {self._dirinfo.reused} unchanged folder listings")
+
+        return self._dirinfo
+
+    def _stage(self, name: str):
+        if self.timings is None:
+            return contextlib.nullcontext()
+        return self.timings.stage(name)
+
+    def snapshot_path(self):
+        """The path of the folder scan snapshot, or None if caching is disabled"""
+        if self.cache_dir is None:
+            return None
+
+        return snapshot_path(self.cache_dir, self.input_dir)
+
+    @property
+    def evaluator(self):
+        if self._evaluator is None:
+            constants = ConstantsConfig(self.constants_path)
+            self.log(f"  Loaded {len(constants)} constants")
+            if self._graph is None and self.cache_dir is not None:
+                self._graph = DependencyGraph.load(
+                    graph_path(
+                        self.cache_dir,
+                        self.input_dir,
+                        self.constants_path,
+                        minify=self.minify,
+                    )
+                )
+            self._evaluator = Evaluator(
+                constants=constants,
+                cache_dir=self.cache_dir,
+                timings=self.timings,
+                function_paths=self.function_paths,
+                graph=self._graph,
+            )
+            if self._graph is not None:
+                self.log(
+                    f"  Reusing {len(self._graph.values)} values from the last build,"
+                    f" {self._evaluator.invalidated} depended on changed constants"
+                )
+
+        return self._evaluator
+
+    @property
+    def palette(self):
+        if self._palette is None and self.palette_path is not None:
+            # only import NumPy when a palette is used
+            from .palette import Palette
+
+            self._palette = Palette.from_path(self.palette_path, self.evaluator.val)
+
+        return self._palette
+
+    @property
+    def transforms(self):
+        if self._transforms is None and self.transforms_path is not None:
+            self._transforms = TransformSpec.from_path(
+                self.transforms_path, self.evaluator.val
+            )
+
+        return self._transforms
+
+    def _resource_dir(self, name: str):
+        """The folder to store generated resources in, kept between builds"""
+        if self.cache_dir is not None:
+            return Path(self.cache_dir) / name
+
+        if self._transform_tmpdir is None:
+            self._transform_tmpdir = tempfile.TemporaryDirectory()
+        return Path(self._transform_tmpdir.name) / name
+
+    def update(self, paths):
+        """
+        Update the project after the given paths were modified, created or deleted.
+        Returns True if any of the paths affect the built theme.
+        """
+        changed = False
+        rescan = []
+
+        function_paths = {os.path.abspath(p) for p in self.function_paths}
+        for path in paths:
+            path = os.path.abspath(path)
+
+            if path in function_paths or (
+                self.constants_path is not None
+                and os.path.abspath(self.constants_path) == path
+            ):
+                # every processed value may depend on the constants and functions
+                self._evaluator = None
+                self._palette = None
+                self._transforms = None
+                self._rtconfig_cache.clear()
+                self._rptheme_cache.clear()
+                changed = True
+                continue
+
+            if self.palette_path is not None and os.path.abspath(
+                self.palette_path
+            ) == os.path.abspath(path):
+                self._palette = None
+                changed = True
+                continue
+
+            if self.transforms_path is not None and os.path.abspath(
+                self.transforms_path
+            ) == os.path.abspath(path):
+                self._transforms = None
+                changed = True
+                continue
+
+            if os.path.commonpath([self.input_dir, path]) != str(self.input_dir):
+                continue
+
+            if is_rtconfig(path):
+                self._rtconfig_cache.pop(path, None)
+                self._rtconfig_templates.pop(path, None)
+
+            rescan.append(path)
+            changed = True
+
+        if self._dirinfo is not None and len(rescan) > 0:
+            self._dirinfo.rescan(rescan)
+
+        return changed
+
+    def resources(self):
+        filemap = self.dirinfo.filemap()
+
+        if self.transforms is not None:
+            transforms = self.transforms.plan(filemap)
+            filemap, stats = apply_transforms(
+                filemap,
+                transforms,
+                self._resource_dir(TRANSFORM_CACHE),
+                jobs=self.jobs,
+            )
+            self.log(
+                f"  Transformed {stats.transformed} resources, reused {stats.cached}"
+            )
+
+        if self.optimize_png:
+            filemap, png_stats = optimize_pngs(
+                filemap, self._resource_dir(PNG_CACHE), jobs=self.jobs
+            )
+            self.log(
+                f"  Optimized {png_stats.optimized} PNGs, reused {png_stats.cached}"
+                f" ({png_stats.bytes_in} bytes to {png_stats.bytes_out} bytes)"
+            )
+
+        return [Resource(Path(src), Path(dst)) for src, dst in filemap]
+
+    def _template(self, path: str):
+        template = self._rtconfig_templates.get(path)
+        if template is None:
+            text = rtconfig.from_path(path, minify=self.minify)
+            if self._graph is not None:
+                template = self._graph.template(path, text)
+            else:
+                template = compile_double(text)
+            if self.warm:
+                self._rtconfig_templates[path] = template
+        return template
+
+    def rtconfig(self):
+        """Merge and process all rtconfig files, yields the output in pieces"""
+        paths = self.dirinfo.rtconfig_paths()
+        evaluator = self.evaluator
+        graph = self._graph
+
+        # with more than one evaluation job, the expressions of every file that isn't
+        # cached are evaluated up front in a process pool
+        values = None
+        templates: dict[str, Template] = {}
+        if self.eval_jobs is not None and self.eval_jobs > 1:
+            templates = {
+                p: self._template(p) for p in paths if p not in self._rtconfig_cache
+            }
+            values = evaluator.evaluate_many(
+                (
+                    raw
+                    for p, t in templates.items()
+                    if graph is None or graph.output(p) is None
+                    for raw in expressions(t)
+                ),
+                jobs=self.eval_jobs,
+            )
+
+        first = True
+        for path in paths:
+            if path in self._rtconfig_cache:
+                text = self._rtconfig_cache[path]
+                # some rtconfig files may be empty, these are skipped when merging
+                if text is None:
+                    continue
+
+                if not first:
+                    yield "\n"
+                first = False
+
+                yield text
+                continue
+
+            if graph is None and not self.warm and values is None:
+                raw = rtconfig.iter_path(path, minify=self.minify)
+                head = next(raw, None)
+                if head is None:
+                    continue
+
+                if not first:
+                    yield "\n"
+                first = False
+
+                yield from evaluator.iter_double(itertools.chain([head], raw))
+                continue
+
+            template = templates.get(path) or self._template(path)
+            if template == (("", None),):
+                if self.warm:
+                    self._rtconfig_cache[path] = None
+                continue
+
+            if not first:
+                yield "\n"
+            first = False
+
+            if graph is not None:
+                # files whose expressions don't depend on changed constants are reused
+                # from the last build, others only evaluate the expressions that do
+                text = graph.output(path)
+                if text is None:
+                    text = "".join(evaluator.render(template, values))
+                    graph.set_output(path, text)
+                if self.warm:
+                    self._rtconfig_cache[path] = text
+                yield text
+                continue
+
+            pieces = evaluator.render(template, values)
+            if not self.warm:
+                yield from pieces
+                continue
+
+            result = []
+            for piece in pieces:
+                result.append(piece)
+                yield piece
+            self._rtconfig_cache[path] = "".join(result)
+
+    def optimize(self, pieces: Iterable[str]):
+        """
+        Optimize the WALTER code of a processed rtconfig, for --minify. The optimizer
+        needs the whole file, so the pieces are joined in memory first.
+        """
+        text, stats = walter.optimize("".join(pieces))
+        self.log(
+            f"  Optimized rtconfig from {stats.bytes_in} to {stats.bytes_out} bytes:"
+            f" folded {stats.folded} expressions, removed {stats.removed} lines,"
+            f" renamed {stats.renamed} temporaries"
+        )
+        yield text
+
+    def rptheme(self):
+        """Merge and process all ReaperTheme files"""
+        rpt = rptheme.from_paths(self.dirinfo.rptheme_paths())
+
+        # assign extra configs from the command line, then evaluate every value
+        rptheme.process(
+            rpt,
+            self.evaluator.parse_single,
+            overrides=self.configs,
+            cache=self._rptheme_cache,
+        )
+
+        if self.palette is not None:
+            changed = self.palette.apply(rpt)
+            self.log(f"  Recoloured {changed} values")
+
+        return rpt
+
+    def input_digest(self, name: str):
+        """
+        A digest of everything a theme named `name` is built from: the source files,
+        the constants, functions, palette and transforms, the options that change the
+        output, and the builder itself
+        """
+        h = hashlib.blake2b(digest_size=16)
+
+        def add(*parts):
+            for part in parts:
+                h.update(f"{part}\0".encode())
+
+        add(
+            f"digest={DIGEST_VERSION}",
+            _builder_digest(),
+            f"python={sys.version_info[0]}.{sys.version_info[1]}",
+            f"zlib={zlib.ZLIB_RUNTIME_VERSION}",
+            name,
+            self.png_only,
+            self.minify,
+            self.optimize_png,
+            self.policy,
+            self.configs,
+        )
+        for path in (
+            self.constants_path,
+            *self.function_paths,
+            self.palette_path,
+            self.transforms_path,
+        ):
+            add("-" if path is None else file_digest(path))
+
+        # files are identified by their place in the source folder, not on disk
+        dirinfo = self.dirinfo
+        for path in (*dirinfo.rtconfig_paths(), *dirinfo.rptheme_paths()):
+            add(Path(path).relative_to(self.input_dir).as_posix(), file_digest(path))
+        for src, dst in dirinfo.filemap():
+            add(Path(dst).as_posix(), file_digest(src))
+
+        return h.hexdigest()
+
+    def build(
+        self, output: Path | BinaryIO, *, name: str | None = None, debug=False
+    ):
+        """
+        Build the theme archive, returns the compression report. The output is either a
+        path, or a writable binary stream with the theme named `name` (the name of the
+        input folder by default).
+
+        When building reproducibly to a path, returns None without writing anything if
+        the existing archive was built from the same inputs.
+        """
+        if isinstance(output, (str, os.PathLike)):
+            output_file: Path | None = Path(output)
+        else:
+            output_file = None
+            if name is None:
+                name = self.input_dir.name
+            if debug:
+                raise ValueError("Debug files can only be written next to an archive")
+
+        timings = self.timings
+        if self._evaluator is not None:
+            self._evaluator.timings = timings
+            if timings is not None:
+                self._evaluator.memo.reset_stats()
+
+        with self._stage("scan"):
+            dirinfo = self.dirinfo
+
+        digest = None
+        if self.reproducible:
+            with self._stage("digest"):
+                digest = self.input_digest(
+                    name if output_file is None else output_file.stem
+                )
+            if output_file is not None and read_digest(output_file) == digest:
+                print(f"{output_file} is up to date, nothing to build")
+                snapshot_path = self.snapshot_path()
+                if snapshot_path is not None:
+                    dirinfo.save_snapshot(snapshot_path)
+                return None
+        with self._stage("constants"):
+            self.evaluator
+
+        # construct initial config and stuff
+        with self._stage("resources"):
+            res = self.resources()
+        print(f"Adding {len(res)} resources...")
+        for src, dst in res:
+            self.log(f"  [{dst}]: {src}")
+
+        print(f"Merging {len(dirinfo.rtconfig_paths())} *.rtconfig files...")
+        for path in dirinfo.rtconfig_paths():
+            self.log(f"  {path}")
+
+        print(f"Merging {len(dirinfo.rptheme_paths())} *.ReaperTheme files...")
+        for path in dirinfo.rptheme_paths():
+            self.log(f"  {path}")
+
+        # post-process, the rtconfig is processed while it is written to the archive
+        print("Post processing rtconfig and ReaperTheme...")
+        with self._stage("rptheme"):
+            rpt = self.rptheme()
+        rtc = self.rtconfig()
+        if self.minify:
+            rtc = self.optimize(rtc)
+        if timings is not None:
+            rtc = timings.iterate("rtconfig", rtc)
+
+        if output_file is not None:
+            print(f"Writing ZIP file to {output_file}")
+        else:
+            print(f"Writing ZIP file to {getattr(output, 'name', 'stream')}")
+
+        if debug and output_file is not None:
+            rtc_path = output_file.with_suffix(".rtconfig.txt")
+            print(f"  [rtconfig] {rtc_path}")
+            rtc = _tee(rtc, rtc_path)
+
+        with self._stage("write"):
+            options = dict(
+                rtconfig=rtc,
+                rptheme=rpt,
+                resources=res,
+                manifest=self.manifest,
+                policy=self.policy,
+                jobs=self.jobs,
+                reproducible=self.reproducible,
+                digest=digest,
+            )
+            if output_file is not None:
+                report = create_theme(output_file, **options)
+            else:
+                assert name is not None
+                # there is no archive on disk to reuse resources from, keep them
+                written: dict[str, CompressedEntry] = {}
+                report = write_theme(
+                    output, name, previous=self._previous, written=written, **options
+                )
+                if self.manifest is not None:
+                    self._previous = written
+        self.log(report.format())
+
+        with self._stage("save caches"):
+            self.evaluator.save_cache()
+
+            snapshot_path = self.snapshot_path()
+            if snapshot_path is not None:
+                dirinfo.save_snapshot(snapshot_path)
+
+        if timings is not None:
+            # the rtconfig is evaluated while the archive is written
+            timings.subtract("write", "rtconfig")
+            timings.archive(report.entries)
+            timings.memo.update(self.evaluator.memo.stats())
+
+        if debug and output_file is not None:
+            rpt_path = output_file.with_suffix(".ReaperTheme")
+            print(f"  [ReaperTheme] {rpt_path}")
+            with open(rpt_path, "w", encoding="utf8") as f:
+                rpt.write(f)
+
+        return report
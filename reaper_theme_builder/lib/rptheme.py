@@ -1,12 +1,199 @@
-from configparser import ConfigParser
-from io import StringIO
+# This module merges and processes ReaperTheme files. These are ini files, but are
+# parsed by a small purpose-built store instead of ConfigParser:
+#
+# - keys keep their case, and are looked up without case like REAPER does
+# - values are never interpolated, and each one records the file it came from
+# - sections and keys keep the order they were first seen in, later files replace the
+#   values of keys that already exist
 
+from typing import Callable, Iterable, TextIO
 
-def from_paths(paths: list[str]):
+from .utils import get_config_section_and_key
+
+
+class ReaperThemeSyntaxError(ValueError):
+    """An invalid line in a ReaperTheme file"""
+
+    def __init__(self, message: str, path: str | None, line: int) -> None:
+        self.path = path
+        self.line = line
+        self.message = message
+        super().__init__(f"{message} ({path or '<string>'}, line {line})")
+
+
+class Section:
+    """
+    The keys of a section, in order. Keys are matched without case, and keep the case
+    they were first written with.
+    """
+
+    __slots__ = ("name", "_keys", "_values", "_sources")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        # maps from lowercase keys to the key, its value and the file it came from
+        self._keys: dict[str, str] = {}
+        self._values: dict[str, str] = {}
+        self._sources: dict[str, str | None] = {}
+
+    def __contains__(self, key: str):
+        return key.lower() in self._keys
+
+    def __getitem__(self, key: str):
+        return self._values[key.lower()]
+
+    def __setitem__(self, key: str, value: str):
+        self.set(key, value)
+
+    def __iter__(self):
+        return iter(self._keys.values())
+
+    def __len__(self):
+        return len(self._keys)
+
+    def set(self, key: str, value: str, source: str | None = None):
+        """Set a value, the source is kept if the key exists and no source is given"""
+        lower = key.lower()
+        if lower not in self._keys:
+            self._keys[lower] = key
+            self._sources[lower] = source
+        elif source is not None:
+            self._sources[lower] = source
+        self._values[lower] = value
+
+    def source(self, key: str):
+        """The path of the file a value came from, or None if it was set in code"""
+        return self._sources[key.lower()]
+
+    def items(self):
+        return zip(self._keys.values(), self._values.values())
+
+    def map_values(self, func: Callable[[str], str]):
+        """Replace every value with `func(value)`, keeping the keys and sources"""
+        values = self._values
+        for lower, value in values.items():
+            values[lower] = func(value)
+
+
+class ReaperTheme:
+    """The sections of one or more merged ReaperTheme files"""
+
+    __slots__ = ("_sections",)
+
+    def __init__(self) -> None:
+        self._sections: dict[str, Section] = {}
+
+    def __contains__(self, name: str):
+        return name in self._sections
+
+    def __getitem__(self, name: str):
+        return self._sections[name]
+
+    def __iter__(self):
+        return iter(self._sections)
+
+    def __len__(self):
+        return len(self._sections)
+
+    def has_section(self, name: str):
+        return name in self._sections
+
+    def add_section(self, name: str):
+        """Returns the section with the given name, which is added if it is new"""
+        section = self._sections.get(name)
+        if section is None:
+            section = self._sections[name] = Section(name)
+        return section
+
+    def read_string(self, text: str, source: str | None = None):
+        """
+        Merge the contents of a ReaperTheme file, values of existing keys are replaced.
+        Raises ReaperThemeSyntaxError on lines that aren't a section or `key=value`.
+        """
+        section = None
+        # lowercase keys seen in each section of this file
+        seen: dict[str, set[str]] = {}
+
+        for number, line in enumerate(text.splitlines(), 1):
+            line = line.strip()
+            if len(line) == 0 or line[0] in "#;":
+                continue
+
+            if line[0] == "[":
+                end = line.rfind("]")
+                if end < 2:
+                    raise ReaperThemeSyntaxError("Invalid section", source, number)
+                section = self.add_section(line[1:end])
+                continue
+
+            key, sep, value = line.partition("=")
+            key = key.rstrip()
+            if sep == "" or len(key) == 0:
+                raise ReaperThemeSyntaxError("Expected 'key=value'", source, number)
+            if section is None:
+                raise ReaperThemeSyntaxError("Key before any section", source, number)
+
+            keys = seen.setdefault(section.name, set())
+            if key.lower() in keys:
+                raise ReaperThemeSyntaxError(
+                    f"Duplicate key {key!r} in section {section.name!r}", source, number
+                )
+            keys.add(key.lower())
+
+            section.set(key, value.lstrip(), source)
+
+    def read(self, path: str):
+        # utf-8-sig, as files saved by some editors start with a byte order mark
+        with open(path, "r", encoding="utf-8-sig") as f:
+            self.read_string(f.read(), path)
+
+    def serialize(self):
+        parts = []
+        for name, section in self._sections.items():
+            parts.append(f"[{name}]\n")
+            for key, value in section.items():
+                parts.append(f"{key}={value}\n")
+            parts.append("\n")
+        return "".join(parts)
+
+    def write(self, f: TextIO):
+        f.write(self.serialize())
+
+
+def from_paths(paths: Iterable[str]):
     """Load multiple *.ReaperTheme files and combine them into a single file"""
-    config = ConfigParser()
+    rpt = ReaperTheme()
 
     for p in paths:
-        config.read(p)
+        rpt.read(p)
+
+    return rpt
+
+
+def process(
+    rpt: ReaperTheme,
+    parse: Callable[[str], str],
+    *,
+    overrides: list[list[str]] | None = None,
+    cache: dict[str, str] | None = None,
+):
+    """
+    Assign overrides like ('REAPER.ui_img', 'x') to a merged file, then process every
+    value in place. Values without braces are literal and aren't processed. Processed
+    values are memoized in `cache` if given.
+    """
+    for fullname, value in [] if overrides is None else overrides:
+        section, key = get_config_section_and_key(rpt, fullname)
+        rpt[section][key] = value
+
+    cache = {} if cache is None else cache
+
+    def process_value(raw: str):
+        if "{" not in raw and "}" not in raw:
+            return raw
+        if raw not in cache:
+            cache[raw] = parse(raw)
+        return cache[raw]
 
-    return config
+    for name in rpt:
+        rpt[name].map_values(process_value)
@@ -31,3 +31,46 @@ def from_paths(paths, *, minify=False):
         if len(text) != 0:
             contents.append(text)
     return "\n".join(contents)
+
+
+def iter_path(path: str, *, minify=False):
+    """
+    Load a rtconfig.txt file line by line. Joining the yielded pieces gives the same
+    result as `from_path`.
+    """
+    with open(path, "r", encoding="utf8") as f:
+        if not minify:
+            yield from f
+            return
+
+        first = True
+        for line in f:
+            for l in line.splitlines():
+                l = _trim_line(l)
+                if len(l) == 0:
+                    continue
+
+                yield l if first else f"\n{l}"
+                first = False
+
+
+def iter_paths(paths, *, minify=False):
+    """
+    Load multiple rtconfig.txt files piece by piece. Joining the yielded pieces gives
+    the same result as `from_paths`.
+    """
+    first = True
+    for p in paths:
+        pieces = iter_path(p, minify=minify)
+
+        # some rtconfig files may be empty, only join files that are non-empty
+        head = next(pieces, None)
+        if head is None:
+            continue
+
+        if not first:
+            yield "\n"
+        first = False
+
+        yield head
+        yield from pieces
@@ -1,5 +1,27 @@
-import functools
+import bisect
+import hashlib
+import marshal
 import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+from .utils import tmp_suffix
+
+# the classes of files found in a theme folder
+RTCONFIG = "rtconfig"
+RPTHEME = "rptheme"
+RESOURCE = "resource"
+
+# bump this when the snapshot format changes, to invalidate existing snapshots
+SNAPSHOT_VERSION = 2
+
+# directories modified this close to the time they were listed may have changed again
+# without their mtime changing (on filesystems with coarse timestamps), so they are
+# always listed again
+RACY_NS = 2_000_000_000
 
 
 def is_rtconfig(path):
@@ -10,6 +32,49 @@ def is_rptheme(path):
     return path.lower().endswith(".reapertheme")
 
 
+def classify(path):
+    if is_rtconfig(path):
+        return RTCONFIG
+    if is_rptheme(path):
+        return RPTHEME
+    return RESOURCE
+
+
+class FileEntry(NamedTuple):
+    # the datadir that provides this file
+    owner: str
+    # one of RTCONFIG, RPTHEME or RESOURCE
+    kind: str
+
+
+class DirListing(NamedTuple):
+    # modification time of the directory in nanoseconds
+    mtime_ns: int
+    # names of subdirectories, in alphabetical order
+    dirs: list[str]
+    # names of files, in alphabetical order
+    files: list[str]
+
+
+def list_dir(path) -> DirListing:
+    """List the contents of a single directory"""
+    # stat before listing, so changes made while listing are seen by the next scan
+    mtime_ns = os.stat(path).st_mtime_ns
+
+    dirs = []
+    files = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                dirs.append(entry.name)
+            else:
+                files.append(entry.name)
+
+    dirs.sort()
+    files.sort()
+    return DirListing(mtime_ns, dirs, files)
+
+
 class DirInfo:
     """
     A simple class that classifies paths into the 3 types of resources used in a Reaper
@@ -19,125 +84,323 @@ class DirInfo:
     - *.ReaperTheme
     - Everything else (defaults to PNG only)
 
-    Both rtconfig and ReaperTheme files are considered as "datafiles".
+    Both rtconfig and ReaperTheme files are considered as "datafiles". A directory
+    containing a datafile is a "datadir". Every other file belongs to the nearest
+    datadir above it (including its own directory), and is placed in the theme relative
+    to that datadir:
+
+    - 150/
+        - a.png
+    - 200/
+        - a.png
+    - test/
+        # this folder contains a rtconfig.txt, so this folder is a separate datadir
+        - c.png
+        - rtconfig.txt
+    - a.png
+    - b.png
+    - rtconfig.txt
+
+    The folder is listed in a single pass, and all files are kept in a flat index. The
+    listings can be saved to a snapshot, so the next scan only lists directories that
+    were modified since then. (A directory's mtime only changes when entries are added,
+    removed or renamed, so listings only keep the names of files, which are the only
+    thing that is certain to be up to date in a reused listing.)
     """
 
-    def __init__(self, path, files=None, datafiles=None, subdirs=None) -> None:
+    def __init__(self, path, png_only=True, listings=None, scanned_ns=None) -> None:
         # the location of this directory
         self._path = os.path.abspath(path)
 
-        # files in this directory, excluding data files like rtconfig.txt
-        self._files: list[str] = [] if files is None else files
+        # whether non-PNG resources are skipped
+        self._png_only = png_only
 
-        # data files this directory
-        self._datafiles: list[str] = [] if datafiles is None else datafiles
+        # map from directory paths to their contents
+        self._listings: dict[str, DirListing] = {} if listings is None else listings
 
-        # subdirectories in this directory
-        self._subdirs: list[DirInfo] = [] if subdirs is None else subdirs
+        # map from file paths to entries, in the order files are added to the theme
+        self._index: dict[str, FileEntry] = {}
 
-    @classmethod
-    def scan(cls, path, png_only=True):
-        """Scan and classify a directory recursively."""
-        info = cls(path)
+        # all datadirs, ordered from top to bottom
+        self._datadirs: list[str] = []
 
-        dirpaths = []
+        # when the listings were taken, listings modified since then aren't reused
+        self._scanned_ns = time.time_ns() if scanned_ns is None else scanned_ns
 
-        for entry in os.scandir(path):
-            if entry.is_dir():
-                dirpaths.append(entry.path)
-            else:
-                if is_rtconfig(entry.path) or is_rptheme(entry.path):
-                    info._datafiles.append(entry.name)
-                else:
-                    if png_only and not entry.name.lower().endswith(".png"):
-                        continue
+        # number of listings that were reused from a snapshot
+        self.reused = 0
 
-                    info._files.append(entry.name)
+        # whether the listings changed since they were loaded from a snapshot
+        self._modified = True
 
-        # ensure files are in alphabetical order
-        info._files.sort()
-        info._datafiles.sort()
+        self._build_index()
 
-        for path in dirpaths:
-            subinfo = cls.scan(path)
-            info._subdirs.append(subinfo)
+    @classmethod
+    def scan(cls, path, png_only=True, jobs: int | None = None, snapshot=None):
+        """
+        Scan and classify a directory recursively. If `jobs` is given, directories are
+        listed in a thread pool, which is faster on slow or network filesystems.
 
-        return info
+        If `snapshot` is the path to a snapshot saved by a previous scan, directories
+        that weren't modified since then are not listed again.
+        """
+        path = os.path.abspath(path)
+        scanned_ns = time.time_ns()
 
-    def is_datadir(self):
-        return len(self._datafiles) > 0
+        previous, previous_ns = _load_snapshot(snapshot, path)
+        listings = _list_tree(path, jobs, previous, previous_ns)
 
-    @functools.cache
-    def datadirs(self):
-        """all directories that have at least 1 datafile"""
-        datadirs: list["DirInfo"] = []
-        to_check = [self]
+        info = cls(path, png_only, listings, scanned_ns)
+        info.reused = sum(1 for p, x in listings.items() if previous.get(p) is x)
+        info._modified = info.reused != len(previous) or info.reused != len(listings)
+        if not info._modified:
+            # nothing was listed again, so the listings are as old as the snapshot
+            info._scanned_ns = previous_ns
 
-        while len(to_check) > 0:
-            info = to_check.pop(0)
-            to_check.extend(info._subdirs)
-            if info.is_datadir():
-                datadirs.append(info)
+        return info
 
-        return datadirs
+    def save_snapshot(self, path):
+        """Save the directory listings, so the next scan can reuse them"""
+        if not self._modified:
+            return
 
-    def partial_filemap(self):
-        """
-        generate a partial filemap for a datadir
-
-        a filemap is a map from local paths to archive paths. by "partial" it means
-        this function only returns the local paths provided by the current data dir
-        (a folder containing a data file). this can include resources from subfolders
-        that aren't data dirs.
-
-        when creating the filemap, this method excludes any subfolders that are datadirs:
-
-        - 150/
-            - a.png
-        - 200/
-            - a.png
-        - test/
-            # this folder contains a rtconfig.txt, so this folder will be excluded
-            # please scan this folder separately then add to results
-            - c.png
-            - rtconfig.txt
-        - a.png
-        - b.png
-        """
-        assert self.is_datadir()
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "root": self._path,
+            "scanned_ns": self._scanned_ns,
+            "listings": {p: tuple(listing) for p, listing in self._listings.items()},
+        }
 
-        # list of files, using their actual path
-        files = [os.path.join(self._path, f) for f in self._files]
-        # list of directories to check for more files
-        checkdirs = [d for d in self._subdirs if not d.is_datadir()]
+        path = os.fspath(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{tmp_suffix()}"
+        with open(tmp_path, "wb") as f:
+            marshal.dump(data, f)
+        os.replace(tmp_path, path)
 
-        while len(checkdirs) > 0:
-            subdir = checkdirs.pop(0)
-            files.extend([os.path.join(subdir._path, f) for f in subdir._files])
-            checkdirs.extend([d for d in subdir._subdirs if not d.is_datadir()])
+        self._modified = False
 
-        # we now have a list of files this data folder provides
-        # convert them to paths relative to the archive
-        filemap = [(f, os.path.relpath(f, self._path)) for f in files]
+    def rescan(self, paths):
+        """
+        Scan the given paths again, after they have been modified, created or deleted.
+        A file that was only modified is kept as it is. Otherwise only the directory
+        containing the path is listed again, along with any subdirectories that were
+        added to it.
+        """
+        relist = set()
+        for path in paths:
+            path = os.path.abspath(path)
+            if self._is_listed_file(path):
+                # the contents of a file don't change its listing
+                continue
+
+            # find the deepest scanned directory that still exists and contains the path
+            dirpath = path
+            while dirpath != self._path:
+                if dirpath in self._listings and os.path.isdir(dirpath):
+                    break
+
+                parent = os.path.dirname(dirpath)
+                if parent == dirpath:
+                    # the path isn't inside this directory at all
+                    dirpath = self._path
+                    break
+                dirpath = parent
+
+            relist.add(dirpath)
+
+        # parents sort before their subdirectories, which are skipped if listing the
+        # parent dropped or listed them already
+        for dirpath in sorted(relist):
+            if dirpath == self._path or dirpath in self._listings:
+                self._relist(dirpath)
+
+        if len(relist) > 0:
+            self._modified = True
+            self._build_index()
+
+    def _is_listed_file(self, path):
+        """Whether the path is a file that is already in the listing of its directory"""
+        dirpath, name = os.path.split(path)
+        listing = self._listings.get(dirpath)
+        if listing is None:
+            return False
+
+        i = bisect.bisect_left(listing.files, name)
+        if i == len(listing.files) or listing.files[i] != name:
+            return False
+
+        return os.path.isfile(path)
+
+    def _relist(self, dirpath):
+        """List a directory again, and list the subdirectories that were added to it"""
+        old = self._listings.get(dirpath)
+        try:
+            listing = list_dir(dirpath)
+        except (FileNotFoundError, NotADirectoryError):
+            # the directory was deleted, so its parent changed too
+            self._drop_tree(dirpath)
+            parent = os.path.dirname(dirpath)
+            if dirpath != self._path and parent in self._listings:
+                self._relist(parent)
+            return
+
+        self._listings[dirpath] = listing
+        old_dirs = set() if old is None else set(old.dirs)
+        for name in old_dirs.difference(listing.dirs):
+            self._drop_tree(os.path.join(dirpath, name))
+        for name in listing.dirs:
+            if name not in old_dirs:
+                self._listings.update(_list_tree(os.path.join(dirpath, name)))
+
+    def _drop_tree(self, dirpath):
+        """Forget the listings of a directory and all of its subdirectories"""
+        prefix = os.path.join(dirpath, "")
+        for p in [p for p in self._listings if p == dirpath or p.startswith(prefix)]:
+            del self._listings[p]
+
+    def _build_index(self):
+        index: dict[str, FileEntry] = {}
+        datadirs: list[str] = []
+
+        # files provided by each datadir, in the order they are added to the theme
+        owned: dict[str, list[tuple[str, FileEntry]]] = {}
+
+        # walk the directories breadth-first, tracking the datadir each one belongs to
+        queue: deque[tuple[str, str | None]] = deque([(self._path, None)])
+        while len(queue) > 0:
+            dirpath, owner = queue.popleft()
+            listing = self._listings.get(dirpath)
+            if listing is None:
+                continue
+
+            kinds = [classify(name) for name in listing.files]
+            if RTCONFIG in kinds or RPTHEME in kinds:
+                owner = dirpath
+                datadirs.append(dirpath)
+                owned[owner] = []
+
+            # files that aren't inside a datadir aren't part of the theme
+            if owner is not None:
+                files = owned[owner]
+                prefix = os.path.join(dirpath, "")
+                for name, kind in zip(listing.files, kinds):
+                    if kind == RESOURCE and self._png_only:
+                        if not name.lower().endswith(".png"):
+                            continue
+
+                    files.append((prefix + name, FileEntry(owner, kind)))
+
+            for name in listing.dirs:
+                queue.append((os.path.join(dirpath, name), owner))
+
+        # order the index by datadir, so resources of a datadir stay together
+        for datadir in datadirs:
+            for path, entry in owned[datadir]:
+                index[path] = entry
+
+        self._index = index
+        self._datadirs = datadirs
+
+    def index(self):
+        """map from file paths to entries, for all files provided by a datadir"""
+        return self._index
 
-        return filemap
+    def datadirs(self):
+        """all directories that have at least 1 datafile"""
+        return self._datadirs
 
-    @functools.cache
     def filemap(self):
-        """find all datadirs within this folder, and combine the filemaps from all of them"""
-        return [x for info in self.datadirs() for x in info.partial_filemap()]
+        """
+        a filemap is a list of local paths and their paths in the archive. each file is
+        placed relative to the datadir that provides it.
+        """
+        return [
+            (path, path[len(entry.owner) + 1 :])
+            for path, entry in self._index.items()
+            if entry.kind == RESOURCE
+        ]
 
-    @functools.cache
     def datafiles(self):
-        files: list[str] = []
-        for info in self.datadirs():
-            files.extend(os.path.join(info._path, file) for file in info._datafiles)
-        return files
+        return [p for p, entry in self._index.items() if entry.kind != RESOURCE]
 
-    @functools.cache
     def rtconfig_paths(self):
-        return [p for p in self.datafiles() if is_rtconfig(p)]
+        return [p for p, entry in self._index.items() if entry.kind == RTCONFIG]
 
-    @functools.cache
     def rptheme_paths(self):
-        return [p for p in self.datafiles() if is_rptheme(p)]
+        return [p for p, entry in self._index.items() if entry.kind == RPTHEME]
+
+
+def snapshot_path(cache_dir, root):
+    """The path of the snapshot of a scanned folder, in a cache folder"""
+    key = hashlib.blake2b(str(root).encode(), digest_size=8).hexdigest()
+    return Path(cache_dir) / f"scan-{key}.bin"
+
+
+def _load_snapshot(path, root) -> tuple[dict[str, DirListing], int]:
+    """Load the listings saved by a previous scan, and when they were taken"""
+    if path is None:
+        return {}, 0
+
+    try:
+        # reading the whole file first is much faster than marshal.load() on a file
+        with open(path, "rb") as f:
+            data = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return {}, 0
+
+    if not isinstance(data, dict) or data.get("version") != SNAPSHOT_VERSION:
+        return {}, 0
+    if data["root"] != root:
+        return {}, 0
+
+    listings = {p: DirListing(*listing) for p, listing in data["listings"].items()}
+    return listings, data["scanned_ns"]
+
+
+def _list_tree(
+    path,
+    jobs: int | None = None,
+    previous: dict[str, DirListing] | None = None,
+    previous_ns=0,
+):
+    """
+    List a directory and all of its subdirectories, one level at a time. Listings in
+    `previous` are reused if the directory wasn't modified since `previous_ns`.
+    """
+    listings: dict[str, DirListing] = {}
+    previous = {} if previous is None else previous
+
+    def safe_list_dir(dirpath):
+        try:
+            old = previous.get(dirpath)
+            if old is not None and old.mtime_ns < previous_ns - RACY_NS:
+                if os.stat(dirpath).st_mtime_ns == old.mtime_ns:
+                    return old
+
+            return list_dir(dirpath)
+        except (FileNotFoundError, NotADirectoryError):
+            # the directory was deleted while scanning
+            return None
+
+    executor = ThreadPoolExecutor(jobs) if jobs is not None and jobs > 1 else None
+    try:
+        level = [path]
+        while len(level) > 0:
+            if executor is None:
+                results = map(safe_list_dir, level)
+            else:
+                results = executor.map(safe_list_dir, level)
+
+            next_level = []
+            for dirpath, listing in zip(level, results):
+                if listing is None:
+                    continue
+                listings[dirpath] = listing
+                next_level.extend(os.path.join(dirpath, name) for name in listing.dirs)
+            level = next_level
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return listings
@@ -0,0 +1,663 @@
+# This module runs a build server, which keeps projects in memory between builds, so
+# repeated builds skip scanning, parsing, evaluating and compressing unchanged files.
+# Builds are requested over HTTP, on localhost or on a Unix socket:
+#
+#     curl --unix-socket /tmp/rtb.sock http://localhost/build \
+#         -H 'Content-Type: application/json' \
+#         -d '{"input": "/themes/Default", "constants": "/themes/dark.ini"}' \
+#         -o Default.ReaperThemeZip
+#
+# A build runs the Python files given with `functions`, so only the user who started
+# the server may send requests. A Unix socket can only be used by that user. On a TCP
+# port, every request must send a random token, which is written to a file only that
+# user can read:
+#
+#     curl http://localhost:8765/build \
+#         -H "Authorization: Bearer $(cat ~/.cache/reaper-theme-builder/serve.token)" \
+#         ...
+#
+# `POST /build` takes a JSON object with these keys, only `input` is required:
+#
+#     input           the theme source folder
+#     output          write the archive to this path in the output folder of the
+#                     server, and return a JSON summary instead of the archive itself.
+#                     Only allowed if the server was started with --output-dir
+#     name            the theme name, defaults to the name of the output file, or of
+#                     the input folder
+#     constants       path to an ini file defining constants, the same as -p
+#     functions       paths to Python files of extra functions for expressions, the
+#                     same as --functions
+#     palette         path to a palette spec, the same as --palette
+#     transforms      path to a transform spec, the same as --transforms
+#     config          overrides like {"REAPER.ui_img": "Dark"}, the same as -c
+#     minify          true or false, the same as -m
+#     all_resources   true or false, the same as -all
+#     optimize_png    true or false, the same as --optimize-png
+#     compress        compression methods like ["png=store"], the same as --compress
+#
+# Paths should be absolute, relative paths are resolved against the working directory
+# of the server, except `output` which is resolved against its output folder.
+# `GET /status` lists the projects kept in memory.
+#
+# Any web page can send requests to a server on localhost, so requests are also
+# refused unless they are addressed to localhost (which also stops DNS rebinding),
+# don't come from a page on another host, and are sent as `application/json`, which
+# browsers can't send to another origin without asking first.
+#
+# A project is kept for every distinct source folder and set of options (other than
+# `output`, `name` and `config`), with a watcher that tells it which files changed
+# between builds. Projects that weren't built for a while, or the least recently built
+# ones past a limit, are closed along with their watchers. Builds run in a thread
+# pool, so requests for different projects are built at the same time, while requests
+# for the same project wait for each other. As in any other build, resources are
+# compressed in threads, and images are transformed and optimized in process pools.
+
+import asyncio
+import hmac
+import json
+import os
+import secrets
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Any, NamedTuple
+from urllib.parse import urlsplit
+
+from .compress import CompressionPolicy
+from .manifest import BuildManifest
+from .project import Project
+from .utils import tmp_suffix
+from .watch import create_watcher
+
+# requests are small JSON objects, anything bigger is a mistake
+MAX_REQUEST_BYTES = 1 << 20
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Content Too Large",
+    415: "Unsupported Media Type",
+    500: "Internal Server Error",
+}
+
+# default number of projects kept in memory, and seconds they are kept without builds
+MAX_PROJECTS = 8
+IDLE_TIMEOUT = 30 * 60
+
+# names requests may be addressed to, browsers send the name of the host they think
+# they are connecting to, which is another name after DNS rebinding
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+_OPTIONS = {
+    "input",
+    "output",
+    "name",
+    "constants",
+    "functions",
+    "palette",
+    "transforms",
+    "config",
+    "minify",
+    "all_resources",
+    "optimize_png",
+    "compress",
+}
+
+
+class RequestError(ValueError):
+    """An invalid request, which is answered with an HTTP error status"""
+
+    def __init__(self, message: str, status=400) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class BuildRequest(NamedTuple):
+    input_dir: Path
+    output: Path | None
+    name: str | None
+    constants_path: Path | None
+    # Python files of extra functions for expressions, the same as --functions
+    function_paths: tuple[Path, ...]
+    palette_path: Path | None
+    transforms_path: Path | None
+    # overrides like ['REAPER.ui_img', 'x'], the same as -c
+    configs: list[list[str]]
+    minify: bool
+    png_only: bool
+    optimize_png: bool
+    # compression methods like 'png=store', the same as --compress
+    compress: tuple[str, ...]
+
+    def project_key(self):
+        """Requests with the same key are built by the same project"""
+        return (
+            self.input_dir,
+            self.constants_path,
+            self.function_paths,
+            self.palette_path,
+            self.transforms_path,
+            self.minify,
+            self.png_only,
+            self.optimize_png,
+            self.compress,
+        )
+
+
+def parse_request(data: Any, output_dir: Path | None = None) -> BuildRequest:
+    """
+    Validate the JSON object of a build request. Archives can only be written into
+    `output_dir`, and not at all if it is None.
+    """
+    if not isinstance(data, dict):
+        raise RequestError("The request must be a JSON object")
+
+    unknown = set(data) - _OPTIONS
+    if len(unknown) > 0:
+        raise RequestError(f"Unknown options: {', '.join(sorted(unknown))}")
+
+    def path(key: str):
+        value = data.get(key)
+        if value is None:
+            return None
+        if not isinstance(value, str):
+            raise RequestError(f"{key!r} must be a path")
+        return Path(value).absolute()
+
+    def flag(key: str):
+        value = data.get(key, False)
+        if not isinstance(value, bool):
+            raise RequestError(f"{key!r} must be true or false")
+        return value
+
+    input_dir = path("input")
+    if input_dir is None:
+        raise RequestError("'input' is required")
+    if not input_dir.is_dir():
+        raise RequestError(f"Input folder not found: {input_dir}")
+
+    output = data.get("output")
+    if output is not None:
+        if output_dir is None:
+            raise RequestError(
+                "'output' is only allowed if the server was started with --output-dir",
+                403,
+            )
+        if not isinstance(output, str):
+            raise RequestError("'output' must be a path")
+        output = (output_dir / output).resolve()
+        if not output.is_relative_to(output_dir):
+            raise RequestError(
+                f"'output' must be in the output folder {output_dir}", 403
+            )
+        if output.suffix.lower() != ".reaperthemezip":
+            raise RequestError("Output extension must be .ReaperThemeZip")
+
+    name = data.get("name")
+    if name is not None and not isinstance(name, str):
+        raise RequestError("'name' must be a string")
+
+    config = data.get("config", {})
+    if not isinstance(config, dict):
+        raise RequestError("'config' must be an object")
+
+    functions = data.get("functions", [])
+    if not isinstance(functions, list) or not all(
+        isinstance(x, str) for x in functions
+    ):
+        raise RequestError("'functions' must be a list of paths")
+
+    compress = data.get("compress", [])
+    if not isinstance(compress, list) or not all(isinstance(x, str) for x in compress):
+        raise RequestError("'compress' must be a list of strings")
+    try:
+        CompressionPolicy.parse(compress)
+    except ValueError as e:
+        raise RequestError(str(e))
+
+    return BuildRequest(
+        input_dir.resolve(),
+        output,
+        name,
+        path("constants"),
+        tuple(Path(x).absolute() for x in functions),
+        path("palette"),
+        path("transforms"),
+        [[k, str(v)] for k, v in config.items()],
+        flag("minify"),
+        not flag("all_resources"),
+        flag("optimize_png"),
+        tuple(compress),
+    )
+
+
+class _WarmProject:
+    """A project kept between builds, with a watcher for the files it is built from"""
+
+    def __init__(
+        self,
+        request: BuildRequest,
+        *,
+        jobs: int | None,
+        cache_dir: Path | None,
+        verbose: bool,
+    ) -> None:
+        self.request = request
+        self.project = Project(
+            request.input_dir,
+            png_only=request.png_only,
+            minify=request.minify,
+            constants_path=request.constants_path,
+            function_paths=list(request.function_paths),
+            palette_path=request.palette_path,
+            transforms_path=request.transforms_path,
+            optimize_png=request.optimize_png,
+            policy=CompressionPolicy.parse(list(request.compress)),
+            jobs=jobs,
+            cache_dir=cache_dir,
+            warm=True,
+            verbose=verbose,
+        )
+        # builds reuse resources from the previous build in memory
+        self.project.manifest = BuildManifest()
+
+        # held while the project is building, builds of the same project take turns
+        self.lock = asyncio.Lock()
+        self.watcher = None
+        self.builds = 0
+        # the time.monotonic() of the last request for this project
+        self.last_used = time.monotonic()
+
+        # archives written into the watched folder (and their temporary files), which
+        # must not cause a rescan
+        self._outputs: tuple[str, ...] = ()
+
+    def build(self, request: BuildRequest):
+        """
+        Update the project with the files changed since the last build, then build it.
+        Runs in a worker thread, returns the archive and the compression report.
+        """
+        if self.watcher is None:
+            extra_files = [
+                p
+                for p in (
+                    request.constants_path,
+                    *request.function_paths,
+                    request.palette_path,
+                    request.transforms_path,
+                )
+                if p is not None
+            ]
+            self.watcher = create_watcher(request.input_dir, extra_files)
+        else:
+            changed = {
+                p for p in self.watcher.poll() if not p.startswith(self._outputs)
+            }
+            if len(changed) > 0:
+                self.project.update(changed)
+
+        self.project.configs = request.configs
+
+        name = request.name
+        if name is None and request.output is not None:
+            name = request.output.stem
+
+        with BytesIO() as f:
+            report = self.project.build(f, name=name)
+            data = f.getvalue()
+
+        if request.output is not None:
+            output = str(request.output)
+            if output not in self._outputs:
+                self._outputs += (output,)
+
+            tmp_path = f"{output}.{tmp_suffix()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, request.output)
+
+        self.builds += 1
+        return data, report
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.close()
+
+
+def _response(status: int, body: bytes, content_type: str, headers=None):
+    lines = [
+        f"HTTP/1.1 {status} {_REASONS[status]}",
+        f"Content-Type: {content_type}",
+        f"Content-Length: {len(body)}",
+        "Connection: close",
+    ]
+    for k, v in ({} if headers is None else headers).items():
+        lines.append(f"{k}: {v}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+def _json_response(status: int, data):
+    body = json.dumps(data, indent=2).encode("utf8")
+    return _response(status, body, "application/json")
+
+
+def _hostname(value: str):
+    """The host name of a Host header like 'localhost:8765' or '[::1]:8765'"""
+    try:
+        return urlsplit(f"//{value}").hostname
+    except ValueError:
+        return None
+
+
+def check_headers(
+    method: str, headers: dict[str, str], hosts: set[str], token: str | None = None
+):
+    """
+    Refuse requests without the token (if any), and requests that may come from a web
+    page rather than a local tool: requests addressed to another host, sent from a
+    page on another host, or POSTed as anything other than JSON.
+    """
+    if token is not None:
+        scheme, _, value = headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(
+            value.strip().encode(), token.encode()
+        ):
+            raise RequestError(
+                "A valid 'Authorization: Bearer <token>' header is required", 401
+            )
+
+    if _hostname(headers.get("host", "")) not in hosts:
+        raise RequestError("Requests must be addressed to localhost", 403)
+
+    origin = headers.get("origin")
+    if origin is not None:
+        try:
+            hostname = urlsplit(origin).hostname
+        except ValueError:
+            hostname = None
+        if hostname not in hosts:
+            raise RequestError(f"Requests from {origin} are not allowed", 403)
+
+    if method == "POST":
+        content_type = headers.get("content-type", "").partition(";")[0].strip()
+        if content_type.lower() != "application/json":
+            raise RequestError("The Content-Type must be application/json", 415)
+
+
+class BuildServer:
+    """Builds themes on request, keeping a warm project for each set of options"""
+
+    def __init__(
+        self,
+        *,
+        jobs: int | None = None,
+        cache_dir: Path | None = None,
+        output_dir: Path | None = None,
+        hosts: set[str] = LOCAL_HOSTS,
+        token: str | None = None,
+        max_projects=MAX_PROJECTS,
+        idle_timeout: float | None = IDLE_TIMEOUT,
+        verbose=False,
+    ) -> None:
+        self.jobs = jobs
+        self.cache_dir = cache_dir
+        self.output_dir = None if output_dir is None else output_dir.resolve()
+        self.hosts = hosts
+        self.token = token
+        self.max_projects = max_projects
+        self.idle_timeout = idle_timeout
+        self.verbose = verbose
+
+        # projects in the order they were last requested, the most recent last
+        self._projects: dict[tuple, _WarmProject] = {}
+        self._executor = ThreadPoolExecutor(jobs)
+
+    async def build(self, request: BuildRequest):
+        """Build a theme in the worker pool, returns the archive and the report"""
+        key = request.project_key()
+        warm = self._projects.pop(key, None)
+        if warm is None:
+            warm = _WarmProject(
+                request, jobs=self.jobs, cache_dir=self.cache_dir, verbose=self.verbose
+            )
+        self._projects[key] = warm
+        warm.last_used = time.monotonic()
+        self.evict()
+
+        # a project can only build one archive at a time
+        async with warm.lock:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self._executor, warm.build, request)
+            finally:
+                warm.last_used = time.monotonic()
+
+    def evict(self):
+        """
+        Close the projects that weren't requested for longer than the idle timeout,
+        then the least recently requested ones past the limit. Projects that are
+        building, or waiting to, are kept. Returns the number of projects closed.
+        """
+        now = time.monotonic()
+        excess = len(self._projects) - self.max_projects
+        evicted = []
+        # the most recently requested project is never closed
+        for key in list(self._projects)[:-1]:
+            warm = self._projects[key]
+            if warm.lock.locked():
+                continue
+            timeout = self.idle_timeout
+            if (timeout is not None and now - warm.last_used > timeout) or excess > 0:
+                evicted.append(self._projects.pop(key))
+                excess -= 1
+
+        for warm in evicted:
+            warm.close()
+            if self.verbose:
+                print(f"Closed the project for {warm.request.input_dir}")
+        return len(evicted)
+
+    def status(self):
+        return {
+            "projects": [
+                {
+                    "input": str(warm.request.input_dir),
+                    "constants": (
+                        None
+                        if warm.request.constants_path is None
+                        else str(warm.request.constants_path)
+                    ),
+                    "builds": warm.builds,
+                    "building": warm.lock.locked(),
+                }
+                for warm in self._projects.values()
+            ]
+        }
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        """Read an HTTP request, returns the method, path, headers and body"""
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            raise RequestError("Malformed request line")
+        method, target, _ = request_line
+
+        headers: dict[str, str] = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if line == "":
+                break
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise RequestError("Invalid Content-Length")
+        if length > MAX_REQUEST_BYTES:
+            raise RequestError("The request is too large", 413)
+
+        body = await reader.readexactly(length) if length > 0 else b""
+        return method, target.split("?", 1)[0], headers, body
+
+    async def _respond(self, method: str, path: str, headers: dict, body: bytes):
+        check_headers(method, headers, self.hosts, self.token)
+
+        if path == "/status":
+            if method != "GET":
+                raise RequestError("Use GET for /status", 405)
+            return _json_response(200, self.status())
+
+        if path != "/build":
+            raise RequestError(f"Not found: {path}", 404)
+        if method != "POST":
+            raise RequestError("Use POST for /build", 405)
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise RequestError("The request body must be JSON")
+        request = parse_request(data, self.output_dir)
+
+        start = time.perf_counter()
+        archive, report = await self.build(request)
+        seconds = time.perf_counter() - start
+
+        if request.output is not None:
+            return _json_response(
+                200,
+                {
+                    "output": str(request.output),
+                    "bytes": len(archive),
+                    "reused": report.reused,
+                    "seconds": seconds,
+                },
+            )
+
+        headers = {"X-Build-Seconds": f"{seconds:.3f}"}
+        return _response(200, archive, "application/zip", headers)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer a single request on a connection"""
+        try:
+            method, path, headers, body = await self._read_request(reader)
+            response = await self._respond(method, path, headers, body)
+        except asyncio.IncompleteReadError:
+            writer.close()
+            return
+        except RequestError as e:
+            response = _json_response(e.status, {"error": str(e)})
+        except Exception as e:
+            # a failed build doesn't stop the server, the theme may be fixed later
+            traceback.print_exc()
+            response = _json_response(500, {"error": f"{type(e).__name__}: {e}"})
+
+        try:
+            writer.write(response)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        for warm in self._projects.values():
+            warm.close()
+        self._executor.shutdown()
+
+
+async def _evict_idle(server: BuildServer):
+    """Close idle projects every so often, even without new requests"""
+    while True:
+        await asyncio.sleep(min(server.idle_timeout or 60, 60))
+        server.evict()
+
+
+async def _serve(server: BuildServer, host: str, port: int, socket_path: Path | None):
+    if socket_path is not None:
+        # only the user running the server may connect to the socket
+        umask = os.umask(0o177)
+        try:
+            listener = await asyncio.start_unix_server(server.handle, path=socket_path)
+        finally:
+            os.umask(umask)
+        print(f"Listening on {socket_path}, press Ctrl+C to stop...")
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+        print(f"Listening on http://{host}:{port}, press Ctrl+C to stop...")
+
+    evictions = None
+    if server.idle_timeout is not None:
+        evictions = asyncio.create_task(_evict_idle(server))
+
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        if evictions is not None:
+            evictions.cancel()
+
+
+def write_token(path: Path):
+    """Write a new random token to a file only the current user can read"""
+    token = secrets.token_urlsafe(32)
+    os.makedirs(path.parent, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{tmp_suffix()}")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with open(fd, "w", encoding="utf8") as f:
+        f.write(token)
+    os.replace(tmp_path, path)
+    return token
+
+
+def serve(
+    *,
+    host="127.0.0.1",
+    port=8765,
+    socket_path: Path | None = None,
+    jobs: int | None = None,
+    cache_dir: Path | None = None,
+    output_dir: Path | None = None,
+    token_path: Path | None = None,
+    max_projects=MAX_PROJECTS,
+    idle_timeout: float | None = IDLE_TIMEOUT,
+    verbose=False,
+):
+    """
+    Run a build server until interrupted. On a TCP port, requests must send the token
+    written to `token_path`, which is required then.
+    """
+    token = None
+    if socket_path is None:
+        if token_path is None:
+            raise ValueError("A token file is required to listen on a TCP port")
+        token = write_token(token_path)
+        print(f"Requests must send the token in {token_path}")
+
+    # requests may also be addressed to the host the server listens on
+    hosts = LOCAL_HOSTS if socket_path is not None else LOCAL_HOSTS | {host}
+    server = BuildServer(
+        jobs=jobs,
+        cache_dir=cache_dir,
+        output_dir=output_dir,
+        hosts=hosts,
+        token=token,
+        max_projects=max_projects,
+        idle_timeout=idle_timeout,
+        verbose=verbose,
+    )
+    try:
+        asyncio.run(_serve(server, host, port, socket_path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+        if token is not None and token_path.exists():
+            token_path.unlink()
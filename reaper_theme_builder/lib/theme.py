@@ -1,9 +1,22 @@
 import os.path
+import time
 import zipfile
-from configparser import ConfigParser
-from io import StringIO
+from io import BytesIO
 from pathlib import Path
-from typing import NamedTuple
+from typing import BinaryIO, Iterable, NamedTuple
+
+from .archive import (
+    DIGEST_PREFIX,
+    REPRODUCIBLE_ATTR,
+    REPRODUCIBLE_DATE_TIME,
+    SUPPORTED_METHODS,
+    CompressedEntry,
+    read_entries,
+    write_entry,
+)
+from .compress import CompressionPolicy, CompressionReport, compress_files
+from .manifest import BuildManifest
+from .rptheme import ReaperTheme
 
 
 class DuplicateResourceError(Exception):
@@ -21,20 +34,214 @@ class Resource(NamedTuple):
     dst: Path
 
 
-def create_theme(
-    path,
+def _text_info(z: zipfile.ZipFile, arcname: str, reproducible: bool):
+    if reproducible:
+        zinfo = zipfile.ZipInfo(arcname, date_time=REPRODUCIBLE_DATE_TIME)
+        # the same on every system
+        zinfo.create_system = 3
+        zinfo.external_attr = REPRODUCIBLE_ATTR
+    else:
+        # use the same timestamp and permissions as ZipFile.writestr()
+        zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime(time.time())[:6])
+        zinfo.external_attr = 0o600 << 16
+    zinfo.compress_type = z.compression
+    return zinfo
+
+
+def _write_text(
+    z: zipfile.ZipFile, arcname: str, text: str | Iterable[str], reproducible=False
+):
+    """Write text to the archive, the text may be given in pieces"""
+    zinfo = _text_info(z, arcname, reproducible)
+    if isinstance(text, str):
+        z.writestr(zinfo, text)
+        return
+
+    with z.open(zinfo, "w") as f:
+        for piece in text:
+            f.write(piece.encode("utf8"))
+
+
+def _validate_name(name: str):
+    if len(name) == 0:
+        raise InvalidThemeNameError("The theme name cannot be empty.")
+    if "/" in name or "\\" in name:
+        raise InvalidThemeNameError(f"The theme name cannot contain slashes: {name!r}")
+
+
+def write_theme(
+    fp: BinaryIO,
+    name: str,
     *,
-    rtconfig: str | None = None,
-    rptheme: ConfigParser | None = None,
+    rtconfig: str | Iterable[str] | None = None,
+    rptheme: ReaperTheme | None = None,
     resources: list[Resource] | None = None,
+    manifest: BuildManifest | None = None,
+    previous: dict[str, CompressedEntry] | None = None,
+    written: dict[str, CompressedEntry] | None = None,
+    policy: CompressionPolicy | None = None,
+    jobs: int | None = None,
+    compressed: dict[str, CompressedEntry] | None = None,
+    reproducible=False,
+    digest: str | None = None,
 ):
+    """
+    Write a theme archive with the given theme name to a writable binary stream, which
+    doesn't need to be seekable.
+
+    The rtconfig may be given as an iterable of strings, which are written to the
+    archive as they are produced.
+
+    Resources are compressed in `jobs` threads, using the compression method chosen by
+    the policy for each file extension.
+
+    If a manifest is given, resources that are unchanged since it was written are
+    copied from `previous`, the compressed entries of the previous archive, without
+    recompressing them. The manifest is updated in-place to describe the new archive.
+    If `written` is given, the compressed resources are added to it, so it can be
+    given as `previous` to the next build.
+
+    Resources that were already compressed by the caller can be given in `compressed`,
+    a map from local paths to entries. These are written as-is.
+
+    If `reproducible` is true, the same inputs always give the same bytes: entries are
+    sorted, and have fixed timestamps and permissions. A digest of the inputs can be
+    stored in the archive comment, see `archive.read_digest`.
+
+    Returns a report of how the resources were compressed.
+    """
+    _validate_name(name)
+
     if rtconfig is None:
         rtconfig = ""
     if rptheme is None:
-        rptheme = ConfigParser()
+        rptheme = ReaperTheme()
     if resources is None:
         resources = []
+    if previous is None:
+        previous = {}
+    if reproducible:
+        resources = sorted(resources, key=lambda r: Path(r.dst).as_posix())
+
+    # validation for the list of resources
+    seen_dst_paths = set()
+    for src_path, dst_path in resources:
+        if dst_path in seen_dst_paths:
+            raise DuplicateResourceError(
+                f"The destination {dst_path!r} has already been assigned to a different resource: {src_path}"
+            )
+
+        seen_dst_paths.add(dst_path)
+
+    rptheme_serialized = rptheme.serialize()
+
+    if policy is None:
+        policy = CompressionPolicy()
+
+    report = CompressionReport()
 
+    if manifest is not None:
+        manifest.theme = name
+        manifest.policy = str(policy)
+
+    # decide which resources can be copied from the previous archive
+    arcnames: list[str] = []
+    planned: list[CompressedEntry | None] = []
+    manifest_entries = {}
+    for src_path, dst_path in resources:
+        key = Path(dst_path).as_posix()
+        arcname = f"{name}/{key}"
+        arcnames.append(arcname)
+
+        if compressed is not None and str(src_path) in compressed:
+            planned.append(compressed[str(src_path)])
+            continue
+
+        if manifest is not None:
+            entry, unchanged = manifest.check(key, src_path)
+            manifest_entries[key] = entry
+
+            # entries compressed some other way, by another tool, are compressed again
+            reused = previous.get(arcname)
+            if (
+                unchanged
+                and reused is not None
+                and reused.compress_type in SUPPORTED_METHODS
+                and manifest.matches(entry, reused)
+            ):
+                planned.append(reused)
+                report.reused += 1
+                continue
+
+        planned.append(None)
+
+    # compress all other resources in parallel
+    pending = compress_files(
+        [res.src for res, entry in zip(resources, planned) if entry is None],
+        policy,
+        jobs=jobs,
+        report=report,
+    )
+
+    try:
+        # create the zip and write resources into it
+        with zipfile.ZipFile(fp, "w", zipfile.ZIP_DEFLATED) as z:
+            for arcname, entry in zip(arcnames, planned):
+                if entry is None:
+                    entry = next(pending)
+                if reproducible:
+                    entry = entry._replace(
+                        date_time=REPRODUCIBLE_DATE_TIME,
+                        external_attr=REPRODUCIBLE_ATTR,
+                    )
+                    write_entry(z, arcname, entry, create_system=3)
+                else:
+                    write_entry(z, arcname, entry)
+                if written is not None:
+                    written[arcname] = entry
+                key = arcname[len(name) + 1 :]
+                if key in manifest_entries:
+                    manifest_entries[key] = manifest_entries[key]._replace(
+                        crc=entry.CRC
+                    )
+
+            _write_text(z, f"{name}.ReaperTheme", rptheme_serialized, reproducible)
+            _write_text(z, f"{name}/rtconfig.txt", rtconfig, reproducible)
+            if digest is not None:
+                z.comment = DIGEST_PREFIX + digest.encode("ascii")
+
+        report.entries = z.infolist()
+    finally:
+        pending.close()
+
+    if manifest is not None:
+        manifest.entries = manifest_entries
+
+    return report
+
+
+def create_theme(
+    path,
+    *,
+    rtconfig: str | Iterable[str] | None = None,
+    rptheme: ReaperTheme | None = None,
+    resources: list[Resource] | None = None,
+    manifest: BuildManifest | None = None,
+    policy: CompressionPolicy | None = None,
+    jobs: int | None = None,
+    compressed: dict[str, CompressedEntry] | None = None,
+    reproducible=False,
+    digest: str | None = None,
+):
+    """
+    Create a theme archive at the given path, the theme is named after the file.
+
+    If a manifest from the previous build is given, resources that are unchanged since
+    that build are copied from the existing archive without recompressing them.
+
+    See `write_theme` for the other arguments. Returns a report of how the resources
+    were compressed.
+    """
     # resolve the real path to the outpu
     # abspath also calls normpath
     path = Path(os.path.abspath(path))
@@ -42,28 +249,56 @@ def create_theme(
     # validate the output path
     if not path.name.lower().endswith(".reaperthemezip"):
         raise ValueError("Output extension must be .ReaperThemeZip")
-    if len(path.stem) == 0:
-        raise InvalidThemeNameError("The theme name cannot be empty.")
+    _validate_name(path.stem)
 
-    # validation for the list of resources
-    seen_dst_paths = set()
-    for src_path, dst_path in resources:
-        if dst_path in seen_dst_paths:
-            raise DuplicateResourceError(
-                f"The destination {dst_path!r} has already been assigned to a different resource: {src_path}"
+    if policy is None:
+        policy = CompressionPolicy()
+
+    # compressed entries of the previous archive, for incremental builds
+    previous = {}
+    if manifest is not None:
+        if (
+            manifest.theme == path.stem
+            and manifest.policy == str(policy)
+            and path.exists()
+        ):
+            try:
+                previous = read_entries(path)
+            except (OSError, zipfile.BadZipFile):
+                previous = {}
+
+    # write to a temporary file first, as the previous archive may still be read from
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            report = write_theme(
+                f,
+                path.stem,
+                rtconfig=rtconfig,
+                rptheme=rptheme,
+                resources=resources,
+                manifest=manifest,
+                previous=previous,
+                policy=policy,
+                jobs=jobs,
+                compressed=compressed,
+                reproducible=reproducible,
+                digest=digest,
             )
 
-        seen_dst_paths.add(dst_path)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
 
-    # serialise the rptheme ConfigParser into string
-    with StringIO() as f:
-        rptheme.write(f, space_around_delimiters=False)
-        rptheme_serialized = f.getvalue()
+    return report
 
-    # create the zip and write resources into it
-    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
-        for src_path, dst_path in resources:
-            z.write(src_path, arcname=os.path.join(path.stem, dst_path))
 
-        z.writestr(f"{path.stem}.ReaperTheme", rptheme_serialized)
-        z.writestr(f"{path.stem}/rtconfig.txt", rtconfig)
+def create_theme_bytes(name: str, **kwargs):
+    """
+    Create a theme archive in memory, returns the archive and the compression report.
+    Takes the same arguments as `write_theme`.
+    """
+    with BytesIO() as f:
+        report = write_theme(f, name, **kwargs)
+        return f.getvalue(), report
@@ -0,0 +1,192 @@
+# This module records how long each stage of a build takes, and which expressions the
+# time was spent evaluating. It is only used when --timings or --profile-json is given.
+
+import json
+import time
+from contextlib import contextmanager
+from typing import Iterable, TypeVar
+
+T = TypeVar("T")
+
+
+class Timings:
+    """Wall and CPU time per stage, and time per distinct expression"""
+
+    def __init__(self) -> None:
+        # map from stage names to [wall seconds, cpu seconds]
+        self.stages: dict[str, list[float]] = {}
+
+        # map from expressions to [count, cumulative seconds]
+        self.expressions: dict[str, list] = {}
+
+        # map from constant names to the seconds taken to evaluate them
+        self.constants: dict[str, float] = {}
+
+        # map from memoized function names to their hits and misses
+        self.memo: dict[str, tuple[int, int]] = {}
+
+        # total uncompressed and compressed size of the archive entries
+        self.zip_bytes_in = 0
+        self.zip_bytes_out = 0
+        self.zip_entries = 0
+
+    def _add(self, name: str, wall: float, cpu: float):
+        stage = self.stages.setdefault(name, [0.0, 0.0])
+        stage[0] += wall
+        stage[1] += cpu
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the code inside the `with` block as a stage"""
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self._add(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def iterate(self, name: str, items: Iterable[T]) -> Iterable[T]:
+        """
+        Time how long it takes to produce the items of an iterable as a stage, for
+        stages that are interleaved with other stages.
+        """
+        iterator = iter(items)
+        while True:
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._add(name, time.perf_counter() - wall, time.process_time() - cpu)
+            yield item
+
+    def subtract(self, name: str, other: str):
+        """Remove the time of an interleaved stage from the stage it happened in"""
+        if name in self.stages and other in self.stages:
+            self.stages[name][0] -= self.stages[other][0]
+            self.stages[name][1] -= self.stages[other][1]
+
+    def expression(self, text: str, seconds: float):
+        entry = self.expressions.get(text)
+        if entry is None:
+            self.expressions[text] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    def archive(self, entries: Iterable):
+        """Record the sizes of the entries in a written archive, given as `ZipInfo`s"""
+        for info in entries:
+            self.zip_bytes_in += info.file_size
+            self.zip_bytes_out += info.compress_size
+            self.zip_entries += 1
+
+    def _top_expressions(self, count: int, prefix: str | None = None):
+        items = self.expressions.items()
+        if prefix is not None:
+            items = [(k, v) for k, v in items if k.lstrip().startswith(prefix)]
+        return sorted(items, key=lambda x: x[1][1], reverse=True)[:count]
+
+    def to_json(self, top=50):
+        def expressions(prefix=None):
+            return [
+                {"expression": text, "count": count, "seconds": seconds}
+                for text, (count, seconds) in self._top_expressions(top, prefix)
+            ]
+
+        constants = sorted(self.constants.items(), key=lambda x: x[1], reverse=True)
+        return {
+            "stages": {
+                name: {"wall": wall, "cpu": cpu}
+                for name, (wall, cpu) in self.stages.items()
+            },
+            "total": {
+                "wall": sum(wall for wall, _ in self.stages.values()),
+                "cpu": sum(cpu for _, cpu in self.stages.values()),
+            },
+            "expressions": {
+                "distinct": len(self.expressions),
+                "evaluated": sum(count for count, _ in self.expressions.values()),
+                "seconds": sum(seconds for _, seconds in self.expressions.values()),
+                "slowest": expressions(),
+                "slowest_set": expressions("set("),
+                "slowest_constants": expressions("c("),
+            },
+            "constants": [
+                {"name": name, "seconds": seconds} for name, seconds in constants[:top]
+            ],
+            "memo": [
+                {"function": name, "hits": hits, "misses": misses}
+                for name, (hits, misses) in sorted(self.memo.items())
+            ],
+            "zip": {
+                "entries": self.zip_entries,
+                "bytes_in": self.zip_bytes_in,
+                "bytes_out": self.zip_bytes_out,
+            },
+        }
+
+    def save(self, path):
+        with open(path, "w", encoding="utf8") as f:
+            json.dump(self.to_json(), f, indent=2)
+
+    def format(self, top=10):
+        data = self.to_json(top)
+        lines = [f"  {'stage':<16} {'wall':>9} {'cpu':>9}"]
+        for name, stage in data["stages"].items():
+            lines.append(f"  {name:<16} {stage['wall']:>8.3f}s {stage['cpu']:>8.3f}s")
+        total = data["total"]
+        lines.append(f"  {'total':<16} {total['wall']:>8.3f}s {total['cpu']:>8.3f}s")
+
+        exprs = data["expressions"]
+        lines.append("")
+        lines.append(
+            f"  {exprs['evaluated']} expressions evaluated"
+            f" ({exprs['distinct']} distinct) in {exprs['seconds']:.3f}s"
+        )
+
+        def table(title: str, rows: list[dict]):
+            if len(rows) == 0:
+                return
+            lines.append("")
+            lines.append(f"  {title:<56} {'count':>7} {'total':>10}")
+            for row in rows:
+                text = " ".join(row["expression"].split())
+                if len(text) > 56:
+                    text = text[:53] + "..."
+                ms = row["seconds"] * 1000
+                lines.append(f"  {text:<56} {row['count']:>7} {ms:>8.2f}ms")
+
+        table("slowest expressions", exprs["slowest"])
+        table("slowest set(...) calls", exprs["slowest_set"])
+        table("slowest c(...) lookups", exprs["slowest_constants"])
+
+        if len(data["constants"]) > 0:
+            lines.append("")
+            lines.append(f"  {'slowest constants to evaluate':<56} {'total':>18}")
+            for row in data["constants"]:
+                ms = row["seconds"] * 1000
+                lines.append(f"  {row['name']:<56} {ms:>16.2f}ms")
+
+        if len(data["memo"]) > 0:
+            lines.append("")
+            lines.append(f"  {'memoized functions':<40} {'hits':>10} {'misses':>10}")
+            for row in data["memo"]:
+                calls = row["hits"] + row["misses"]
+                rate = row["hits"] / calls * 100 if calls > 0 else 0
+                lines.append(
+                    f"  {row['function']:<40} {row['hits']:>10} {row['misses']:>10}"
+                    f" {rate:>5.1f}%"
+                )
+
+        z = data["zip"]
+        if z["entries"] > 0:
+            lines.append("")
+            lines.append(
+                f"  zip: {z['entries']} entries, {z['bytes_in']} bytes in,"
+                f" {z['bytes_out']} bytes out"
+            )
+
+        return "\n".join(lines)
@@ -0,0 +1,337 @@
+# This module transforms image resources before they are added to a theme: scaled
+# variants for the 150% and 200% folders are generated from 100% images, images can be
+# tinted with a colour, and images can be re-encoded.
+#
+# Transforms run in a process pool. Outputs are cached by the hash of the input file
+# and the transform parameters, so only new or changed images are processed again.
+# Outputs that are no longer used can be removed with `rtb cache`.
+#
+# A transform spec is an ini file like this, every section is optional:
+#
+#     [scale]
+#     ; generate these variants when they don't exist in the source folder
+#     sizes = 150, 200
+#     ; resampling filter: nearest, bilinear, bicubic or lanczos
+#     filter = lanczos
+#     ; only scale resources matching these patterns
+#     include = *.png
+#     exclude = toolbar_*.png
+#
+#     [tint]
+#     ; multiply resources matching a pattern with a colour, images in the 150 and 200
+#     ; folders are matched without the folder, so all variants get the same tint
+#     meter_*.png = c("colors.accent")
+#
+#     [reencode]
+#     ; re-encode resources matching these patterns, dropping any metadata
+#     include = *.png
+
+import fnmatch
+import hashlib
+import os
+from configparser import ConfigParser
+from pathlib import Path
+from typing import Any, Callable, NamedTuple
+
+from .cache import is_cached
+from .manifest import file_digest
+from .utils import tmp_suffix
+
+# bump this when the output of a transform changes, to invalidate existing caches
+TRANSFORM_VERSION = 1
+
+# the DPI folders REAPER looks for scaled images in
+SCALE_FOLDERS = ("150", "200")
+
+_FILTERS = ("nearest", "bilinear", "bicubic", "lanczos")
+
+# images with this pixel in the top left corner have a 1px border of markers, which
+# tell REAPER how the image is stretched. the border must stay 1px wide when scaling
+MARKER_PINK = (255, 0, 255, 255)
+
+
+def _split_patterns(text: str):
+    return [p.strip() for p in text.replace("\n", ",").split(",") if p.strip()]
+
+
+def _matches(path: str, patterns: list[str]):
+    return any(fnmatch.fnmatchcase(path, p) for p in patterns)
+
+
+class Transform(NamedTuple):
+    # the local path to the source image
+    src: str
+    # the operations to apply, in order, like ("tint", (255, 0, 0))
+    ops: tuple
+    # the path in the archive, relative to the datadir
+    dst: str
+
+
+def _has_markers(image):
+    return image.mode == "RGBA" and image.getpixel((0, 0)) == MARKER_PINK
+
+
+def _scale(image, factor: float, resample: str):
+    from PIL import Image
+
+    resample = getattr(Image.Resampling, resample.upper())
+
+    w, h = image.size
+    if not _has_markers(image) or w < 3 or h < 3:
+        size = (max(1, round(w * factor)), max(1, round(h * factor)))
+        return image.resize(size, resample)
+
+    # scale the inside normally, but stretch the marker border along its length only
+    inner_w = max(1, round((w - 2) * factor))
+    inner_h = max(1, round((h - 2) * factor))
+    nearest = Image.Resampling.NEAREST
+
+    result = Image.new("RGBA", (inner_w + 2, inner_h + 2))
+    for box, size, resample_, pos in (
+        # the inside
+        ((1, 1, w - 1, h - 1), (inner_w, inner_h), resample, (1, 1)),
+        # the top, bottom, left and right edges
+        ((1, 0, w - 1, 1), (inner_w, 1), nearest, (1, 0)),
+        ((1, h - 1, w - 1, h), (inner_w, 1), nearest, (1, inner_h + 1)),
+        ((0, 1, 1, h - 1), (1, inner_h), nearest, (0, 1)),
+        ((w - 1, 1, w, h - 1), (1, inner_h), nearest, (inner_w + 1, 1)),
+    ):
+        result.paste(image.crop(box).resize(size, resample_), pos)
+
+    # the corners
+    for x, y, nx, ny in (
+        (0, 0, 0, 0),
+        (w - 1, 0, inner_w + 1, 0),
+        (0, h - 1, 0, inner_h + 1),
+        (w - 1, h - 1, inner_w + 1, inner_h + 1),
+    ):
+        result.putpixel((nx, ny), image.getpixel((x, y)))
+
+    return result
+
+
+def _tint(image, color: tuple[int, int, int]):
+    from PIL import Image, ImageChops
+
+    rgb = image.convert("RGB")
+    tinted = ImageChops.multiply(rgb, Image.new("RGB", image.size, color))
+    tinted.putalpha(image.getchannel("A"))
+
+    if _has_markers(image):
+        # keep the original marker border
+        w, h = image.size
+        result = image.copy()
+        result.paste(tinted.crop((1, 1, w - 1, h - 1)), (1, 1))
+        return result
+
+    return tinted
+
+
+def run_transform(src: str, ops: tuple, dst: str):
+    """Apply operations to an image and save it as a PNG, runs in a worker process"""
+    from PIL import Image
+
+    with Image.open(src) as image:
+        image.load()
+
+    if any(op[0] != "reencode" for op in ops):
+        image = image.convert("RGBA")
+
+    for op in ops:
+        if op[0] == "scale":
+            image = _scale(image, op[1], op[2])
+        elif op[0] == "tint":
+            image = _tint(image, op[1])
+
+    tmp_path = f"{dst}.{tmp_suffix()}.png"
+    image.save(tmp_path, "PNG", optimize=True)
+    os.replace(tmp_path, dst)
+
+
+class TransformSpec:
+    """The transforms to apply to the resources of a theme"""
+
+    def __init__(
+        self,
+        *,
+        sizes: list[str] | None = None,
+        resample="lanczos",
+        include: list[str] | None = None,
+        exclude: list[str] | None = None,
+        tints: dict[str, tuple[int, int, int]] | None = None,
+        reencode: list[str] | None = None,
+    ) -> None:
+        for size in [] if sizes is None else sizes:
+            if size not in SCALE_FOLDERS:
+                raise ValueError(
+                    f"Unknown scale {size!r}, must be one of {SCALE_FOLDERS}"
+                )
+        if resample not in _FILTERS:
+            raise ValueError(f"Unknown filter {resample!r}, must be one of {_FILTERS}")
+
+        self.sizes = [] if sizes is None else sizes
+        self.resample = resample
+        self.include = ["*.png"] if include is None else include
+        self.exclude = [] if exclude is None else exclude
+        # map from patterns to colours, as (r, g, b)
+        self.tints = {} if tints is None else tints
+        self.reencode = [] if reencode is None else reencode
+
+    @classmethod
+    def from_path(cls, path, val: Callable[[str], Any]):
+        """
+        Load a transform spec. Tint colours are evaluated with `val`, so they can be
+        written like any other value.
+        """
+        config = ConfigParser()
+        # patterns are case sensitive
+        config.optionxform = str  # type: ignore
+        with open(path, "r", encoding="utf8") as f:
+            config.read_file(f)
+
+        kwargs = {}
+        if config.has_section("scale"):
+            section = config["scale"]
+            if "sizes" in section:
+                kwargs["sizes"] = _split_patterns(section["sizes"])
+            if "filter" in section:
+                kwargs["resample"] = section["filter"].strip().lower()
+            if "include" in section:
+                kwargs["include"] = _split_patterns(section["include"])
+            if "exclude" in section:
+                kwargs["exclude"] = _split_patterns(section["exclude"])
+
+        if config.has_section("tint"):
+            tints = {}
+            for pattern, raw in config["tint"].items():
+                # colours are encoded like `rgb()`
+                color = int(val(raw))
+                r, g, b = color & 0xFF, (color >> 8) & 0xFF, (color >> 16) & 0xFF
+                tints[pattern] = (r, g, b)
+            kwargs["tints"] = tints
+
+        if config.has_section("reencode"):
+            kwargs["reencode"] = _split_patterns(config["reencode"].get("include", ""))
+
+        return cls(**kwargs)
+
+    def plan(self, filemap: list[tuple[str, str]]):
+        """
+        Decide which transforms to apply to a filemap, returns a list of transforms
+        for resources that are replaced or generated.
+        """
+        existing = {dst.replace(os.sep, "/") for _, dst in filemap}
+        transforms: list[Transform] = []
+        generated: list[Transform] = []
+
+        for src, dst in filemap:
+            dst = dst.replace(os.sep, "/")
+            if not dst.lower().endswith(".png"):
+                continue
+
+            # hand-made variants are tinted like the 100% image they are a variant of
+            folder, _, unscaled = dst.partition("/")
+            names = (dst, unscaled) if folder in SCALE_FOLDERS else (dst,)
+
+            ops = []
+            for pattern, color in self.tints.items():
+                if any(fnmatch.fnmatchcase(name, pattern) for name in names):
+                    ops.append(("tint", color))
+                    break
+            if _matches(dst, self.reencode):
+                ops.append(("reencode",))
+
+            if len(ops) > 0:
+                transforms.append(Transform(src, tuple(ops), dst))
+
+            # only generate variants of 100% images
+            if folder in SCALE_FOLDERS:
+                continue
+            if not _matches(dst, self.include) or _matches(dst, self.exclude):
+                continue
+
+            for size in self.sizes:
+                scaled_dst = f"{size}/{dst}"
+                if scaled_dst in existing:
+                    continue
+
+                scale = ("scale", int(size) / 100, self.resample)
+                generated.append(Transform(src, (scale, *ops), scaled_dst))
+
+        return transforms + generated
+
+
+class TransformStats(NamedTuple):
+    transformed: int
+    cached: int
+
+
+def apply_transforms(
+    filemap: list[tuple[str, str]],
+    transforms: list[Transform],
+    cache_dir: Path,
+    *,
+    jobs: int | None = None,
+):
+    """
+    Run transforms, reusing cached outputs. Returns the filemap with transformed
+    resources replaced or added, and how many transforms were run.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    digests: dict[str, str] = {}
+    # map from archive paths to transformed files
+    outputs: dict[str, str] = {}
+    # map from transformed files that don't exist yet to their transforms
+    pending: dict[str, Transform] = {}
+
+    for transform in transforms:
+        if transform.src not in digests:
+            digests[transform.src] = file_digest(transform.src)
+
+        # outputs are named by the input and the operations
+        key = f"{TRANSFORM_VERSION}\0{digests[transform.src]}\0{transform.ops!r}"
+        name = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        out_path = os.path.join(cache_dir, f"{name}.png")
+        outputs[transform.dst] = out_path
+
+        if not is_cached(out_path):
+            pending[out_path] = transform
+
+    if len(pending) > 0:
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            raise ImportError(
+                "Pillow is required for transforms:"
+                " pip install 'reaper-theme-builder[images]'"
+            )
+
+        srcs = [t.src for t in pending.values()]
+        ops = [t.ops for t in pending.values()]
+        dsts = list(pending.keys())
+
+        if jobs == 1 or len(pending) == 1:
+            for args in zip(srcs, ops, dsts):
+                run_transform(*args)
+        else:
+            # multiprocessing is slow to import, so only import it when it is used
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(jobs) as executor:
+                # consume the results, to raise any errors
+                for _ in executor.map(run_transform, srcs, ops, dsts):
+                    pass
+
+    result = []
+    for src, dst in filemap:
+        result.append((outputs.get(dst.replace(os.sep, "/"), src), dst))
+
+    existing = {dst.replace(os.sep, "/") for _, dst in filemap}
+    for transform in transforms:
+        if transform.dst not in existing:
+            result.append((outputs[transform.dst], transform.dst))
+
+    stats = TransformStats(len(pending), len(transforms) - len(pending))
+    return result, stats
+
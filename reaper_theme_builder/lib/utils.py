@@ -1,7 +1,13 @@
+import os
+import threading
 from configparser import ConfigParser
+from typing import TYPE_CHECKING
 
+if TYPE_CHECKING:
+    from .rptheme import ReaperTheme
 
-def get_config_section_and_key(config: ConfigParser, full_name: str):
+
+def get_config_section_and_key(config: "ConfigParser | ReaperTheme", full_name: str):
     """
     Given a config and a full name like 'REAPER.ui_img', determine the section and the
     key. In this case, 'REAPER.ui_img' will return ('REAPER', 'ui_img').
@@ -18,3 +24,11 @@ def get_config_section_and_key(config: ConfigParser, full_name: str):
         raise ValueError(f"Constant name not found in section {section!r}: {name}")
 
     return section, name
+
+
+def tmp_suffix():
+    """
+    A suffix for temporary files, unique to this process and thread, so builds running
+    at the same time never write to the same temporary file
+    """
+    return f"{os.getpid()}.{threading.get_ident()}"
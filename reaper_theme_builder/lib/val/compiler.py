@@ -0,0 +1,265 @@
+# This module compiles expressions into Python code objects, so that each distinct
+# expression is only parsed and validated once. Compiled expressions are cached on
+# disk between runs.
+#
+# Expressions are validated against the same functions and names that are given to
+# SimpleEval. Expressions using syntax that isn't handled here fall back to SimpleEval,
+# so they behave exactly as before (including raising errors at evaluation time).
+
+import ast
+import functools
+import hashlib
+import marshal
+import os
+import sys
+from pathlib import Path
+from typing import Any, Callable
+
+import simpleeval
+from simpleeval import SimpleEval
+
+from ..utils import tmp_suffix
+
+# bump this when the compiled output changes, to invalidate existing caches
+COMPILER_VERSION = 1
+
+# don't let the cache grow forever when building many different themes
+MAX_CACHE_ENTRIES = 200_000
+
+# operators that SimpleEval guards against huge results, these are compiled into
+# calls to SimpleEval's own implementation
+_GUARDED_OPERATORS = {
+    ast.Add: "__op_add",
+    ast.Mult: "__op_mult",
+    ast.Pow: "__op_pow",
+    ast.LShift: "__op_lshift",
+    ast.RShift: "__op_rshift",
+}
+
+# every other operator SimpleEval supports behaves the same as native Python
+_ALLOWED_NODES = (
+    ast.Expression,
+    ast.Constant,
+    ast.Name,
+    ast.Load,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.BoolOp,
+    ast.Compare,
+    ast.IfExp,
+    ast.Call,
+    ast.keyword,
+    ast.Subscript,
+    ast.Slice,
+    *simpleeval.DEFAULT_OPERATORS,
+    ast.And,
+    ast.Or,
+)
+
+
+class _Unsupported(Exception):
+    """The expression can't be compiled, and should be evaluated by SimpleEval"""
+
+
+class _Transformer(ast.NodeTransformer):
+    def __init__(self, functions: dict, names: dict) -> None:
+        self.functions = functions
+        self.names = names
+
+    def generic_visit(self, node):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise _Unsupported(type(node).__name__)
+        return super().generic_visit(node)
+
+    def visit_Constant(self, node: ast.Constant):
+        value = node.value
+        if hasattr(value, "__len__") and len(value) > simpleeval.MAX_STRING_LENGTH:
+            raise _Unsupported("long literal")
+        return node
+
+    def visit_Name(self, node: ast.Name):
+        if node.id not in self.names and node.id not in self.functions:
+            raise _Unsupported(f"unknown name {node.id}")
+        return node
+
+    def visit_Call(self, node: ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in self.functions:
+            raise _Unsupported("unknown function")
+        if any(isinstance(arg, ast.Starred) for arg in node.args):
+            raise _Unsupported("starred argument")
+        if any(kw.arg is None for kw in node.keywords):
+            raise _Unsupported("keyword unpacking")
+
+        # SimpleEval looks up called functions separately from names, which can't be
+        # reproduced if a name shadows the function
+        if node.func.id in self.names:
+            raise _Unsupported("function shadowed by name")
+
+        return self.generic_visit(node)
+
+    def visit_BinOp(self, node: ast.BinOp):
+        node = self.generic_visit(node)
+
+        helper = _GUARDED_OPERATORS.get(type(node.op))
+        if helper is None:
+            return node
+
+        # the new nodes get their locations here, which is much cheaper than running
+        # `ast.fix_missing_locations` over the whole tree
+        call = ast.Call(
+            func=ast.copy_location(ast.Name(id=helper, ctx=ast.Load()), node),
+            args=[node.left, node.right],
+            keywords=[],
+        )
+        return ast.copy_location(call, node)
+
+
+def _parse(text: str) -> ast.Expression:
+    """Parse an expression the same way SimpleEval does"""
+    try:
+        module = ast.parse(text.strip())
+    except SyntaxError:
+        raise _Unsupported("syntax error")
+
+    if len(module.body) != 1 or not isinstance(module.body[0], ast.Expr):
+        raise _Unsupported("not a single expression")
+
+    return ast.Expression(body=module.body[0].value)
+
+
+@functools.cache
+def source_digest():
+    """
+    Hash the source of this package, which has the built-in functions and evaluates
+    expressions, so that cached values aren't reused after either of them changes
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for path in sorted(Path(__file__).parent.glob("*.py")):
+        h.update(f"{path.name}\0".encode())
+        h.update(hashlib.blake2b(path.read_bytes(), digest_size=16).digest())
+    return h.hexdigest()
+
+
+def fingerprint(functions: dict, names: dict):
+    """
+    A key that identifies the set of functions and names available to expressions, and
+    the built-in implementations of those functions
+    """
+    parts = [
+        f"compiler={COMPILER_VERSION}",
+        f"source={source_digest()}",
+        f"python={sys.version_info[0]}.{sys.version_info[1]}",
+        f"marshal={marshal.version}",
+        f"functions={','.join(sorted(functions))}",
+        f"names={','.join(sorted(names))}",
+    ]
+    return hashlib.blake2b("\n".join(parts).encode(), digest_size=8).hexdigest()
+
+
+class ExpressionCompiler:
+    """
+    Compiles expressions into fast callables. Each distinct expression is only compiled
+    once, and if a cache folder is given, compiled expressions are stored on disk so
+    that the next run can skip compiling them entirely.
+    """
+
+    def __init__(
+        self,
+        functions: dict[str, Callable],
+        names: dict[str, Any],
+        cache_dir: Path | None = None,
+    ) -> None:
+        self._simple_eval = SimpleEval(functions=functions, names=names)
+        self._fingerprint = fingerprint(functions, names)
+        self._transformer = _Transformer(functions, names)
+
+        self._globals = {
+            **functions,
+            **names,
+            "__builtins__": {},
+            "__op_add": simpleeval.DEFAULT_OPERATORS[ast.Add],
+            "__op_mult": simpleeval.DEFAULT_OPERATORS[ast.Mult],
+            "__op_pow": simpleeval.DEFAULT_OPERATORS[ast.Pow],
+            "__op_lshift": simpleeval.DEFAULT_OPERATORS[ast.LShift],
+            "__op_rshift": simpleeval.DEFAULT_OPERATORS[ast.RShift],
+        }
+
+        # the on-disk cache, mapping expressions to code objects (or None if the
+        # expression must be evaluated by SimpleEval)
+        self._cache_path = None
+        if cache_dir is not None:
+            self._cache_path = Path(cache_dir) / f"expressions-{self._fingerprint}.bin"
+        self._code: dict[str, Any] | None = None
+        self._modified = False
+
+        # map from expressions to callables
+        self._compiled: dict[str, Callable[[], Any]] = {}
+
+    def _load(self):
+        self._code = {}
+        if self._cache_path is None:
+            return
+
+        try:
+            # reading the whole file first is much faster than marshal.load() on a file
+            with open(self._cache_path, "rb") as f:
+                code = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            return
+
+        if isinstance(code, dict):
+            self._code = code
+
+    def save(self):
+        """Write newly compiled expressions to the cache folder"""
+        if self._cache_path is None or not self._modified or self._code is None:
+            return
+
+        code = self._code
+        if len(code) > MAX_CACHE_ENTRIES:
+            # only keep the expressions used in this run
+            code = {k: v for k, v in code.items() if k in self._compiled}
+
+        os.makedirs(self._cache_path.parent, exist_ok=True)
+        tmp_path = self._cache_path.with_name(
+            f"{self._cache_path.name}.{tmp_suffix()}"
+        )
+        with open(tmp_path, "wb") as f:
+            marshal.dump(code, f)
+        os.replace(tmp_path, self._cache_path)
+
+        self._modified = False
+
+    def _compile_code(self, text: str):
+        try:
+            tree = self._transformer.visit(_parse(text))
+        except _Unsupported:
+            return None
+
+        return compile(tree, "<expression>", "eval")
+
+    def compile(self, text: str) -> Callable[[], Any]:
+        """Compile an expression, returns a function that evaluates the expression"""
+        func = self._compiled.get(text)
+        if func is not None:
+            return func
+
+        if self._code is None:
+            self._load()
+        assert self._code is not None
+
+        if text in self._code:
+            code = self._code[text]
+        else:
+            code = self._compile_code(text)
+            self._code[text] = code
+            self._modified = True
+
+        if code is None:
+            func = functools.partial(self._simple_eval.eval, text)
+        else:
+            # a partial of a builtin is called without a Python frame of its own
+            func = functools.partial(eval, code, self._globals)
+
+        self._compiled[text] = func
+        return func
@@ -1,6 +1,20 @@
+import configparser
+import hashlib
+import marshal
+import os
+import time
 from configparser import ConfigParser
+from pathlib import Path
+from typing import Any, Callable
 
-from ..utils import get_config_section_and_key
+from ..utils import get_config_section_and_key, tmp_suffix
+
+# bump this when the table format changes, to invalidate existing caches
+TABLE_VERSION = 2
+
+
+class ConstantCycleError(ValueError):
+    """A constant refers to itself, directly or through other constants"""
 
 
 class ConstantsConfig:
@@ -13,5 +27,187 @@ class ConstantsConfig:
         section, name = get_config_section_and_key(self._config, full_name)
         return self._config[section][name]
 
+    def raw_values(self):
+        """
+        Map from full names like 'colors.bg' to raw values, or to the exception raised
+        when the value couldn't be interpolated.
+        """
+        values: dict[str, str | Exception] = {}
+        for section in self._config:
+            for name in self._config[section]:
+                # names containing a period can't be referred to by a full name
+                if "." in name:
+                    continue
+
+                try:
+                    values[f"{section}.{name}"] = self._config[section][name]
+                except configparser.Error as e:
+                    values[f"{section}.{name}"] = e
+
+        return values
+
     def __len__(self):
         return sum(len(self._config[section]) for section in self._config)
+
+
+class ConstantsTable:
+    """
+    A flat table of evaluated constants.
+
+    Every constant is evaluated once, in dependency order, when the table is compiled.
+    Constants that fail to evaluate (including cycles) only raise an error when they
+    are used. The constants each constant refers to are recorded in `dependencies`,
+    and while `reads` is a set, the constants read by expressions are added to it.
+    """
+
+    def __init__(self, config: ConstantsConfig) -> None:
+        self._config = config
+        self._raw = config.raw_values()
+
+        # map from full names to evaluated values
+        self._values: dict[str, Any] = {}
+
+        # map from full names to the error raised when evaluating them
+        self._errors: dict[str, Exception] = {
+            k: v for k, v in self._raw.items() if isinstance(v, Exception)
+        }
+
+        # map from full names to the constants they refer to
+        self.dependencies: dict[str, list[str]] = {}
+
+        # map from full names to the seconds taken to evaluate them, including the
+        # constants they refer to
+        self.seconds: dict[str, float] = {}
+
+        # the constants currently being evaluated, innermost last
+        self._resolving: list[str] = []
+
+        # when set, the full names of constants read outside of other constants
+        self.reads: set[str] | None = None
+
+        self._val: Callable[[str], Any] | None = None
+
+    def __len__(self):
+        return len(self._raw)
+
+    def key(self, fingerprint: str):
+        """A key that identifies the raw constants and the functions used to evaluate them"""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"table={TABLE_VERSION}\n{fingerprint}\n".encode())
+        for name, raw in sorted(self._raw.items()):
+            h.update(f"{name}\0{raw}\0".encode())
+        return h.hexdigest()
+
+    def compile(self, val: Callable[[str], Any]):
+        """Evaluate every constant using the given function"""
+        self._val = val
+        for name in self._raw:
+            if name in self._values or name in self._errors:
+                continue
+
+            try:
+                self._resolve(name)
+            except Exception:
+                # the error is recorded, and raised again if the constant is used
+                pass
+
+    def get(self, full_name: str):
+        if full_name not in self._raw:
+            # find the constant the same way as the config does, this raises an error
+            # if the constant doesn't exist
+            section, name = get_config_section_and_key(
+                self._config._config, full_name
+            )
+            full_name = f"{section}.{self._config._config.optionxform(name)}"
+
+        if len(self._resolving) > 0:
+            deps = self.dependencies.setdefault(self._resolving[-1], [])
+            if full_name not in deps:
+                deps.append(full_name)
+        elif self.reads is not None:
+            self.reads.add(full_name)
+
+        try:
+            return self._values[full_name]
+        except KeyError:
+            return self._resolve(full_name)
+
+    def _resolve(self, full_name: str):
+        error = self._errors.get(full_name)
+        if error is not None:
+            raise error
+
+        if full_name in self._resolving:
+            cycle = self._resolving[self._resolving.index(full_name) :] + [full_name]
+            raise ConstantCycleError(f"Constant refers to itself: {' -> '.join(cycle)}")
+
+        if self._val is None:
+            raise RuntimeError("Constants table hasn't been compiled")
+
+        raw = self._raw[full_name]
+        assert isinstance(raw, str)
+
+        self._resolving.append(full_name)
+        start = time.perf_counter()
+        try:
+            value = self._val(raw)
+        except Exception as e:
+            self._errors[full_name] = e
+            raise
+        finally:
+            self._resolving.pop()
+            self.seconds[full_name] = time.perf_counter() - start
+
+        self._values[full_name] = value
+        return value
+
+    def raw_values(self):
+        """Map from full names to raw values, see `ConstantsConfig.raw_values`"""
+        return self._raw
+
+    def state(self):
+        """The evaluated constants, which can be restored into a table elsewhere"""
+        return {
+            "raw": self._raw,
+            "values": self._values,
+            "dependencies": self.dependencies,
+        }
+
+    def restore(self, state: Any):
+        """Restore evaluated constants from `state`, returns True if they still apply"""
+        if not isinstance(state, dict) or state.get("raw") != self._raw:
+            return False
+
+        self._values = state["values"]
+        self.dependencies = state["dependencies"]
+        return True
+
+    def load(self, path: Path):
+        """Load evaluated constants from a cache file, returns True if successful"""
+        try:
+            with open(path, "rb") as f:
+                data = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            return False
+
+        return self.restore(data)
+
+    def save(self, path: Path):
+        """
+        Save evaluated constants to a cache file. Tables with errors aren't saved, as
+        the errors can't be stored.
+        """
+        if len(self._errors) > 0:
+            return
+
+        try:
+            dumped = marshal.dumps(self.state())
+        except ValueError:
+            # some constants evaluated to values that can't be stored
+            return
+
+        os.makedirs(path.parent, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{tmp_suffix()}")
+        with open(tmp_path, "wb") as f:
+            f.write(dumped)
+        os.replace(tmp_path, path)
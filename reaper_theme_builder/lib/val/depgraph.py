@@ -0,0 +1,249 @@
+# This module keeps the output of the last build together with the constants each part
+# of it depends on, so a build after the constants change only evaluates the parts
+# that are affected.
+#
+# While an expression is evaluated, the constants it reads with `c(...)` are recorded.
+# Constants record the constants they refer to in turn, so when the constants change,
+# everything that depends on a changed constant directly or transitively is found by
+# walking the graph of the previous build:
+#
+#     constants.ini            rtconfig.txt
+#     a = rgb(1, 2, 3)   <---  {{c("x.b")}}   (depends on x.b, and so on x.a)
+#     b = c("x.a") + 1
+#
+# Only constants that were read in the previous build can affect its output, so the
+# dependencies recorded then are enough to tell what changed. Expressions that call
+# functions that aren't pure are never kept.
+#
+# The tokenized rtconfig files and their processed output are kept as well, so a file
+# whose expressions are all unaffected is copied from the last build as it is, and a
+# file with some affected expressions only evaluates those and splices the values back
+# into the text.
+
+import hashlib
+import marshal
+import os
+from pathlib import Path
+from typing import Any
+
+from ..utils import tmp_suffix
+from .constants import ConstantsTable
+from .evaluator import expressions
+from .formatter import Template, compile_double
+
+# bump this when the graph format changes, to invalidate existing graphs
+GRAPH_VERSION = 1
+
+
+def graph_path(
+    cache_dir: Path,
+    input_dir: Path,
+    constants_path: Path | None,
+    *,
+    minify=False,
+):
+    """The path of the graph of a theme built with the given constants file"""
+    key = "\0".join(
+        [
+            f"graph={GRAPH_VERSION}",
+            os.path.abspath(input_dir),
+            "" if constants_path is None else os.path.abspath(constants_path),
+            f"minify={minify}",
+        ]
+    )
+    digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+    return Path(cache_dir) / "graphs" / f"{digest}.bin"
+
+
+def _digest(text: str):
+    return hashlib.blake2b(text.encode("utf8"), digest_size=16).digest()
+
+
+class DependencyGraph:
+    """
+    Values of expressions and rtconfig outputs of the last build, and the constants
+    they depend on. Stored at `path` if given.
+    """
+
+    def __init__(self, path: Path | None = None) -> None:
+        self.path = path
+
+        # the functions, and the raw constants and the constants each one refers to,
+        # that the values were evaluated with
+        self._functions = ""
+        self._constants: dict[str, str] = {}
+        self._dependencies: dict[str, list[str]] = {}
+
+        # map from expressions to their values as text, and the constants they read
+        self.values: dict[str, str] = {}
+        self._reads: dict[str, tuple[str, ...]] = {}
+
+        # map from rtconfig files to the digest of their text, their template, and
+        # their output if none of its expressions changed since it was rendered
+        self._files: dict[str, list[Any]] = {}
+
+        # expressions and files used by this build, others are dropped when saving
+        self._used: set[str] = set()
+        self._seen: set[str] = set()
+
+        self._modified = False
+
+    @classmethod
+    def load(cls, path: Path):
+        """Load a graph saved by a previous build, or an empty graph if there is none"""
+        graph = cls(path)
+        try:
+            with open(path, "rb") as f:
+                data = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            return graph
+
+        if not isinstance(data, dict) or data.get("version") != GRAPH_VERSION:
+            return graph
+
+        graph._functions = data["functions"]
+        graph._constants = data["constants"]
+        graph._dependencies = data["dependencies"]
+        graph.values = data["values"]
+        graph._reads = data["reads"]
+        graph._files = data["files"]
+        return graph
+
+    def save(self):
+        """Store the graph for the next build, if it changed"""
+        if self.path is None or not self._modified:
+            return
+
+        files = {name: self._files[name] for name in self._seen if name in self._files}
+        used = set(self._used)
+        for _, template, _ in files.values():
+            used.update(expressions(template))
+        values = {raw: v for raw, v in self.values.items() if raw in used}
+
+        data = {
+            "version": GRAPH_VERSION,
+            "functions": self._functions,
+            "constants": self._constants,
+            "dependencies": self._dependencies,
+            "values": values,
+            "reads": {raw: self._reads[raw] for raw in values},
+            "files": files,
+        }
+        os.makedirs(self.path.parent, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{tmp_suffix()}")
+        with open(tmp_path, "wb") as f:
+            marshal.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+        self._modified = False
+
+    def update(self, constants: ConstantsTable, functions: str):
+        """
+        Drop everything that depends on constants that changed since the values were
+        evaluated, given the new constants and a key that identifies the functions.
+        Returns the number of expressions that were dropped.
+        """
+        raw = {
+            name: value
+            for name, value in constants.raw_values().items()
+            if isinstance(value, str)
+        }
+        if functions == self._functions and raw == self._constants:
+            return 0
+
+        if functions != self._functions:
+            dropped = len(self.values)
+            self.values.clear()
+            self._reads.clear()
+            for entry in self._files.values():
+                entry[2] = None
+        else:
+            dropped = self._invalidate(self._changed(raw))
+
+        self._functions = functions
+        self._constants = raw
+        self._dependencies = constants.dependencies
+        self._modified = True
+        return dropped
+
+    def _changed(self, raw: dict[str, str]):
+        """The constants that changed, or depend on a constant that changed"""
+        changed = {
+            name
+            for name in self._constants.keys() | raw.keys()
+            if self._constants.get(name) != raw.get(name)
+        }
+
+        # map from constants to the constants that refer to them
+        dependents: dict[str, list[str]] = {}
+        for name, deps in self._dependencies.items():
+            for dep in deps:
+                dependents.setdefault(dep, []).append(name)
+
+        pending = list(changed)
+        while len(pending) > 0:
+            for name in dependents.get(pending.pop(), []):
+                if name not in changed:
+                    changed.add(name)
+                    pending.append(name)
+
+        return changed
+
+    def _invalidate(self, changed: set[str]):
+        if len(changed) == 0:
+            return 0
+
+        dropped = {
+            raw for raw, reads in self._reads.items() if not changed.isdisjoint(reads)
+        }
+        for raw in dropped:
+            del self.values[raw]
+            del self._reads[raw]
+
+        for entry in self._files.values():
+            if entry[2] is not None and not dropped.isdisjoint(expressions(entry[1])):
+                entry[2] = None
+
+        return len(dropped)
+
+    def record(self, raw: str, value: str, reads: tuple[str, ...]):
+        """Record the value of an expression, and the constants it read"""
+        self.values[raw] = value
+        self._reads[raw] = reads
+        self._used.add(raw)
+        self._modified = True
+
+    def get(self, raw: str):
+        """The value of an expression as text, or None if it must be evaluated"""
+        value = self.values.get(raw)
+        if value is not None:
+            self._used.add(raw)
+        return value
+
+    def template(self, name: str, text: str) -> Template:
+        """The template of a rtconfig file, only tokenized again if its text changed"""
+        self._seen.add(name)
+        digest = _digest(text)
+        entry = self._files.get(name)
+        if entry is not None and entry[0] == digest:
+            return entry[1]
+
+        template = compile_double(text)
+        self._files[name] = [digest, template, None]
+        self._modified = True
+        return template
+
+    def output(self, name: str):
+        """
+        The output of a rtconfig file from the last build, if none of its expressions
+        changed since then. `template` must be called first, to check its text.
+        """
+        entry = self._files.get(name)
+        return None if entry is None else entry[2]
+
+    def set_output(self, name: str, output: str):
+        """Keep the output of a rtconfig file, if all its expressions were recorded"""
+        entry = self._files[name]
+        if all(raw in self.values for raw in expressions(entry[1])):
+            entry[2] = output
+            self._modified = True
@@ -1,31 +1,125 @@
-import functools
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Iterable
 
-from simpleeval import SimpleEval
+from ..timings import Timings
+from .compiler import ExpressionCompiler, fingerprint
+from .constants import ConstantsConfig, ConstantsTable
+from .formatter import (
+    Template,
+    split_double,
+    split_double_stream,
+    split_single,
+)
+from .funcs import NRGB_CONST
+from .registry import BUILTINS, MEMO_MIN_COST, FunctionModule, Memo
 
-from .constants import ConstantsConfig
-from .formatter import split_double, split_single
-from .funcs import FUNCTIONS, NRGB_CONST
+if TYPE_CHECKING:
+    from .depgraph import DependencyGraph
+
+
+def expressions(template: Template):
+    """The expressions in a template, in order"""
+    return [raw for _, raw in template if raw is not None]
 
 
 class Evaluator:
-    def __init__(self, constants: ConstantsConfig | None = None) -> None:
+    def __init__(
+        self,
+        constants: ConstantsConfig | None = None,
+        cache_dir: Path | None = None,
+        timings: Timings | None = None,
+        constants_state: Any = None,
+        function_paths: list[Path] | None = None,
+        graph: "DependencyGraph | None" = None,
+    ) -> None:
         if constants is None:
             constants = ConstantsConfig(None)
 
-        self._constants = constants
+        # when set, the time taken by every expression is recorded
+        self.timings = timings
+
+        self._config = constants
+        self._cache_dir = cache_dir
+        self._constants = ConstantsTable(constants)
+
+        # project-local function modules, only imported when they are used
+        self._function_paths = [] if function_paths is None else function_paths
+        self._modules = [FunctionModule(p) for p in self._function_paths]
+
+        # results of calls to pure functions
+        self.memo = Memo()
+        # calls to functions that aren't pure, their results can't be reused
+        self._impure_calls = 0
+        self._function_table = self._build_functions()
+
+        functions = self._functions()
+        names = self._names()
+        self._compiler = ExpressionCompiler(functions, names, cache_dir=cache_dir)
+
+        # evaluate all constants up front, unless they were already evaluated by
+        # another evaluator, or a previous run with the same constants cached them
+        self._constants_cache = None
+        restored = constants_state is not None and self._constants.restore(
+            constants_state
+        )
+        if not restored and cache_dir is not None:
+            path = Path(cache_dir) / f"constants-{self.key()}.bin"
+            if not self._constants.load(path):
+                self._constants_cache = path
+        self._constants.compile(self.val)
+        if timings is not None:
+            timings.constants.update(self._constants.seconds)
+
+        # values of expressions from the last build, that don't depend on constants
+        # that changed since then
+        self.graph = graph
+        self.invalidated = 0
+        if graph is not None:
+            self.invalidated = graph.update(self._constants, self.functions_key())
+
+    def functions_key(self):
+        """A key that identifies the functions used to evaluate expressions"""
+        key = fingerprint(self._functions(), self._names())
+        for module in self._modules:
+            key += f"\n{module.digest}"
+        return key
 
-        self._simple_eval = SimpleEval(functions=self._functions(), names=self._names())
+    def key(self):
+        """A key that identifies the constants, and the functions used to evaluate them"""
+        return self._constants.key(self.functions_key())
 
-    @functools.cache
     def get_constant(self, full_name: str):
-        raw_value = self._constants.get_constant(full_name)
-        return self.val(raw_value)
+        return self._constants.get(full_name)
+
+    def _build_functions(self):
+        registries = [(BUILTINS.info, BUILTINS.functions)]
+        for module in self._modules:
+            functions = {name: module.function(name) for name in module.info}
+            registries.append((module.info, functions))
+
+        # later modules replace functions with the same name
+        table: dict[str, Callable] = {}
+        for info, functions in registries:
+            for name, func in functions.items():
+                if not info[name].pure:
+                    func = self._impure(func)
+                elif info[name].cost >= MEMO_MIN_COST:
+                    func = self.memo.wrap(name, func)
+                table[name] = func
+
+        table["c"] = self._constants.get
+        return table
+
+    def _impure(self, func: Callable):
+        def call(*args, **kwargs):
+            self._impure_calls += 1
+            return func(*args, **kwargs)
+
+        return call
 
     def _functions(self):
-        return {
-            **FUNCTIONS,
-            "c": self.get_constant,
-        }
+        return self._function_table
 
     def _names(self):
         return {
@@ -33,20 +127,174 @@ class Evaluator:
         }
 
     def val(self, text: str):
-        return self._simple_eval.eval(text)
+        if self.timings is None:
+            return self._compiler.compile(text)()
+
+        start = time.perf_counter()
+        try:
+            return self._compiler.compile(text)()
+        finally:
+            self.timings.expression(text, time.perf_counter() - start)
+
+    def track(self, raw: str):
+        """
+        Evaluate an expression, returns its value as text and the constants it read,
+        or None instead of the constants if it called a function that isn't pure
+        """
+        table = self._constants
+        table.reads = reads = set()
+        impure_calls = self._impure_calls
+        try:
+            value = str(self.val(raw))
+        finally:
+            table.reads = None
+
+        if self._impure_calls != impure_calls:
+            return value, None
+        return value, tuple(sorted(reads))
+
+    def value(self, raw: str):
+        """
+        The value of an expression as text, reused from the dependency graph if none of
+        the constants it depends on changed since the last build
+        """
+        graph = self.graph
+        if graph is None:
+            if self.timings is None:
+                # the common case, without the extra call to `val`
+                return str(self._compiler.compile(raw)())
+            return str(self.val(raw))
+
+        value = graph.get(raw)
+        if value is None:
+            value, reads = self.track(raw)
+            if reads is not None:
+                graph.record(raw, value, reads)
+        return value
+
+    def save_cache(self):
+        """
+        Store compiled expressions, constants and the dependency graph in the cache
+        folder for the next run
+        """
+        self._compiler.save()
+
+        if self._constants_cache is not None:
+            self._constants.save(self._constants_cache)
+            self._constants_cache = None
+
+        if self.graph is not None:
+            self.graph.save()
 
     def parse_single(self, text: str):
         result = []
+        append = result.append
+        value = self.value
         for prefix, raw in split_single(text):
-            result.append(prefix)
+            append(prefix)
             if raw is not None:
-                result.append(str(self.val(raw)))
+                append(value(raw))
         return "".join(result)
 
-    def parse_double(self, text: str):
+    def parse_double(self, text: str, *, jobs: int | None = None):
+        """
+        Evaluate the double brace expressions in a text. If `jobs` is more than 1, the
+        expressions are evaluated in that many processes, see `evaluate_many`.
+        """
+        if jobs is not None and jobs > 1:
+            template = tuple(split_double(text))
+            values = self.evaluate_many(expressions(template), jobs=jobs)
+            return "".join(self.render(template, values))
+
         result = []
+        append = result.append
+        value = self.value
         for prefix, raw in split_double(text):
-            result.append(prefix)
+            append(prefix)
             if raw is not None:
-                result.append(str(self.val(raw)))
+                append(value(raw))
         return "".join(result)
+
+    def parse_file(self, name: str, text: str):
+        """
+        Like `parse_double`, for the text of the file `name`. With a dependency graph,
+        the output of the last build is reused if none of its expressions changed.
+        """
+        graph = self.graph
+        if graph is None:
+            return self.parse_double(text)
+
+        template = graph.template(name, text)
+        output = graph.output(name)
+        if output is None:
+            output = "".join(self.render(template))
+            graph.set_output(name, output)
+        return output
+
+    def evaluate_many(self, expressions: Iterable[str], *, jobs: int | None = None):
+        """
+        Evaluate distinct expressions in a process pool with `jobs` processes, returns
+        a map from expressions to their values as strings, to give to `render`.
+        Expressions that raised an error map to None, `render` evaluates these again
+        to raise the error where the expression is used. Expressions in the dependency
+        graph aren't evaluated again.
+        """
+        from .parallel import evaluate_parallel
+
+        graph = self.graph
+        values: dict[str, str | None] = {}
+        pending = []
+        for raw in dict.fromkeys(expressions):
+            value = None if graph is None else graph.get(raw)
+            if value is None:
+                pending.append(raw)
+            else:
+                values[raw] = value
+
+        evaluated, seconds, reads = evaluate_parallel(
+            self._config,
+            self._constants.state(),
+            pending,
+            jobs=jobs,
+            cache_dir=self._cache_dir,
+            function_paths=self._function_paths,
+            timed=self.timings is not None,
+            tracked=graph is not None,
+        )
+        values.update(evaluated)
+        if graph is not None:
+            for raw, constants in reads.items():
+                value = evaluated[raw]
+                if value is not None and constants is not None:
+                    graph.record(raw, value, constants)
+        if self.timings is not None:
+            for text, s in seconds.items():
+                self.timings.expression(text, s)
+        return values
+
+    def render(self, template: Template, values: dict[str, str | None] | None = None):
+        """
+        Evaluate a template made by `compile_double`, yields the output in pieces. The
+        same template can be rendered many times, without tokenizing the text again.
+        Expressions found in `values`, made by `evaluate_many`, aren't evaluated again.
+        """
+        for literal, raw in template:
+            if len(literal) != 0:
+                yield literal
+            if raw is None:
+                continue
+
+            value = None if values is None else values.get(raw)
+            # expressions that failed in a worker are evaluated here to raise the error
+            yield self.value(raw) if value is None else value
+
+    def iter_double(self, chunks: Iterable[str]):
+        """
+        Like `parse_double`, but processes text piece by piece. Joining the yielded
+        pieces gives the same result as `parse_double`.
+        """
+        for prefix, raw in split_double_stream(chunks):
+            if len(prefix) != 0:
+                yield prefix
+            if raw is not None:
+                yield self.value(raw)
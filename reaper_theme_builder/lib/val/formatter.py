@@ -1,10 +1,93 @@
 # This module is responsible for taking a string, then finding
 # format braces "{abc}" or "{{abc}}" in them.
+#
+# Both syntaxes are tokenized in a single pass over the text, without backtracking,
+# so the time taken only grows linearly with the length of the text. Text is split into
+# segments: literal text, followed by the expression that comes after it (or None).
 
 import re
-from string import Formatter
+from typing import Iterable
 
-fmt = Formatter()
+
+class TemplateSyntaxError(ValueError):
+    """Invalid braces in a template, with the line and column where they were found"""
+
+    def __init__(self, message: str, text: str, pos: int) -> None:
+        self.line = text.count("\n", 0, pos) + 1
+        self.column = pos - text.rfind("\n", 0, pos)
+        self.message = message
+        super().__init__(f"{message} (line {self.line}, column {self.column})")
+
+
+# literal text, followed by the expression that comes after it (None at the end)
+Segment = tuple[str, str | None]
+
+# a template split into segments, can be evaluated many times without tokenizing again
+Template = tuple[Segment, ...]
+
+_BRACE = re.compile(r"[{}]")
+_FIELD_NAME_END = re.compile(r"[{}\[:!]")
+
+
+def _parse_field(text: str, pos: int):
+    """
+    Parse a field after a single '{', returns the field name and the position after the
+    closing '}'. Follows the same rules as `string.Formatter.parse`, the format spec and
+    conversion are skipped.
+    """
+    start = pos
+    end = len(text)
+    c = ""
+    while pos < end:
+        match = _FIELD_NAME_END.search(text, pos)
+        if match is None:
+            c = text[end - 1]
+            pos = end
+            break
+
+        c = match.group()
+        pos = match.end()
+        if c == "{":
+            raise TemplateSyntaxError("Unexpected '{' in expression", text, pos - 1)
+        if c == "[":
+            # braces and separators are allowed between square brackets
+            close = text.find("]", pos)
+            pos = end if close == -1 else close
+            c = "["
+            continue
+        break
+
+    if c not in ("}", ":", "!"):
+        raise TemplateSyntaxError("Expected '}' before end of text", text, start - 1)
+
+    name = text[start : pos - 1]
+    if c == "}":
+        return name, pos
+
+    if c == "!":
+        # a conversion character, which may be followed by a format spec
+        if pos >= end:
+            raise TemplateSyntaxError("Expected conversion after '!'", text, pos - 1)
+        pos += 1
+        if pos < end:
+            c = text[pos]
+            pos += 1
+            if c == "}":
+                return name, pos
+            if c != ":":
+                message = "Expected ':' after conversion"
+                raise TemplateSyntaxError(message, text, pos - 1)
+
+    # skip the format spec, which may contain nested braces
+    depth = 1
+    while True:
+        match = _BRACE.search(text, pos)
+        if match is None:
+            raise TemplateSyntaxError("Unmatched '{' in format spec", text, start - 1)
+        pos = match.end()
+        depth += 1 if match.group() == "{" else -1
+        if depth == 0:
+            return name, pos
 
 
 def split_single(text: str):
@@ -20,40 +103,163 @@ def split_single(text: str):
     # The first element is actual literal text.
     # The second element is the format '{...}' that comes after the literal text
     # If the end of string is reached, the second element is None
-    for prefix, key, _, _ in fmt.parse(text):
-        yield prefix, key
+    # Escaped braces '{{' and '}}' end the literal text, like `string.Formatter.parse`
+    pos = 0
+    end = len(text)
+    while pos < end:
+        match = _BRACE.search(text, pos)
+        if match is None:
+            yield (text[pos:], None)
+            return
 
+        brace = match.group()
+        i = match.start()
+        if i + 1 < end and text[i + 1] == brace:
+            # an escaped brace
+            yield (text[pos : i + 1], None)
+            pos = i + 2
+            continue
 
-def _create_split_double_pattern():
-    # basic definitions
-    nonbracket = r"[^{}]"
-    singlebracket_l = "{" + nonbracket
-    singlebracket_r = "}" + nonbracket
+        if brace == "}":
+            raise TemplateSyntaxError("Single '}' encountered", text, i)
+        if i + 1 == end:
+            raise TemplateSyntaxError("Single '{' encountered", text, i)
 
-    # build the actual pattern
-    # all above characters are allowed in the content
-    allowed_contents = "|".join([nonbracket, singlebracket_l, singlebracket_r])
-    # wrap in non-matching group
-    allowed_contents = f"(?:{allowed_contents})+"
+        name, after = _parse_field(text, i + 1)
+        yield (text[pos:i], name)
+        pos = after
 
-    return "{{(" + allowed_contents + ")}}"
 
+# runs of two or more braces, only these can start or end a double brace expression
+_BRACE_RUN = re.compile(r"[{}][{}]+")
 
-_SPLIT_DOUBLE_PATTERN = _create_split_double_pattern()
-_SPLIT_DOUBLE_REGEX = re.compile(_SPLIT_DOUBLE_PATTERN, flags=re.DOTALL)
+
+def _opening(run: str, start: int, pos: int):
+    """
+    Find the '{{' in a run of braces starting at `start` that may open an expression,
+    returns None if there is none at or after `pos`.
+
+    An expression can't contain two braces in a row, so only an opening '{{' in the
+    last three braces of a run can be followed by an expression. The leftmost one wins.
+    """
+    if len(run) >= 3 and run[-3:-1] == "{{" and start + len(run) - 3 >= pos:
+        return start + len(run) - 3
+    if run[-2:] == "{{" and start + len(run) - 2 >= pos:
+        return start + len(run) - 2
+    return None
 
 
-def split_double(text: str):
+def split_double(
+    text: str, *, strict=False, errors: list[TemplateSyntaxError] | None = None
+):
     """
     Parser for double brace formatting, i.e.:
     ```plain
     The value of 1 + 2 is {{1 + 2}}
     ```
+    An expression can contain single braces, but not two braces in a row. Braces that
+    don't form an expression are kept as literal text, unless `strict` is set, in which
+    case an unterminated '{{' raises a `TemplateSyntaxError`. If `errors` is given,
+    the errors are added to it instead, and the text is still split.
     """
-    last_match_end = 0
-    for match in _SPLIT_DOUBLE_REGEX.finditer(text):
-        prefix = text[last_match_end : match.start()]
-        yield prefix, match.group(1)
-        last_match_end = match.end()
 
-    yield text[last_match_end:], None
+    def unterminated(pos: int):
+        if errors is not None:
+            errors.append(TemplateSyntaxError("Unterminated '{{'", text, pos))
+        elif strict:
+            raise TemplateSyntaxError("Unterminated '{{'", text, pos)
+
+    last = 0
+    opening = None
+    for match in _BRACE_RUN.finditer(text):
+        run = match.group()
+        start = match.start()
+
+        # an expression is closed by the next run of braces, if it starts with '}}'
+        if opening is not None:
+            if run.startswith("}}"):
+                yield (text[last:opening], text[opening + 2 : start])
+                last = start + 2
+            else:
+                unterminated(opening)
+
+        # most runs are a plain '{{' or '}}'
+        if run == "{{":
+            opening = start
+        elif run == "}}":
+            opening = None
+        else:
+            opening = _opening(run, start, last)
+
+    if opening is not None:
+        unterminated(opening)
+
+    yield (text[last:], None)
+
+
+def compile_double(text: str) -> Template:
+    """Split text with double brace formatting into segments, to evaluate later"""
+    return tuple(split_double(text))
+
+
+def split_double_stream(chunks: Iterable[str]):
+    """
+    Like `split_double`, but takes the text in chunks and yields results as soon as
+    possible, without holding the whole text in memory.
+
+    Unlike `split_double`, literal text without an expression (i.e. `(prefix, None)`)
+    may be yielded at any point, not just at the end.
+    """
+    buffer = ""
+    # where to look for the next run of braces
+    pos = 0
+    # position of a '{{' waiting for the next run of braces to decide if it is closed
+    opening: int | None = None
+
+    for chunk in chunks:
+        buffer += chunk
+
+        while True:
+            match = _BRACE_RUN.search(buffer, pos)
+            if match is None:
+                # a run of braces may start with the last character
+                pos = max(pos, len(buffer) - 1)
+                break
+
+            start, end = match.span()
+            if opening is not None:
+                # only the first two braces of the next run are needed to decide
+                if buffer.startswith("}}", start):
+                    yield (buffer[:opening], buffer[opening + 2 : start])
+                    buffer = buffer[start + 2 :]
+                    pos = 0
+                else:
+                    yield (buffer[:start], None)
+                    buffer = buffer[start:]
+                    pos = 0
+                opening = None
+                continue
+
+            if end == len(buffer):
+                # the run may continue in the next chunk
+                pos = start
+                break
+
+            opening = _opening(match.group(), start, 0)
+            pos = end
+
+        if opening is not None:
+            if opening > 0:
+                yield (buffer[:opening], None)
+                buffer = buffer[opening:]
+                pos -= opening
+                opening = 0
+        else:
+            # text before the next possible run of braces is never part of an expression
+            keep = min(pos, len(buffer))
+            if keep > 0:
+                yield (buffer[:keep], None)
+                buffer = buffer[keep:]
+                pos -= keep
+
+    yield (buffer, None)
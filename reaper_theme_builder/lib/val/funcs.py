@@ -1,19 +1,17 @@
-from typing import Callable
+# Built-in functions for expressions. Project-local function modules can register
+# their own functions the same way, with `register_func` imported from this module.
 
-FUNCTIONS = {}
+from .registry import BUILTINS, register_func
 
+FUNCTIONS = BUILTINS.functions
 
-def register_func(func: Callable):
-    FUNCTIONS[func.__name__] = func
-    return func
 
-
-@register_func
+@register_func(pure=True)
 def rgb(r, g, b):
     return (b << 16) + (g << 8) + r
 
 
-@register_func
+@register_func(pure=True)
 def build_hex(*args: int):
     result = 0
     for i in args:
@@ -26,12 +24,12 @@ def build_hex(*args: int):
 _hex = hex
 
 
-@register_func
+@register_func(pure=True)
 def hex(val: int):
     return _hex(val)[2:]
 
 
-@register_func
+@register_func(pure=True, cost=3)
 def arr(val: int):
     """
     Given a hex number like 0x112233, split it into bytes, then
@@ -52,7 +50,7 @@ def arr(val: int):
     return " ".join(str(i) for i in result)
 
 
-@register_func
+@register_func(pure=True, cost=5)
 def set(
     target: str,
     x: str | None = None,
@@ -173,7 +171,7 @@ BLEND_MODES = {
 # fmt: on
 
 
-@register_func
+@register_func(pure=True)
 def blend(mode: str, frac: float):
     # the blend mode is a 18-bit value, split into multiple parts:
     #
@@ -196,7 +194,7 @@ def blend(mode: str, frac: float):
     return 0b100000000000000000 + (rp_frac << 8) + rp_mode
 
 
-@register_func
+@register_func(pure=True)
 def rev(val: int):
     """
     Given a hex number like 0x112233, reverse every 2 bytes to
@@ -0,0 +1,130 @@
+# This module evaluates many expressions in a process pool, for very large rtconfig
+# files where evaluating one expression after another on a single core is too slow.
+#
+# Each worker process makes its own evaluator, starting from the constants already
+# evaluated by the main process, so constants are never evaluated again. Only the
+# distinct expressions are sent to the workers, in chunks. The results are joined back
+# into the text by the caller, in the original order, so the output is the same as
+# evaluating every expression in turn.
+#
+# Exceptions aren't sent back, as not every exception can be pickled. Expressions that
+# fail are marked, and evaluated again by the caller to raise the same error. The
+# constants read by each expression can be sent back too, for the dependency graph.
+
+import os
+import time
+from pathlib import Path
+from typing import Any
+
+from .constants import ConstantsConfig
+
+# the evaluator of a worker process, made by `_init_worker`, whether to time each
+# expression, and whether to record the constants each expression reads
+_evaluator = None
+_timed = False
+_tracked = False
+
+# expressions per chunk, fewer chunks lower the overhead of sending them to workers
+MIN_CHUNK_SIZE = 64
+
+
+def _init_worker(
+    constants: ConstantsConfig,
+    state: Any,
+    cache_dir: Path | None,
+    function_paths: list[Path],
+    timed: bool,
+    tracked: bool,
+):
+    from .evaluator import Evaluator
+
+    global _evaluator, _timed, _tracked
+    _evaluator = Evaluator(
+        constants,
+        cache_dir=cache_dir,
+        constants_state=state,
+        function_paths=function_paths,
+    )
+    _timed = timed
+    _tracked = tracked
+
+
+def _evaluate_chunk(chunk: list[str]):
+    """
+    Evaluate expressions in a worker process, returns their values as strings (None if
+    the expression raised an error), the time taken by each expression, and the
+    constants read by each expression if they are tracked
+    """
+    assert _evaluator is not None
+
+    values: list[str | None] = []
+    seconds: list[float] = []
+    reads: list[tuple[str, ...] | None] = []
+    for raw in chunk:
+        start = time.perf_counter()
+        try:
+            if _tracked:
+                value, constants = _evaluator.track(raw)
+                values.append(value)
+                reads.append(constants)
+            else:
+                values.append(str(_evaluator.val(raw)))
+        except Exception:
+            values.append(None)
+            if _tracked:
+                reads.append(None)
+        if _timed:
+            seconds.append(time.perf_counter() - start)
+
+    return values, seconds, reads
+
+
+def _chunks(items: list[str], jobs: int):
+    # a few chunks per worker, so workers that finish early can take more
+    size = max(MIN_CHUNK_SIZE, -(-len(items) // (jobs * 4)))
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def evaluate_parallel(
+    constants: ConstantsConfig,
+    state: Any,
+    expressions: list[str],
+    *,
+    jobs: int | None = None,
+    cache_dir: Path | None = None,
+    function_paths: list[Path] | None = None,
+    timed=False,
+    tracked=False,
+):
+    """
+    Evaluate distinct expressions in `jobs` processes, given the constants and their
+    evaluated state from `ConstantsTable.state()`. Returns a map from expressions to
+    their values as strings, or None for expressions that raised an error, a map from
+    expressions to the seconds taken if `timed` is true, and a map from expressions to
+    the constants they read if `tracked` is true (None if they can't be reused, see
+    `Evaluator.track`).
+    """
+    # multiprocessing is slow to import, so only import it when it is used
+    from concurrent.futures import ProcessPoolExecutor
+
+    values: dict[str, str | None] = {}
+    seconds: dict[str, float] = {}
+    reads: dict[str, tuple[str, ...] | None] = {}
+    if len(expressions) == 0:
+        return values, seconds, reads
+
+    jobs = jobs or os.cpu_count() or 1
+    chunks = _chunks(expressions, jobs)
+    with ProcessPoolExecutor(
+        min(jobs, len(chunks)),
+        initializer=_init_worker,
+        initargs=(constants, state, cache_dir, function_paths or [], timed, tracked),
+    ) as executor:
+        for chunk, (chunk_values, chunk_seconds, chunk_reads) in zip(
+            chunks, executor.map(_evaluate_chunk, chunks)
+        ):
+            values.update(zip(chunk, chunk_values))
+            seconds.update(zip(chunk, chunk_seconds))
+            reads.update(zip(chunk, chunk_reads))
+
+    return values, seconds, reads
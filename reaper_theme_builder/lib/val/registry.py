@@ -0,0 +1,204 @@
+# This module keeps the functions that can be called from expressions, with metadata
+# about each one:
+#
+# - a pure function always returns the same result for the same arguments, and has no
+#   side effects, so its results can be memoized
+# - the cost of a call, relative to a cheap built-in like `rgb()`. Looking up a
+#   memoized result costs about as much as two cheap calls, so only pure functions
+#   costing at least MEMO_MIN_COST are memoized
+#
+# Project-local function modules are Python files that register functions with
+# `register_func`. Their functions are found by reading the file without running it,
+# and the module is only imported the first time one of them is called.
+
+import ast
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Callable, NamedTuple
+
+# pure functions at least this costly are memoized
+MEMO_MIN_COST = 2
+
+# memoized results kept at most, the oldest results are dropped first
+MEMO_MAX_ENTRIES = 100_000
+
+
+class FunctionInfo(NamedTuple):
+    pure: bool
+    cost: int
+
+
+class FunctionRegistry:
+    """Functions available to expressions, and their metadata"""
+
+    def __init__(self) -> None:
+        self.functions: dict[str, Callable] = {}
+        self.info: dict[str, FunctionInfo] = {}
+
+    def add(self, func: Callable, *, pure=False, cost=1):
+        self.functions[func.__name__] = func
+        self.info[func.__name__] = FunctionInfo(pure, cost)
+
+
+# the built-in functions
+BUILTINS = FunctionRegistry()
+
+# the registries `register_func` adds functions to, the last one is used
+_targets = [BUILTINS]
+_lock = threading.Lock()
+
+
+def register_func(func: Callable | None = None, *, pure=False, cost=1):
+    """
+    Make a function available to expressions. Used as `@register_func`, or as
+    `@register_func(pure=True, cost=5)` to declare a pure function and its cost.
+    """
+
+    def register(func: Callable):
+        _targets[-1].add(func, pure=pure, cost=cost)
+        return func
+
+    if func is None:
+        return register
+    return register(func)
+
+
+def _is_register_func(node: ast.expr):
+    if isinstance(node, ast.Call):
+        node = node.func
+    if isinstance(node, ast.Attribute):
+        return node.attr == "register_func"
+    return isinstance(node, ast.Name) and node.id == "register_func"
+
+
+def _scan(tree: ast.Module, path: Path):
+    """Find the functions a module registers, and their metadata"""
+    info: dict[str, FunctionInfo] = {}
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef):
+            continue
+
+        for decorator in node.decorator_list:
+            if not _is_register_func(decorator):
+                continue
+
+            options = {"pure": False, "cost": 1}
+            keywords = decorator.keywords if isinstance(decorator, ast.Call) else []
+            for keyword in keywords:
+                if keyword.arg not in options or not isinstance(
+                    keyword.value, ast.Constant
+                ):
+                    raise ValueError(
+                        f"{path}:{decorator.lineno}: register_func options must be"
+                        " 'pure' or 'cost', given as literals"
+                    )
+                options[keyword.arg] = keyword.value.value
+            info[node.name] = FunctionInfo(**options)
+
+    return info
+
+
+class FunctionModule:
+    """A project-local Python file of functions, imported when one is first called"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            source = f.read()
+
+        # identifies the implementation, as cached constants depend on it
+        self.digest = hashlib.blake2b(source, digest_size=16).hexdigest()
+        self.info = _scan(ast.parse(source, filename=str(self.path)), self.path)
+        self._functions: dict[str, Callable] | None = None
+
+    def _load(self):
+        with _lock:
+            if self._functions is None:
+                import importlib.util
+
+                spec = importlib.util.spec_from_file_location(
+                    f"_rtb_functions_{self.digest}", self.path
+                )
+                assert spec is not None and spec.loader is not None
+                module = importlib.util.module_from_spec(spec)
+
+                registry = FunctionRegistry()
+                _targets.append(registry)
+                try:
+                    spec.loader.exec_module(module)
+                finally:
+                    _targets.pop()
+
+                missing = [name for name in self.info if name not in registry.functions]
+                if len(missing) > 0:
+                    raise ValueError(
+                        f"{self.path} didn't register: {', '.join(missing)}"
+                    )
+                self._functions = registry.functions
+
+        return self._functions
+
+    def function(self, name: str):
+        """A function that imports the module, then calls the function in it"""
+
+        def call(*args, **kwargs):
+            return self._load()[name](*args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+
+class MemoStats(NamedTuple):
+    hits: int
+    misses: int
+
+
+class Memo:
+    """Results of calls to pure functions, by their arguments"""
+
+    def __init__(self, max_entries=MEMO_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._results: dict[tuple, Any] = {}
+        # map from function names to [hits, misses]
+        self._stats: dict[str, list[int]] = {}
+
+    def wrap(self, name: str, func: Callable):
+        """Returns a function that memoizes the results of `func`"""
+        results = self._results
+        stats = self._stats.setdefault(name, [0, 0])
+
+        def memoized(*args, **kwargs):
+            # the types are part of the key, as 1, 1.0 and True are equal but may give
+            # different results
+            key = (name, args, tuple(map(type, args)))
+            if len(kwargs) > 0:
+                values = tuple(kwargs.values())
+                key += (tuple(kwargs), values, tuple(map(type, values)))
+
+            try:
+                result = results[key]
+                stats[0] += 1
+                return result
+            except KeyError:
+                pass
+            except TypeError:
+                # unhashable arguments
+                return func(*args, **kwargs)
+
+            result = func(*args, **kwargs)
+            stats[1] += 1
+            if len(results) >= self.max_entries:
+                del results[next(iter(results))]
+            results[key] = result
+            return result
+
+        return memoized
+
+    def stats(self):
+        """Map from memoized function names to their hits and misses"""
+        return {name: MemoStats(*s) for name, s in self._stats.items() if s != [0, 0]}
+
+    def reset_stats(self):
+        for s in self._stats.values():
+            s[0] = s[1] = 0
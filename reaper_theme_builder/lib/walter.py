@@ -0,0 +1,395 @@
+# This module optimizes WALTER code in a processed rtconfig, it is used by --minify.
+#
+# Lines are split into tokens, then consecutive `set` lines are optimized together:
+#
+# - arithmetic on integer literals is folded, e.g. `+ 1 2` becomes `3`
+# - temporaries that already hold the same expression are not assigned again
+# - temporaries that hold a literal, or the same expression as another temporary, are
+#   replaced by that value wherever they are read
+# - temporaries that are assigned again before they are read are removed
+#
+# Any line that isn't a `set` ends the optimized block, as layouts, macros and other
+# statements may read any variable. Lines inside macros are never optimized, as macro
+# parameters can stand for any variable. Finally, temporaries are renamed to the
+# shortest names that aren't used anywhere else.
+#
+# Only the variables made by `set()` (`__x`, `__ls` and so on) can be temporaries, and
+# only if every read of them is in a block of `set` lines, after they are assigned in
+# that block. Any other variable may be read from elsewhere, so it is kept as is.
+#
+# Renaming needs every name used in the file, and removing an assignment needs the
+# lines after it, so the whole rtconfig is optimized at once: with --minify it is
+# held in memory rather than streamed into the archive.
+
+import re
+import string
+from typing import NamedTuple
+
+# quoted strings, brackets, or anything else up to whitespace or a bracket
+_TOKEN = re.compile(r"\"[^\"]*\"|'[^']*'|[\[\]]|[^\s\[\]]+")
+# lines with quotes, or brackets right next to other tokens, keep their own spacing
+_IRREGULAR = re.compile(r"[\"']|[^\s\[]\[|\][^\s\]]")
+_INT = re.compile(r"-?[0-9]+")
+_TEMPORARY_IN_TEXT = re.compile(r"(?<![A-Za-z0-9_.])__[A-Za-z0-9_]+(?![A-Za-z0-9_.])")
+_WORD = re.compile(r"[A-Za-z0-9_.]+")
+
+# the variables `set()` assigns expressions to, see `resolve` in val/funcs.py
+SET_TEMPORARIES = frozenset(
+    f"__{name}" for name in ("x", "y", "w", "h", "ls", "ts", "rs", "bs", "else")
+)
+
+_OPERATORS = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": lambda a, b: a // b if b != 0 and a % b == 0 else None,
+}
+
+
+class OptimizeStats(NamedTuple):
+    folded: int
+    removed: int
+    renamed: int
+    bytes_in: int
+    bytes_out: int
+
+
+class _Line:
+    """
+    A tokenized line. Runs of whitespace are shortened to a single space, and there is
+    no space after '[' or before ']'. Irregular lines keep the whitespace that came
+    before each token in `spaces`, only shortened to a single space.
+    """
+
+    __slots__ = ("tokens", "spaces", "arithmetic")
+
+    def __init__(self, text: str) -> None:
+        self.tokens: list[str]
+        self.spaces: list[str] | None = None
+        self.arithmetic = "+" in text or "-" in text or "*" in text or "/" in text
+
+        if "[" not in text and "]" not in text and '"' not in text and "'" not in text:
+            self.tokens = text.split()
+            return
+
+        if _IRREGULAR.search(text) is None:
+            self.tokens = _TOKEN.findall(text)
+            return
+
+        self.tokens = []
+        self.spaces = []
+        end = 0
+        for match in _TOKEN.finditer(text):
+            self.spaces.append("" if match.start() == end else " ")
+            self.tokens.append(match.group())
+            end = match.end()
+
+    def __str__(self) -> str:
+        if self.spaces is None:
+            return " ".join(self.tokens).replace("[ ", "[").replace(" ]", "]")
+
+        spaces = self.spaces
+        return "".join(spaces[i] + t for i, t in enumerate(self.tokens)).lstrip()
+
+    def is_set(self):
+        return len(self.tokens) >= 3 and self.tokens[0].lower() == "set"
+
+
+def _is_string(token: str):
+    return token[0] in "\"'"
+
+
+def _fold(line: _Line):
+    """Fold arithmetic on integer literals outside of lists, returns the count"""
+    if not line.arithmetic:
+        return 0
+
+    tokens = line.tokens
+    spaces = line.spaces
+
+    # lists can't contain arithmetic, so skip anything between brackets
+    depth = 0
+    outside = []
+    for i, t in enumerate(tokens):
+        if t == "[":
+            depth += 1
+        elif t == "]":
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            outside.append(i)
+
+    folded = 0
+    # going backwards folds nested expressions like `+ * 2 3 4` in one pass
+    for i in reversed(outside):
+        if i < 2 or i + 2 >= len(tokens):
+            continue
+
+        op = _OPERATORS.get(tokens[i])
+        a, b = tokens[i + 1], tokens[i + 2]
+        if op is None or not _INT.fullmatch(a) or not _INT.fullmatch(b):
+            continue
+
+        result = op(int(a), int(b))
+        # negative literals aren't used by every version of WALTER, so keep them as is
+        if result is None or result < 0:
+            continue
+
+        tokens[i : i + 3] = [str(result)]
+        if spaces is not None:
+            del spaces[i + 1 : i + 3]
+        folded += 1
+
+    return folded
+
+
+def _reads(line: _Line, name: str):
+    """
+    How a line reads a variable: 0 if it doesn't, 1 if only as whole tokens, 2 if it
+    may read it in other ways (like `name{0}`)
+    """
+    result = 0
+    for t in line.tokens[2:]:
+        if t == name:
+            result = max(result, 1)
+        elif name in t and not _is_string(t):
+            return 2
+    return result
+
+
+def _optimize_block(block: list[_Line], temporaries: set[str]):
+    """Optimize consecutive `set` lines, returns the fold count and removed lines"""
+    targets = [line.tokens[1] for line in block]
+
+    # the index of the next line assigning the same variable
+    following: list[int | None] = [None] * len(block)
+    last: dict[str, int] = {}
+    for i in range(len(block) - 1, -1, -1):
+        following[i] = last.get(targets[i])
+        last[targets[i]] = i
+
+    # map from temporaries to the expressions they hold
+    holds: dict[str, str] = {}
+    # map from variables to the temporaries holding expressions that read them
+    readers: dict[str, set[str]] = {}
+    # map from removed temporaries to the values their reads are replaced with
+    aliases: dict[str, str] = {}
+
+    folded = 0
+    removed: set[int] = set()
+
+    def replaceable(i: int, name: str, value: str):
+        """
+        Whether every read of the temporary assigned on line `i` can be replaced with a
+        value, which must not be assigned before the temporary is assigned again.
+        """
+        j = following[i]
+        if j is None:
+            return False
+        for k in range(i + 1, j + 1):
+            if _reads(block[k], name) == 2:
+                return False
+            if k < j and targets[k] == value:
+                return False
+        return True
+
+    def dead(i: int, name: str):
+        """Whether the temporary is assigned again before it is read"""
+        j = following[i]
+        if j is None:
+            return False
+        return all(_reads(block[k], name) == 0 for k in range(i + 1, j + 1))
+
+    for i, line in enumerate(block):
+        tokens = line.tokens
+        target = tokens[1]
+        expression = " ".join(tokens[2:])
+
+        if len(aliases) > 0 and "__" in expression:
+            tokens[2:] = [aliases.get(t, t) for t in tokens[2:]]
+            expression = " ".join(tokens[2:])
+        aliases.pop(target, None)
+
+        count = _fold(line)
+        if count > 0:
+            folded += count
+            expression = " ".join(tokens[2:])
+
+        if target in temporaries:
+            if holds.get(target) == expression:
+                # the temporary already holds this value
+                removed.add(i)
+                continue
+
+            value = None
+            if len(tokens) == 3 and (
+                _INT.fullmatch(tokens[2]) or tokens[2] in temporaries
+            ):
+                value = tokens[2]
+            else:
+                for name, held in holds.items():
+                    if held == expression and name != target:
+                        value = name
+                        break
+
+            if value is not None and value != target:
+                if replaceable(i, target, value):
+                    aliases[target] = value
+                    removed.add(i)
+                    continue
+
+            if dead(i, target):
+                removed.add(i)
+                continue
+
+        # the assigned variable changes the value of expressions that read it
+        holds.pop(target, None)
+        for name in readers.pop(target, ()):
+            holds.pop(name, None)
+
+        if target in temporaries and target not in expression:
+            holds[target] = expression
+            for word in _WORD.findall(expression):
+                readers.setdefault(word, set()).add(target)
+
+    return folded, removed
+
+
+def _short_names(used: set[str]):
+    """Yield the shortest names starting with '_' that aren't used"""
+    letters = string.ascii_letters
+    length = 1
+    while True:
+        count = len(letters) ** length
+        for n in range(count):
+            name = ""
+            for _ in range(length):
+                n, r = divmod(n, len(letters))
+                name = letters[r] + name
+            if f"_{name}" not in used:
+                yield f"_{name}"
+        length += 1
+
+
+def _rename(
+    lines: list[str], irregular: list[bool], temporaries: set[str], used: set[str]
+):
+    """
+    Rename temporaries to shorter names that aren't in `used`, returns the number
+    renamed
+    """
+    counts: dict[str, int] = {}
+    for name in _TEMPORARY_IN_TEXT.findall("\n".join(lines)):
+        if name in temporaries:
+            counts[name] = counts.get(name, 0) + 1
+
+    # the most used temporaries get the shortest names
+    names = _short_names(used)
+    renames = {}
+    for old in sorted(counts, key=lambda x: (-counts[x], x)):
+        new = next(names)
+        if len(new) < len(old):
+            renames[old] = new
+
+    if len(renames) == 0:
+        return 0
+
+    def rename(match: re.Match):
+        return renames.get(match.group(), match.group())
+
+    for i, line in enumerate(lines):
+        if "__" not in line:
+            continue
+
+        if not irregular[i]:
+            lines[i] = _TEMPORARY_IN_TEXT.sub(rename, line)
+            continue
+
+        # don't rename anything in quoted strings
+        lines[i] = "".join(
+            part if part[:1] in "\"'" else _TEMPORARY_IN_TEXT.sub(rename, part)
+            for part in re.split(r"(\"[^\"]*\"|'[^']*')", line)
+        )
+
+    return len(renames)
+
+
+def _local_reads(line: _Line, text: str, assigned: set[str]):
+    """
+    The possible temporaries in a `set` line, and whether each of them is only read
+    as a whole token after being assigned in the block (`assigned`)
+    """
+    target = line.tokens[1]
+    result = {}
+    for name in _TEMPORARY_IN_TEXT.findall(text):
+        if name not in SET_TEMPORARIES:
+            continue
+        if line.spaces is not None or (name != target and name in target):
+            result[name] = False
+            continue
+
+        reads = _reads(line, name)
+        if reads == 0:
+            result[name] = name == target
+        else:
+            result[name] = reads == 1 and name in assigned
+    return result
+
+
+def optimize(text: str):
+    """Optimize the WALTER code in a processed rtconfig, returns the text and stats"""
+    texts = text.split("\n")
+    lines = [_Line(l) for l in texts]
+
+    # blocks of consecutive `set` lines outside of macros, as lists of line indices
+    blocks: list[list[int]] = [[]]
+    # variables made by `set()` that are read anywhere else than in a block after
+    # being assigned in it, these aren't temporaries
+    kept: set[str] = set()
+    # variables made by `set()` assigned in the current block
+    assigned: set[str] = set()
+
+    macro_depth = 0
+    for i, line in enumerate(lines):
+        if len(line.tokens) == 0:
+            # empty lines don't end a block
+            continue
+
+        if line.is_set() and macro_depth == 0:
+            if "__" in texts[i]:
+                for name, local in _local_reads(line, texts[i], assigned).items():
+                    if not local:
+                        kept.add(name)
+                assigned.add(line.tokens[1])
+            blocks[-1].append(i)
+            continue
+
+        if "__" in texts[i]:
+            kept.update(_TEMPORARY_IN_TEXT.findall(texts[i]))
+        if len(blocks[-1]) > 0:
+            blocks.append([])
+        assigned.clear()
+
+        keyword = line.tokens[0].lower()
+        if keyword == "macro":
+            macro_depth += 1
+        elif keyword == "endmacro":
+            macro_depth = max(macro_depth - 1, 0)
+
+    temporaries = SET_TEMPORARIES - kept
+
+    folded = 0
+    removed: set[int] = set()
+    for block in blocks:
+        if len(block) > 0:
+            count, dropped = _optimize_block([lines[i] for i in block], temporaries)
+            folded += count
+            removed.update(block[i] for i in dropped)
+
+    kept_lines = [line for i, line in enumerate(lines) if i not in removed]
+    output = [str(line) for line in kept_lines]
+    irregular = [line.spaces is not None for line in kept_lines]
+    renamed = _rename(output, irregular, temporaries, set(_WORD.findall(text)))
+    result = "\n".join(output)
+
+    stats = OptimizeStats(folded, len(removed), renamed, len(text), len(result))
+    return result, stats
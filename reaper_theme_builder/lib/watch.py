@@ -0,0 +1,204 @@
+# This module watches a theme source folder for changes. On Linux, inotify is used
+# through ctypes. On other platforms (or if inotify is unavailable), the folder is
+# polled for changes instead.
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+# inotify event flags, see `man 7 inotify`
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; }
+_EVENT_STRUCT = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """Watch a folder and some extra files for changes using Linux's inotify API"""
+
+    def __init__(self, root, files=()) -> None:
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not supported")
+
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.root = os.path.abspath(root)
+        self.files = {os.path.abspath(f) for f in files}
+
+        # map from watch descriptors to directory paths
+        self._watches: dict[int, str] = {}
+
+        self._add_tree(self.root)
+        for path in self.files:
+            self._add_watch(os.path.dirname(path))
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            # the directory may have been deleted before we could watch it
+            return
+        self._watches[wd] = path
+
+    def _add_tree(self, path):
+        for dirpath, _, _ in os.walk(path):
+            self._add_watch(dirpath)
+
+    def _is_relevant(self, path):
+        if path in self.files:
+            return True
+        return os.path.commonpath([self.root, path]) == self.root
+
+    def _read_events(self):
+        changed: set[str] = set()
+
+        data = os.read(self._fd, 1 << 16)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_STRUCT.unpack_from(data, offset)
+            offset += _EVENT_STRUCT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # events were dropped, the whole folder must be rescanned
+                changed.add(self.root)
+                continue
+
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            dirpath = self._watches.get(wd)
+            if dirpath is None:
+                continue
+
+            path = os.path.join(dirpath, os.fsdecode(name)) if name else dirpath
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(path)
+
+            if self._is_relevant(path):
+                changed.add(path)
+
+        return changed
+
+    def wait(self, debounce=0.1):
+        """
+        Block until something changes, then return the changed paths. Events are
+        collected until no new events arrive for `debounce` seconds, as editors often
+        save a file in several steps.
+        """
+        changed: set[str] = set()
+        while len(changed) == 0:
+            select.select([self._fd], [], [])
+            changed |= self._read_events()
+
+        while select.select([self._fd], [], [], debounce)[0]:
+            changed |= self._read_events()
+
+        return changed
+
+    def poll(self):
+        """Return the paths changed since the last call, without blocking"""
+        changed: set[str] = set()
+        while select.select([self._fd], [], [], 0)[0]:
+            changed |= self._read_events()
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Watch a folder and some extra files for changes by repeatedly checking them"""
+
+    def __init__(self, root, files=(), interval=0.5) -> None:
+        self.root = os.path.abspath(root)
+        self.files = {os.path.abspath(f) for f in files}
+        self.interval = interval
+
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        snapshot: dict[str, tuple[int, int]] = {}
+
+        paths = list(self.files)
+        for dirpath, _, filenames in os.walk(self.root):
+            paths.append(dirpath)
+            paths.extend(os.path.join(dirpath, f) for f in filenames)
+
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+
+        return snapshot
+
+    def poll(self):
+        """Return the paths changed since the last call, without blocking"""
+        snapshot = self._take_snapshot()
+        changed = {
+            path
+            for path in snapshot.keys() | self._snapshot.keys()
+            if snapshot.get(path) != self._snapshot.get(path)
+        }
+        self._snapshot = snapshot
+        return changed
+
+    def wait(self):
+        """Block until something changes, then return the changed paths"""
+        while True:
+            time.sleep(self.interval)
+
+            changed = self.poll()
+            if len(changed) > 0:
+                return changed
+
+    def close(self):
+        pass
+
+
+def create_watcher(root, files=()):
+    """Create a watcher using the best method available on this platform"""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root, files)
+        except OSError:
+            pass
+
+    return PollingWatcher(root, files)
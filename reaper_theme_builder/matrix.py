@@ -0,0 +1,57 @@
+import argparse
+from pathlib import Path
+
+from .lib.cache import default_cache_dir
+from .lib.matrix import build_matrix, load_matrix
+
+parser = argparse.ArgumentParser(
+    prog="rtb matrix",
+    description="Build many variants of a theme, as described in a TOML file",
+)
+parser.add_argument(
+    "matrix", help="path to the TOML file describing the variants", type=Path
+)
+parser.add_argument(
+    "--functions",
+    metavar="PATH",
+    help="path to a Python file of extra functions for expressions, for every variant",
+    default=[],
+    action="append",
+    type=Path,
+)
+parser.add_argument(
+    "-j",
+    "--jobs",
+    help="number of processes to evaluate variants with, and threads to compress with",
+    type=int,
+)
+parser.add_argument(
+    "--cache-dir",
+    help="folder to store caches between runs in, defaults to the user's cache folder",
+    type=Path,
+)
+parser.add_argument(
+    "--no-cache",
+    help="don't read or write caches between runs",
+    action="store_true",
+)
+parser.add_argument(
+    "-v",
+    "--verbose",
+    help="print statistics for each stage",
+    action="store_true",
+)
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+
+    matrix = load_matrix(args.matrix, args.functions)
+    build_matrix(
+        matrix,
+        jobs=args.jobs,
+        cache_dir=None if args.no_cache else (args.cache_dir or default_cache_dir()),
+        verbose=args.verbose,
+    )
+
+    print("Success!")
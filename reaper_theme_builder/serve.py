@@ -0,0 +1,97 @@
+import argparse
+from pathlib import Path
+
+from .lib.cache import default_cache_dir
+from .lib.server import IDLE_TIMEOUT, MAX_PROJECTS, serve
+
+parser = argparse.ArgumentParser(
+    prog="rtb serve",
+    description="Run a build server that keeps themes in memory between builds",
+)
+parser.add_argument(
+    "--host",
+    help="address to listen on, defaults to 127.0.0.1",
+    default="127.0.0.1",
+)
+parser.add_argument(
+    "--port",
+    help="port to listen on, defaults to 8765",
+    type=int,
+    default=8765,
+)
+parser.add_argument(
+    "--socket",
+    help="listen on a Unix socket at this path instead of a TCP port, only the"
+    " current user can connect to it",
+    type=Path,
+)
+parser.add_argument(
+    "--token-file",
+    help="on a TCP port, requests must send a random token which is written to this"
+    " file, defaults to serve.token in the cache folder",
+    type=Path,
+)
+parser.add_argument(
+    "--output-dir",
+    help="folder that requests may write archives into with 'output', requests can"
+    " only get the archive in the response if not given",
+    type=Path,
+)
+parser.add_argument(
+    "--max-projects",
+    help=f"number of projects kept in memory, defaults to {MAX_PROJECTS}",
+    type=int,
+    default=MAX_PROJECTS,
+)
+parser.add_argument(
+    "--idle-timeout",
+    help="close projects that weren't built for this many minutes, 0 keeps them,"
+    f" defaults to {IDLE_TIMEOUT // 60}",
+    type=float,
+    default=IDLE_TIMEOUT / 60,
+)
+parser.add_argument(
+    "-j",
+    "--jobs",
+    help="number of builds to run at the same time, and threads to compress with",
+    type=int,
+)
+parser.add_argument(
+    "--cache-dir",
+    help="folder to store caches between runs in, defaults to the user's cache folder",
+    type=Path,
+)
+parser.add_argument(
+    "--no-cache",
+    help="don't read or write caches between runs",
+    action="store_true",
+)
+parser.add_argument(
+    "-v",
+    "--verbose",
+    help="print the files used to build each theme",
+    action="store_true",
+)
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    if args.max_projects < 1:
+        parser.error("--max-projects must be at least 1")
+
+    token_path = args.token_file
+    if token_path is None and args.socket is None:
+        token_path = (args.cache_dir or default_cache_dir()) / "serve.token"
+
+    serve(
+        host=args.host,
+        port=args.port,
+        socket_path=args.socket,
+        jobs=args.jobs,
+        cache_dir=None if args.no_cache else (args.cache_dir or default_cache_dir()),
+        output_dir=args.output_dir,
+        token_path=token_path,
+        max_projects=args.max_projects,
+        idle_timeout=None if args.idle_timeout <= 0 else args.idle_timeout * 60,
+        verbose=args.verbose,
+    )
@@ -0,0 +1,45 @@
+from pathlib import Path
+
+from reaper_theme_builder.lib.check import Problem, check_theme
+
+RTCONFIG = """\
+set a {{1 + 2}}
+"""
+
+
+def write_theme(root: Path, reaper_theme: str):
+    theme = root / "theme"
+    theme.mkdir()
+    (theme / "rtconfig.txt").write_text(RTCONFIG)
+    path = theme / "Default.ReaperTheme"
+    path.write_text(reaper_theme, encoding="utf-8-sig")
+    return theme, str(path)
+
+
+def test_valid_reaper_theme(tmp_path):
+    theme, _ = write_theme(tmp_path, "[color theme]\ncol_main_bg = {rgb(1, 2, 3)}\n")
+    result = check_theme(theme)
+    assert result.problems == []
+    assert result.files == 2
+
+
+def test_syntax_errors_are_reported(tmp_path):
+    theme, path = write_theme(tmp_path, "[color theme]\na = 1\nnot a key\n")
+    result = check_theme(theme)
+    assert result.problems == [Problem(path, 3, 1, "Expected 'key=value'")]
+
+
+def test_duplicate_keys_are_reported(tmp_path):
+    theme, path = write_theme(tmp_path, "[color theme]\na = 1\nA = {1 +}\n")
+    problems = check_theme(theme).problems
+    assert problems[0] == Problem(
+        path, 3, 1, "Duplicate key 'A' in section 'color theme'"
+    )
+    # the expressions are still checked
+    assert [p.line for p in problems] == [3, 3]
+
+
+def test_byte_order_mark(tmp_path):
+    # the byte order mark isn't part of the first section name
+    theme, _ = write_theme(tmp_path, "[color theme]\na = {2 * 3}\n")
+    assert check_theme(theme).problems == []
@@ -0,0 +1,97 @@
+from pathlib import Path
+
+from reaper_theme_builder.lib.project import Project
+from reaper_theme_builder.lib.val import compiler
+
+CONSTANTS = """\
+[x]
+a = rgb(1, 2, 3)
+b = c("x.a")
+d = 5
+e = 7
+"""
+
+RTCONFIG = """\
+set p {{c("x.b")}}
+set q {{c("x.d") + 1}}
+set r {{2 * 3}}
+"""
+
+REAPER_THEME = """\
+[color theme]
+col_main_bg = {c("x.a")}
+col_main_text = {c("x.d")}
+"""
+
+
+def write_theme(root: Path):
+    theme = root / "theme"
+    theme.mkdir()
+    (theme / "rtconfig.txt").write_text(RTCONFIG)
+    (theme / "Default.ReaperTheme").write_text(REAPER_THEME)
+    constants = root / "constants.ini"
+    constants.write_text(CONSTANTS)
+    return theme, constants
+
+
+def evaluate(theme: Path, constants: Path, cache_dir: Path | None):
+    """Evaluate a theme, returns the evaluator and the processed files"""
+    project = Project(theme, constants_path=constants, cache_dir=cache_dir)
+    text = "".join(project.rtconfig())
+    rpt = project.rptheme().serialize()
+    project.evaluator.save_cache()
+    return project.evaluator, (text, rpt)
+
+
+def change_constant(constants: Path, line: str, new: str):
+    text = constants.read_text()
+    assert line in text
+    constants.write_text(text.replace(line, new))
+
+
+def test_transitive_change_evaluates_dependents(tmp_path):
+    theme, constants = write_theme(tmp_path)
+    cache_dir = tmp_path / "cache"
+    evaluate(theme, constants, cache_dir)
+
+    # x.b refers to x.a, so {{c("x.b")}} and {c("x.a")} are evaluated again
+    change_constant(constants, "a = rgb(1, 2, 3)", "a = rgb(4, 5, 6)")
+    evaluator, output = evaluate(theme, constants, cache_dir)
+    assert evaluator.invalidated == 2
+    assert output == evaluate(theme, constants, None)[1]
+
+
+def test_unrelated_change_evaluates_nothing(tmp_path):
+    theme, constants = write_theme(tmp_path)
+    cache_dir = tmp_path / "cache"
+    _, before = evaluate(theme, constants, cache_dir)
+
+    change_constant(constants, "e = 7", "e = 8")
+    evaluator, output = evaluate(theme, constants, cache_dir)
+    assert evaluator.invalidated == 0
+    assert output == before
+
+
+def test_direct_change_evaluates_readers_only(tmp_path):
+    theme, constants = write_theme(tmp_path)
+    cache_dir = tmp_path / "cache"
+    evaluate(theme, constants, cache_dir)
+
+    change_constant(constants, "d = 5", "d = 6")
+    evaluator, output = evaluate(theme, constants, cache_dir)
+    assert evaluator.invalidated == 2
+    assert output == evaluate(theme, constants, None)[1]
+    assert "set q 7" in output[0]
+
+
+def test_builtin_change_evaluates_everything(tmp_path, monkeypatch):
+    theme, constants = write_theme(tmp_path)
+    cache_dir = tmp_path / "cache"
+    key = evaluate(theme, constants, cache_dir)[0].key()
+
+    # a new version of the built-in functions may give different values
+    monkeypatch.setattr(compiler, "source_digest", lambda: "changed")
+    evaluator, output = evaluate(theme, constants, cache_dir)
+    assert evaluator.key() != key
+    assert evaluator.invalidated == 5
+    assert output == evaluate(theme, constants, None)[1]
@@ -0,0 +1,136 @@
+import random
+import re
+from string import Formatter
+
+import pytest
+
+from reaper_theme_builder.lib.val.formatter import (
+    TemplateSyntaxError,
+    split_double,
+    split_double_stream,
+    split_single,
+)
+
+# the regex split_double replaced, which defines what an expression is
+LEGACY_REGEX = re.compile(r"{{((?:[^{}]|{[^{}]|}[^{}])+)}}", flags=re.DOTALL)
+
+
+def legacy_split_double(text: str):
+    last_match_end = 0
+    for match in LEGACY_REGEX.finditer(text):
+        yield text[last_match_end : match.start()], match.group(1)
+        last_match_end = match.end()
+
+    yield text[last_match_end:], None
+
+
+def formatter_split_single(text: str):
+    return [(literal, name) for literal, name, _, _ in Formatter().parse(text)]
+
+
+def merge(segments):
+    """Merge literal text yielded separately by split_double_stream"""
+    merged = []
+    literal = ""
+    for prefix, raw in segments:
+        literal += prefix
+        if raw is not None:
+            merged.append((literal, raw))
+            literal = ""
+    merged.append((literal, None))
+    return merged
+
+
+def chunked(text: str, size: int):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def random_texts(alphabet: str, count: int, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+
+
+DOUBLE_CASES = [
+    "",
+    "no braces at all",
+    'set x {{c("a.b") + 1}} ; comment',
+    "{{a}}{{b}}",
+    "{{a} }}",
+    "{{ {a} }}",
+    "{{{a}}}",
+    "{{{{{{{{ }}}}}}}}",
+    "{a} }b{ {c}",
+    "{{ unterminated\nset x } y",
+    "set x {{ a } b",
+    "{{a}",
+    "{{",
+    "}}",
+    "{{}}",
+    "{{a\n}}",
+]
+
+
+@pytest.mark.parametrize("text", DOUBLE_CASES)
+def test_split_double_matches_regex(text):
+    assert list(split_double(text)) == list(legacy_split_double(text))
+
+
+def test_split_double_matches_regex_on_random_text():
+    for text in random_texts("{}ab \n", 20_000):
+        assert list(split_double(text)) == list(legacy_split_double(text)), text
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7])
+def test_split_double_stream_matches_split_double(size):
+    for text in DOUBLE_CASES + list(random_texts("{}ab \n", 2_000, seed=size)):
+        expected = list(split_double(text))
+        assert merge(split_double_stream(chunked(text, size))) == expected, text
+
+
+def test_split_double_strict():
+    with pytest.raises(TemplateSyntaxError) as e:
+        list(split_double("a\nb {{ c", strict=True))
+    assert (e.value.line, e.value.column) == (2, 3)
+
+    errors = []
+    assert list(split_double("{{a} {{b", errors=errors)) == [("{{a} {{b", None)]
+    assert len(errors) == 2
+
+
+SINGLE_CASES = [
+    "",
+    "text",
+    "{rgb(1, 2, 3)} text",
+    "{{a}}",
+    "a}}b{{c",
+    "{a:{b}{c}}",
+    "{a!r}",
+    "{a[0]}",
+    "{}",
+]
+
+
+@pytest.mark.parametrize("text", SINGLE_CASES)
+def test_split_single_matches_formatter(text):
+    assert list(split_single(text)) == formatter_split_single(text)
+
+
+@pytest.mark.parametrize("text", ["{", "}", "a}b", "{a", "{a:{b}", "{a[0}"])
+def test_split_single_errors_like_formatter(text):
+    with pytest.raises(ValueError):
+        formatter_split_single(text)
+    with pytest.raises(TemplateSyntaxError):
+        list(split_single(text))
+
+
+def test_split_single_matches_formatter_on_random_text():
+    for text in random_texts("{}ab:![]0 ", 20_000):
+        try:
+            expected = formatter_split_single(text)
+        except ValueError:
+            with pytest.raises(ValueError):
+                list(split_single(text))
+            continue
+
+        assert list(split_single(text)) == expected, text
@@ -0,0 +1,143 @@
+import random
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from reaper_theme_builder.lib import archive, theme as theme_module
+from reaper_theme_builder.lib.archive import read_entries
+from reaper_theme_builder.lib.manifest import BuildManifest
+from reaper_theme_builder.lib.project import Project
+
+
+def write_theme_folder(root: Path, seed=0):
+    """A small theme source folder with a few resources"""
+    rng = random.Random(seed)
+    root.mkdir(parents=True, exist_ok=True)
+    (root / "rtconfig.txt").write_text("set x {{1 + 2}}\n")
+    (root / "Default.ReaperTheme").write_text("[color theme]\ncol_main_bg=1\n")
+    for i in range(5):
+        # partly repetitive, so resources are actually deflated
+        data = bytes(rng.randrange(4) for _ in range(2000)) * 2
+        (root / f"img{i}.png").write_bytes(data)
+    (root / "150").mkdir(exist_ok=True)
+    (root / "150" / "img0.png").write_bytes(b"scaled" * 100)
+    return root
+
+
+def entries(path: Path):
+    """The entries of an archive, without their timestamps"""
+    return {
+        name: (e.compress_type, e.CRC, e.file_size, e.external_attr, e.data)
+        for name, e in read_entries(path).items()
+    }
+
+
+def build(theme: Path, output: Path, *, incremental: bool):
+    project = Project(theme)
+    manifest_path = output.with_suffix(".manifest.json")
+    if incremental:
+        project.manifest = BuildManifest.load(manifest_path)
+    report = project.build(output)
+    if incremental:
+        project.manifest.save(manifest_path)
+    return report
+
+
+def spy_compressed(monkeypatch, theme: Path):
+    """Record the resources that are compressed, rather than copied, by each build"""
+    compressed: list[str] = []
+    compress_files = theme_module.compress_files
+
+    def spy(paths, *args, **kwargs):
+        compressed.extend(Path(p).relative_to(theme).as_posix() for p in paths)
+        return compress_files(paths, *args, **kwargs)
+
+    monkeypatch.setattr(theme_module, "compress_files", spy)
+    return compressed
+
+
+def fresh_entries(theme: Path, tmp_path: Path, name: str):
+    """Build the theme from scratch, into an archive with the same name"""
+    fresh = tmp_path / "fresh" / name
+    fresh.parent.mkdir(exist_ok=True)
+    build(theme, fresh, incremental=False)
+    return entries(fresh)
+
+
+def test_reused_entries_match_a_fresh_build(tmp_path, monkeypatch):
+    theme = write_theme_folder(tmp_path / "theme")
+    output = tmp_path / "Test.ReaperThemeZip"
+
+    assert build(theme, output, incremental=True).reused == 0
+    (theme / "img1.png").write_bytes(b"changed" * 50)
+    (theme / "img9.png").write_bytes(b"added" * 50)
+
+    compressed = spy_compressed(monkeypatch, theme)
+    report = build(theme, output, incremental=True)
+    assert report.reused == 5
+    assert sorted(compressed) == ["img1.png", "img9.png"]
+    assert entries(output) == fresh_entries(theme, tmp_path, output.name)
+
+
+def test_overwritten_archive_is_not_reused(tmp_path, monkeypatch):
+    theme = write_theme_folder(tmp_path / "theme")
+    other = write_theme_folder(tmp_path / "other", seed=1)
+    output = tmp_path / "Test.ReaperThemeZip"
+
+    build(theme, output, incremental=True)
+    # a build without -i replaces the archive, but not the manifest
+    build(other, output, incremental=False)
+
+    compressed = spy_compressed(monkeypatch, theme)
+    report = build(theme, output, incremental=True)
+    # only 150/img0.png is the same in both themes
+    assert report.reused == 1
+    assert sorted(compressed) == [f"img{i}.png" for i in range(5)]
+    assert entries(output) == fresh_entries(theme, tmp_path, output.name)
+
+
+def test_unsupported_compression_is_not_reused(tmp_path, monkeypatch):
+    theme = write_theme_folder(tmp_path / "theme")
+    output = tmp_path / "Test.ReaperThemeZip"
+    build(theme, output, incremental=True)
+
+    # another tool stored an entry with a method the builder doesn't write
+    previous = read_entries(output)
+    with zipfile.ZipFile(output, "w") as z:
+        for name, entry in previous.items():
+            if name.endswith("img2.png"):
+                data = archive.decompress(entry)
+                z.writestr(name, data, compress_type=zipfile.ZIP_BZIP2)
+            else:
+                archive.write_entry(z, name, entry)
+
+    bzip2 = read_entries(output)["Test/img2.png"]
+    with pytest.raises(zipfile.BadZipFile):
+        archive.decompress(bzip2)
+
+    compressed = spy_compressed(monkeypatch, theme)
+    report = build(theme, output, incremental=True)
+    assert report.reused == 5
+    assert compressed == ["img2.png"]
+    assert entries(output) == fresh_entries(theme, tmp_path, output.name)
+
+
+def test_write_entry_without_zipfile_internals(tmp_path, monkeypatch):
+    theme = write_theme_folder(tmp_path / "theme")
+    output = tmp_path / "Test.ReaperThemeZip"
+    build(theme, output, incremental=True)
+
+    # entries are compressed again instead of copied, so only compare the contents
+    monkeypatch.setattr(archive, "_can_write_raw", lambda z: False)
+    (theme / "img1.png").write_bytes(b"changed" * 50)
+    build(theme, output, incremental=True)
+
+    fresh = tmp_path / "fresh" / output.name
+    fresh.parent.mkdir()
+    build(theme, fresh, incremental=False)
+
+    def contents(path):
+        return {name: archive.decompress(e) for name, e in read_entries(path).items()}
+
+    assert contents(output) == contents(fresh)
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from reaper_theme_builder.lib.server import (
+    LOCAL_HOSTS,
+    BuildServer,
+    RequestError,
+    _WarmProject,
+    check_headers,
+    parse_request,
+    write_token,
+)
+
+HEADERS = {"host": "localhost:8765", "content-type": "application/json"}
+
+
+def test_token_is_required(tmp_path):
+    token = write_token(tmp_path / "serve.token")
+    assert (tmp_path / "serve.token").read_text() == token
+    assert (tmp_path / "serve.token").stat().st_mode & 0o777 == 0o600
+
+    headers = {**HEADERS, "authorization": f"Bearer {token}"}
+    check_headers("POST", headers, LOCAL_HOSTS, token)
+    for authorization in (None, "Bearer", f"Basic {token}", f"Bearer {token}x"):
+        headers = dict(HEADERS)
+        if authorization is not None:
+            headers["authorization"] = authorization
+        with pytest.raises(RequestError) as e:
+            check_headers("POST", headers, LOCAL_HOSTS, token)
+        assert e.value.status == 401
+
+
+def test_local_requests_only():
+    check_headers("POST", HEADERS, LOCAL_HOSTS)
+    for headers, status in (
+        ({**HEADERS, "host": "evil.example:8765"}, 403),
+        ({**HEADERS, "origin": "https://evil.example"}, 403),
+        ({**HEADERS, "content-type": "text/plain"}, 415),
+    ):
+        with pytest.raises(RequestError) as e:
+            check_headers("POST", headers, LOCAL_HOSTS)
+        assert e.value.status == status
+
+
+def make_projects(server: BuildServer, tmp_path, count: int):
+    """Add warm projects to a server without building them, oldest first"""
+    projects = []
+    for i in range(count):
+        folder = tmp_path / f"theme{i}"
+        folder.mkdir()
+        request = parse_request({"input": str(folder)})
+        warm = _WarmProject(request, jobs=1, cache_dir=None, verbose=False)
+        server._projects[request.project_key()] = warm
+        projects.append(warm)
+    return projects
+
+
+def test_least_recently_used_projects_are_closed(tmp_path):
+    server = BuildServer(max_projects=2, idle_timeout=None)
+    try:
+        projects = make_projects(server, tmp_path, 4)
+        assert server.evict() == 2
+        assert list(server._projects.values()) == projects[2:]
+    finally:
+        server.close()
+
+
+def test_idle_projects_are_closed(tmp_path):
+    server = BuildServer(idle_timeout=60)
+    try:
+        projects = make_projects(server, tmp_path, 3)
+        projects[0].last_used -= 120
+        projects[2].last_used -= 120
+        # the most recently requested project is kept
+        assert server.evict() == 1
+        assert list(server._projects.values()) == projects[1:]
+    finally:
+        server.close()
+
+
+def test_building_projects_are_kept(tmp_path):
+    server = BuildServer(max_projects=1, idle_timeout=None)
+
+    async def evict_while_building():
+        async with projects[0].lock:
+            return server.evict()
+
+    try:
+        projects = make_projects(server, tmp_path, 3)
+        assert asyncio.run(evict_while_building()) == 1
+        assert list(server._projects.values()) == [projects[0], projects[2]]
+    finally:
+        server.close()
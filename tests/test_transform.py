@@ -0,0 +1,27 @@
+from reaper_theme_builder.lib.transform import Transform, TransformSpec
+
+RED = (255, 0, 0)
+
+
+def test_tints_apply_to_every_variant():
+    spec = TransformSpec(sizes=["150", "200"], tints={"meter_*.png": RED})
+    filemap = [
+        ("src/meter_a.png", "meter_a.png"),
+        # a hand-made variant, only the 200% one is generated
+        ("src/150/meter_a.png", "150/meter_a.png"),
+        ("src/other.png", "other.png"),
+    ]
+    scale = ("scale", 2.0, "lanczos")
+    assert spec.plan(filemap) == [
+        Transform("src/meter_a.png", (("tint", RED),), "meter_a.png"),
+        Transform("src/150/meter_a.png", (("tint", RED),), "150/meter_a.png"),
+        Transform("src/meter_a.png", (scale, ("tint", RED)), "200/meter_a.png"),
+        Transform("src/other.png", (("scale", 1.5, "lanczos"),), "150/other.png"),
+        Transform("src/other.png", (scale,), "200/other.png"),
+    ]
+
+
+def test_tints_for_one_folder():
+    spec = TransformSpec(tints={"150/*.png": RED})
+    filemap = [("a.png", "a.png"), ("150/a.png", "150/a.png")]
+    assert spec.plan(filemap) == [Transform("150/a.png", (("tint", RED),), "150/a.png")]
@@ -0,0 +1,197 @@
+from itertools import zip_longest
+
+from reaper_theme_builder.lib.val.funcs import set as set_code
+from reaper_theme_builder.lib.walter import SET_TEMPORARIES, optimize
+
+_OPERATORS = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": lambda a, b: a // b,
+}
+
+
+def _evaluate(tokens: list[str], pos: int, env: dict):
+    """Evaluate the prefix expression at `pos`, returns the value and the next pos"""
+    token = tokens[pos]
+    if token in _OPERATORS:
+        a, pos = _evaluate(tokens, pos + 1, env)
+        b, pos = _evaluate(tokens, pos, env)
+        op = _OPERATORS[token]
+        if isinstance(a, tuple) or isinstance(b, tuple):
+            a = a if isinstance(a, tuple) else (a,)
+            b = b if isinstance(b, tuple) else (b,)
+            return tuple(op(x, y) for x, y in zip_longest(a, b, fillvalue=0)), pos
+        return op(a, b), pos
+
+    if token == "[":
+        items = []
+        pos += 1
+        while tokens[pos] != "]":
+            value, pos = _evaluate(tokens, pos, env)
+            items.append(value)
+        return tuple(items), pos + 1
+
+    if token.lstrip("-").isdigit():
+        return int(token), pos + 1
+    return env.get(token, 0), pos + 1
+
+
+def run(text: str):
+    """Run the `set` lines of a WALTER program, returns the variables it assigns"""
+    env: dict = {}
+    for line in text.split("\n"):
+        tokens = line.replace("[", " [ ").replace("]", " ] ").split()
+        if len(tokens) >= 3 and tokens[0] == "set":
+            env[tokens[1]], _ = _evaluate(tokens, 2, env)
+    return {k: v for k, v in env.items() if k not in SET_TEMPORARIES}
+
+
+def same_behaviour(text: str, result: str):
+    """Whether the optimized code leaves the same values in the variables it keeps"""
+    before = run(text)
+    after = run(result)
+    return {k: after.get(k) for k in before} == before
+
+
+def test_set_temporaries():
+    # every temporary `set()` can make is known to the optimizer
+    code = set_code(
+        "tcp.x", *["+ a 1"] * 8, condition="a", inherit=True, add="[1]", sub="[2]"
+    )
+    assigned = {line.split()[1] for line in code.split("\n")[:-1]}
+    assert len(assigned) == 8
+    assert assigned <= SET_TEMPORARIES
+
+
+def test_constant_folding():
+    result, stats = optimize("set a + 1 * 2 3\nset b [+ 1 2 3]\nset c - 1 2")
+    # lists and negative results are left alone
+    assert result == "set a 7\nset b [+ 1 2 3]\nset c - 1 2"
+    assert stats.folded == 2
+
+
+def test_division_is_only_folded_when_exact():
+    result, _ = optimize("set a / 6 3\nset b / 7 2\nset c / 1 0")
+    assert result == "set a 2\nset b / 7 2\nset c / 1 0"
+
+
+def test_aliases():
+    text = "set __x 5\nset a [__x __x]\nset __x + b 1\nset c [__x 0]"
+    result, stats = optimize(text)
+    assert result == "set a [5 5]\nset _a + b 1\nset c [_a 0]"
+    assert stats.removed == 1
+    assert same_behaviour(text, result)
+
+
+def test_alias_to_reassigned_value():
+    # __y can't stand for __x, as __x changes before __y is assigned again
+    text = "set __x + a 1\nset __y __x\nset __x 2\nset b [__y __x]\nset __y 0"
+    result, _ = optimize(text)
+    assert same_behaviour(text, result)
+    assert "set _" in result.split("\n")[1]
+
+
+def test_same_expression():
+    text = "set __x + a 1\nset b [__x]\nset __x + a 1\nset c [__x]\nset __x 0"
+    result, stats = optimize(text)
+    assert stats.removed == 1
+    assert result.count("+ a 1") == 1
+    assert same_behaviour(text, result)
+
+
+def test_assignment_changes_held_expression():
+    text = "set __x + a 1\nset b [__x]\nset a 5\nset __x + a 1\nset c [__x]"
+    result, _ = optimize(text)
+    assert result.count("+ a 1") == 2
+    assert same_behaviour(text, result)
+
+
+def test_dead_temporaries():
+    text = "set __x + a 1\nset __x + a 2\nset b [__x]"
+    result, stats = optimize(text)
+    assert result == "set _a + a 2\nset b [_a]"
+    assert stats.removed == 1
+    assert same_behaviour(text, result)
+
+
+def test_generated_code():
+    text = "\n".join(
+        [
+            "set a 4",
+            set_code("tcp.mute", "+ a 1", "* a 2", "10", "+ 1 1"),
+            set_code("tcp.solo", "+ a 1", "* a 3", add="[1 1]"),
+            set_code("tcp.recarm", x="- a 1", w="+ a 1"),
+            "set a 7",
+            set_code("tcp.fx", "+ a 1", "* a 2", "- a 3", "+ a 4"),
+        ]
+    )
+    result, stats = optimize(text)
+    assert stats.bytes_out < stats.bytes_in
+    assert "__" not in result
+    assert same_behaviour(text, result)
+
+
+def test_layouts_end_blocks():
+    # the layout may read __x, so it isn't a temporary
+    text = "set __x + a 1\nLayout \"A\"\nset b [__x]\nEndLayout\nset __x 0"
+    result, stats = optimize(text)
+    assert result == text
+    assert stats == (0, 0, 0, len(text), len(text))
+
+
+def test_read_before_assignment():
+    # __w is read before it is assigned in the block, so it may come from elsewhere
+    text = "set a [__w]\nset __w + b 1\nset __w 0\nset c [__w]"
+    result, _ = optimize(text)
+    assert result == text
+
+
+def test_macros():
+    text = "\n".join(
+        [
+            "macro m __x",
+            "set __x + __x 1",
+            "set __x + __x 1",
+            "endmacro",
+            "set __y + a 1",
+            "set b [__y]",
+        ]
+    )
+    result, _ = optimize(text)
+    lines = result.split("\n")
+    # nothing in the macro is changed, and __x isn't renamed outside of it either
+    assert lines[:4] == text.split("\n")[:4]
+    assert lines[4:] == ["set _a + a 1", "set b [_a]"]
+
+
+def test_user_variables_are_kept():
+    # only the names made by set() can be temporaries
+    text = "set __mine + a 1\nset __mine 2\nset b [__mine]"
+    result, stats = optimize(text)
+    assert result == text
+    assert stats.removed == 0 and stats.renamed == 0
+
+
+def test_quoted_strings():
+    text = "set __x + a 1\nset b [__x]\nset c \"__x  [ 1 ]\""
+    result, _ = optimize(text)
+    # __x is read in a string, so it isn't a temporary, and the string is kept as is
+    assert result == text
+
+    text = "set __x + a 1\nset b [__x]\nset c 'x  y'"
+    result, _ = optimize(text)
+    assert result == "set _a + a 1\nset b [_a]\nset c 'x  y'"
+
+
+def test_renamed_names_are_unused():
+    text = "set _a 1\nset __x + _a 1\nset b [__x _a]"
+    result, stats = optimize(text)
+    assert stats.renamed == 1
+    assert "set _b + _a 1" in result
+    assert same_behaviour(text, result)
+
+
+def test_whitespace():
+    result, _ = optimize("  set   a  [ 1   2 ]  \n\nset b 1")
+    assert result == "set a [1 2]\n\nset b 1"